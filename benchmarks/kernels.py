@@ -0,0 +1,69 @@
+"""
+Benchmark: the NumPy, Numba kernels of simulation.kernels vs. the interpreted code they replace
+
+- path pricing: DEX.update_price_for_symbol with the per-path loop, numpy and numba kernels
+- amounts out: DEX.get_v2_amounts_out (exact, Python ints) vs. DEX.estimate_amounts_out on V2 only swap paths
+
+numba is skipped if Numba isn't installed (pip install numba).
+The compiled kernels are cached in simulation/__pycache__, the first run includes compiling them
+
+Run from the repository root:
+
+python -m benchmarks.kernels
+"""
+import numpy as np
+
+from benchmarks.utils import synthetic_market, OfflineDEX, timeit
+from simulation.kernels import NUMBA_AVAILABLE, NumpyKernels, NumbaKernels
+
+BACKENDS = [NumpyKernels, NumbaKernels] if NUMBA_AVAILABLE else [NumpyKernels]
+
+
+def run(n_pools: int, symbol: str = 'ETH/USDT', max_swap_number: int = 3, n_amounts: int = 10):
+    tokens, pools, storage = synthetic_market(n_pools)
+    chain = list(tokens.keys())[0]
+
+    dex = OfflineDEX(tokens, pools, storage, [symbol], max_swap_number)
+    index = dex.price_index[symbol]
+    n_paths = index['hop_rows'].shape[0]
+
+    dex.batch_pricing = False
+    loop_took = timeit(lambda: dex.update_price_for_symbol(chain, symbol), number=10)
+    loop_price = dex.swap_paths[symbol]['price'].copy()
+
+    dex.batch_pricing = True
+    line = f'{n_pools:>6} pools | {n_paths:>6} paths | pricing   loop: {loop_took * 1000:9.3f} ms'
+
+    for kernels in BACKENDS:
+        dex.kernels = kernels
+        took = timeit(lambda: dex.update_price_for_symbol(chain, symbol), number=100)
+        assert np.allclose(dex.swap_paths[symbol]['price'], loop_price, rtol=1e-12)
+        line += f' | {kernels.name}: {took * 1000:7.3f} ms (x{loop_took / took:.1f})'
+
+    print(line)
+
+    v2_rows = np.flatnonzero(np.all(index['hop_v2'] | ~index['hop_mask'], axis=1))
+    amounts_in = [10 ** 9 * 2 ** i for i in range(n_amounts)]
+
+    exact = dex.get_v2_amounts_out(symbol, v2_rows, amounts_in)
+    exact_took = timeit(lambda: dex.get_v2_amounts_out(symbol, v2_rows, amounts_in), number=10)
+
+    line = f'{n_pools:>6} pools | {len(v2_rows):>6} paths | amounts  exact: {exact_took * 1000:9.3f} ms'
+
+    for kernels in BACKENDS:
+        dex.kernels = kernels
+        estimates = dex.estimate_amounts_out(symbol, v2_rows, amounts_in)
+        took = timeit(lambda: dex.estimate_amounts_out(symbol, v2_rows, amounts_in), number=100)
+        # exact amounts are rounded down on every hop, which shows in amounts of few units
+        assert np.allclose(estimates, exact.astype(np.float64), rtol=1e-5)
+        line += f' | {kernels.name}: {took * 1000:7.3f} ms (x{exact_took / took:.1f})'
+
+    print(line)
+
+
+if __name__ == '__main__':
+    if not NUMBA_AVAILABLE:
+        print('Numba is not installed, only the numpy kernels are benchmarked')
+
+    for n in [10, 100, 1000]:
+        run(n)
@@ -0,0 +1,535 @@
+"""
+A local stand-in for the JSON-RPC/websocket node of a chain, for end-to-end benchmarks without real endpoints
+
+It answers what DEX.load and DexStream need from a node:
+- eth_call: Multicall aggregate/tryBlockAndAggregate of getReserves, slot0, liquidity, tickSpacing, tickBitmap, ticks
+  (or the same calls sent to the pools directly)
+- eth_subscribe: newHeads, logs (Sync of Uniswap V2, Swap of Uniswap V3 pools, filtered by address and topics)
+- eth_getLogs: of the last max_logs logs generated
+- eth_chainId, net_version, eth_blockNumber, eth_getBlockByNumber
+
+Pool states start from storage values in the format of DexBase._fetch_pool_data (ex. benchmarks.utils.synthetic_market)
+and follow a mean reverting random walk. Events are generated at events_per_second across all pools
+and a new block is produced every block_time seconds.
+Nothing else is executed: contract simulations (OnlineSimulator) and transactions (DexOrder) aren't supported
+
+HTTP and websocket requests are served on the same port, run from the repository root:
+
+python -m benchmarks.local_node [--pools 200] [--events-per-second 500] [--block-time 12] [--port 8545]
+
+The pools served are benchmarks.utils.synthetic_market(pools, seed=seed), load DEX with the same pools
+"""
+import math
+import json
+import time
+import random
+import asyncio
+import argparse
+import eth_abi
+import eth_utils
+import threading
+from collections import deque
+from aiohttp import web, WSMsgType
+from typing import Any, Dict, List, Optional
+
+from benchmarks.utils import synthetic_market
+from data.dex_streams import SYNC_EVENT_SELECTOR, SWAP_EVENT_SELECTOR
+from data.utils import calculate_next_block_base_fee
+from simulation.uniswap_v3_math import (
+    FEE_TO_TICK_SPACING,
+    get_tick_at_sqrt_ratio,
+    compress_tick,
+    tick_position,
+)
+
+
+def selector(signature: str) -> bytes:
+    return eth_utils.function_signature_to_4byte_selector(signature)
+
+
+AGGREGATE = selector('aggregate((address,bytes)[])')
+TRY_BLOCK_AND_AGGREGATE = selector('tryBlockAndAggregate(bool,(address,bytes)[])')
+
+GET_RESERVES = selector('getReserves()')
+SLOT0 = selector('slot0()')
+LIQUIDITY = selector('liquidity()')
+TICK_SPACING = selector('tickSpacing()')
+TICK_BITMAP = selector('tickBitmap(int16)')
+TICKS = selector('ticks(int24)')
+
+ZERO_TOPIC = '0x' + '00' * 32
+
+
+class ExecutionReverted(Exception):
+    pass
+
+
+class SyntheticChain:
+    """
+    Pool states of a single chain, and the blocks and logs generated from them
+    """
+
+    def __init__(self,
+                 tokens: Dict[str, Dict[str, List[str or int]]],
+                 pools: List[Dict[str, Any]],
+                 storage: Dict[str, Any],
+                 chain: str = 'ethereum',
+                 volatility: float = 0.0001,
+                 v3_depth: int = 10 ** 4,
+                 v3_position_width: int = 100,
+                 start_block: int = 17000000,
+                 max_logs: int = 100000,
+                 seed: int = 0):
+        """
+        :param tokens, pools: in the format of data.dex.DEX
+        :param storage: initial storage values, in the format of the value returned from DexBase._fetch_pool_data
+                        the ticks in V3 slot0 values are ignored and calculated from sqrtPriceX96
+
+        :param volatility: standard deviation of the log price change of a pool per event
+        :param v3_depth: amount of token0 (in token units) a Uniswap V3 pool holds at its initial price
+        :param v3_position_width: a single position is placed on each Uniswap V3 pool
+                                  from v3_position_width tick spacings below the current tick to as many above
+        :param max_logs: the number of the latest logs kept for eth_getLogs
+        """
+        self.chain = chain
+        self.volatility = volatility
+        self.rng = random.Random(seed)
+
+        self.block_number = start_block
+        self.base_fee = 30 * 10 ** 9
+        self.gas_limit = 30000000
+        self.gas_used = self.gas_limit // 2
+        self.log_index = 0
+
+        # the latest logs generated, oldest first
+        self.logs = deque(maxlen=max_logs)
+
+        """
+        State of each pool by lowercase address
+        - V2: reserve0, reserve1, k
+        - V3: sqrt_price, tick, liquidity, tick_spacing, tick_bitmap, ticks
+        x is the deviation of the log price from the initial price
+        """
+        self.pools = {}
+
+        for pool_idx, pool in enumerate(pools):
+            if pool['chain'] != chain:
+                continue
+
+            values = storage[str(pool_idx)]
+            state = {'version': pool['version'], 'x': 0.0}
+
+            if pool['version'] == 2:
+                state['reserve0'], state['reserve1'] = values[0], values[1]
+                state['k'] = values[0] * values[1]
+                state['initial_price'] = values[1] / values[0]
+            else:
+                sqrt_price = values[0]
+                tick = get_tick_at_sqrt_ratio(sqrt_price)
+                tick_spacing = FEE_TO_TICK_SPACING[pool['fee']]
+                decimals0 = tokens[chain][pool['token0']][1]
+                liquidity = int(v3_depth * 10 ** decimals0 * sqrt_price / 2 ** 96)
+
+                lower = (compress_tick(tick, tick_spacing) - v3_position_width) * tick_spacing
+                upper = (compress_tick(tick, tick_spacing) + v3_position_width) * tick_spacing
+
+                tick_bitmap = {}
+                for t in [lower, upper]:
+                    word_pos, bit_pos = tick_position(compress_tick(t, tick_spacing))
+                    tick_bitmap[word_pos] = tick_bitmap.get(word_pos, 0) | (1 << bit_pos)
+
+                state.update({
+                    'sqrt_price': sqrt_price,
+                    'initial_sqrt_price': sqrt_price,
+                    'tick': tick,
+                    'liquidity': liquidity,
+                    'tick_spacing': tick_spacing,
+                    'tick_bitmap': tick_bitmap,
+                    'ticks': {lower: (liquidity, liquidity), upper: (liquidity, -liquidity)},
+                })
+
+            self.pools[pool['address'].lower()] = state
+
+        self.addresses = list(self.pools.keys())
+
+    def new_block(self) -> Dict[str, Any]:
+        """
+        Moves on to the next block, the base fee follows EIP-1559 with a random gas usage
+        """
+        self.base_fee = int(calculate_next_block_base_fee(self.header()))
+        self.gas_used = self.rng.randint(0, self.gas_limit)
+        self.block_number += 1
+        self.log_index = 0
+        return self.header()
+
+    def header(self) -> Dict[str, Any]:
+        return {
+            'number': hex(self.block_number),
+            'hash': '0x' + self.block_number.to_bytes(32, 'big').hex(),
+            'parentHash': '0x' + (self.block_number - 1).to_bytes(32, 'big').hex(),
+            'timestamp': hex(int(time.time())),
+            'gasLimit': hex(self.gas_limit),
+            'gasUsed': hex(self.gas_used),
+            'baseFeePerGas': hex(self.base_fee),
+        }
+
+    def next_log(self) -> Dict[str, Any]:
+        """
+        Moves the price of a random pool and returns the log the pool emits: Sync (V2), Swap (V3)
+        """
+        address = self.rng.choice(self.addresses)
+        state = self.pools[address]
+
+        # AR(1) process keeps prices around their initial values
+        state['x'] = 0.98 * state['x'] + self.rng.gauss(0, self.volatility)
+
+        if state['version'] == 2:
+            price = state['initial_price'] * math.exp(state['x'])
+            state['reserve0'] = int(math.sqrt(state['k'] / price))
+            state['reserve1'] = int(math.sqrt(state['k'] * price))
+
+            topics = [SYNC_EVENT_SELECTOR]
+            data = eth_abi.encode(['uint112', 'uint112'], [state['reserve0'], state['reserve1']])
+        else:
+            sqrt_price = state['sqrt_price']
+            new_sqrt_price = int(state['initial_sqrt_price'] * math.exp(state['x'] / 2))
+            liquidity = state['liquidity']
+
+            # amounts the pool received (+) or sent (-)
+            amount0 = liquidity * 2 ** 96 // new_sqrt_price - liquidity * 2 ** 96 // sqrt_price
+            amount1 = liquidity * (new_sqrt_price - sqrt_price) // 2 ** 96
+
+            state['sqrt_price'] = new_sqrt_price
+            state['tick'] = get_tick_at_sqrt_ratio(new_sqrt_price)
+
+            topics = [SWAP_EVENT_SELECTOR, ZERO_TOPIC, ZERO_TOPIC]
+            data = eth_abi.encode(['int256', 'int256', 'uint160', 'uint128', 'int24'],
+                                  [amount0, amount1, new_sqrt_price, liquidity, state['tick']])
+
+        log_index = self.log_index
+        self.log_index += 1
+
+        log = {
+            'address': address,
+            'topics': topics,
+            'data': eth_utils.encode_hex(data),
+            'blockNumber': hex(self.block_number),
+            'transactionHash': '0x' + self.rng.getrandbits(256).to_bytes(32, 'big').hex(),
+            'transactionIndex': hex(log_index),
+            'blockHash': '0x' + self.block_number.to_bytes(32, 'big').hex(),
+            'logIndex': hex(log_index),
+            'removed': False,
+        }
+        self.logs.append(log)
+        return log
+
+    def get_logs(self, log_filter: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        eth_getLogs filter: fromBlock, toBlock (hex or 'latest'), address, topics (refer to log_matches)
+        """
+
+        def _block(tag: str) -> int:
+            return self.block_number if tag in [None, 'latest', 'pending', 'safe', 'finalized'] else int(tag, 16)
+
+        from_block, to_block = _block(log_filter.get('fromBlock')), _block(log_filter.get('toBlock'))
+        return [log for log in self.logs
+                if from_block <= int(log['blockNumber'], 16) <= to_block and log_matches(log_filter, log)]
+
+    def call(self, to: str, data: bytes) -> bytes:
+        """
+        Executes an eth_call on the Multicall contract or on a pool
+        """
+        func, args = data[:4], data[4:]
+
+        if func == AGGREGATE:
+            calls = eth_abi.decode(['(address,bytes)[]'], args)[0]
+            results = [self.call(target, call_data) for target, call_data in calls]
+            return eth_abi.encode(['uint256', 'bytes[]'], [self.block_number, results])
+
+        if func == TRY_BLOCK_AND_AGGREGATE:
+            require_success, calls = eth_abi.decode(['bool', '(address,bytes)[]'], args)
+            results = []
+            for target, call_data in calls:
+                try:
+                    results.append((True, self.call(target, call_data)))
+                except ExecutionReverted:
+                    if require_success:
+                        raise
+                    results.append((False, b''))
+            block_hash = self.block_number.to_bytes(32, 'big')
+            return eth_abi.encode(['uint256', 'bytes32', '(bool,bytes)[]'], [self.block_number, block_hash, results])
+
+        state = self.pools.get(to.lower())
+
+        if state is None:
+            raise ExecutionReverted
+
+        if state['version'] == 2:
+            if func == GET_RESERVES:
+                return eth_abi.encode(['uint112', 'uint112', 'uint32'], [state['reserve0'], state['reserve1'], 0])
+        else:
+            if func == SLOT0:
+                return eth_abi.encode(['uint160', 'int24', 'uint16', 'uint16', 'uint16', 'uint8', 'bool'],
+                                      [state['sqrt_price'], state['tick'], 0, 1, 1, 0, True])
+            if func == LIQUIDITY:
+                return eth_abi.encode(['uint128'], [state['liquidity']])
+            if func == TICK_SPACING:
+                return eth_abi.encode(['int24'], [state['tick_spacing']])
+            if func == TICK_BITMAP:
+                word_pos = eth_abi.decode(['int16'], args)[0]
+                return eth_abi.encode(['uint256'], [state['tick_bitmap'].get(word_pos, 0)])
+            if func == TICKS:
+                tick = eth_abi.decode(['int24'], args)[0]
+                gross, net = state['ticks'].get(tick, (0, 0))
+                return eth_abi.encode(['uint128', 'int128', 'uint256', 'uint256', 'int56', 'uint160', 'uint32', 'bool'],
+                                      [gross, net, 0, 0, 0, 0, 0, gross > 0])
+
+        raise ExecutionReverted
+
+
+def log_matches(log_filter: Dict[str, Any], log: Dict[str, Any]) -> bool:
+    """
+    eth_subscribe logs filter: address is a single address or a list of them,
+    topics[i] is None (any), a single topic, or a list of topics that are OR'ed
+    """
+    addresses = log_filter.get('address')
+    if addresses is not None:
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        if log['address'] not in [a.lower() for a in addresses]:
+            return False
+
+    for i, topics in enumerate(log_filter.get('topics') or []):
+        if topics is None:
+            continue
+        if i >= len(log['topics']):
+            return False
+        if isinstance(topics, str):
+            topics = [topics]
+        if log['topics'][i] not in topics:
+            return False
+
+    return True
+
+
+class LocalNode:
+    """
+    Serves a SyntheticChain over HTTP and websocket JSON-RPC, and streams its blocks and logs to subscribers
+
+    ex) node = LocalNode(SyntheticChain(tokens, pools, storage), events_per_second=500, port=8545)
+        node.run()  # or node.start_thread() from a synchronous program, both take an optional duration
+
+        dex = DEX({'ethereum': node.http_url}, tokens, pools, trading_symbols)
+        dex_stream = DexStream(dex, {'ethereum': node.ws_url}, publisher)
+    """
+
+    def __init__(self,
+                 synthetic_chain: SyntheticChain,
+                 chain_id: int = 1,
+                 events_per_second: float = 50.0,
+                 block_time: float = 12.0,
+                 host: str = '127.0.0.1',
+                 port: int = 8545):
+        self.synthetic_chain = synthetic_chain
+        self.chain_id = chain_id
+        self.events_per_second = events_per_second
+        self.block_time = block_time
+        self.host = host
+        self.port = port
+
+        # websocket -> {subscription id: (kind, filter)}
+        self.subscriptions: Dict[web.WebSocketResponse, Dict[str, tuple]] = {}
+        self.subscription_count = 0
+
+        self.events_sent = 0
+        self.runner: Optional[web.AppRunner] = None
+        self.producer: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.started = threading.Event()
+
+    @property
+    def http_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def ws_url(self) -> str:
+        return f'ws://{self.host}:{self.port}'
+
+    def rpc(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        method = request.get('method')
+        params = request.get('params') or []
+        chain = self.synthetic_chain
+
+        response = {'jsonrpc': '2.0', 'id': request.get('id')}
+
+        try:
+            if method == 'eth_chainId':
+                response['result'] = hex(self.chain_id)
+            elif method == 'net_version':
+                response['result'] = str(self.chain_id)
+            elif method == 'eth_blockNumber':
+                response['result'] = hex(chain.block_number)
+            elif method == 'eth_getBlockByNumber':
+                response['result'] = chain.header()
+            elif method == 'eth_getLogs':
+                response['result'] = chain.get_logs(params[0])
+            elif method == 'eth_call':
+                # block numbers and state overrides are ignored: calls are always run on the latest state
+                tx = params[0]
+                data = eth_utils.decode_hex(tx.get('data') or tx.get('input') or '0x')
+                response['result'] = eth_utils.encode_hex(chain.call(tx.get('to', ''), data))
+            else:
+                response['error'] = {'code': -32601, 'message': f'the method {method} does not exist/is not available'}
+        except ExecutionReverted:
+            response['error'] = {'code': -32000, 'message': 'execution reverted'}
+
+        return response
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        if request.headers.get('Upgrade', '').lower() == 'websocket':
+            return await self.handle_websocket(request)
+
+        body = await request.json(loads=json.loads)
+
+        if isinstance(body, list):
+            return web.json_response([self.rpc(r) for r in body])
+
+        return web.json_response(self.rpc(body))
+
+    async def handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        self.subscriptions[ws] = {}
+
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+
+                request = json.loads(msg.data)
+                method = request.get('method')
+                params = request.get('params') or []
+
+                if method == 'eth_subscribe':
+                    self.subscription_count += 1
+                    subscription_id = hex(self.subscription_count)
+                    kind = params[0]
+                    log_filter = params[1] if len(params) > 1 else {}
+                    self.subscriptions[ws][subscription_id] = (kind, log_filter)
+                    response = {'jsonrpc': '2.0', 'id': request.get('id'), 'result': subscription_id}
+                elif method == 'eth_unsubscribe':
+                    removed = self.subscriptions[ws].pop(params[0], None) is not None
+                    response = {'jsonrpc': '2.0', 'id': request.get('id'), 'result': removed}
+                else:
+                    response = self.rpc(request)
+
+                await ws.send_str(json.dumps(response))
+        finally:
+            self.subscriptions.pop(ws, None)
+
+        return ws
+
+    async def broadcast(self, kind: str, result: Dict[str, Any]):
+        for ws, subscriptions in list(self.subscriptions.items()):
+            for subscription_id, (sub_kind, log_filter) in subscriptions.items():
+                if sub_kind != kind or (kind == 'logs' and not log_matches(log_filter, result)):
+                    continue
+                try:
+                    await ws.send_str(json.dumps({
+                        'jsonrpc': '2.0',
+                        'method': 'eth_subscription',
+                        'params': {'subscription': subscription_id, 'result': result},
+                    }))
+                except ConnectionResetError:
+                    self.subscriptions.pop(ws, None)
+                    break
+
+    async def produce(self):
+        """
+        Sends the logs due at events_per_second every millisecond, and a new block every block_time seconds
+        """
+        start = time.time()
+        next_block = start + self.block_time
+        produced = 0
+
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.time()
+
+            if now >= next_block:
+                await self.broadcast('newHeads', self.synthetic_chain.new_block())
+                next_block += self.block_time
+
+            due = int((now - start) * self.events_per_second) - produced
+            for _ in range(due):
+                await self.broadcast('logs', self.synthetic_chain.next_log())
+            produced += due
+            self.events_sent += due
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/', self.handle)
+
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+        self.producer = asyncio.ensure_future(self.produce())
+        self.loop = asyncio.get_event_loop()
+        self.started.set()
+
+    async def stop(self):
+        if self.producer:
+            self.producer.cancel()
+        for ws in list(self.subscriptions):
+            await ws.close()
+        if self.runner:
+            await self.runner.cleanup()
+
+    def run(self, duration: Optional[float] = None):
+        """
+        Serves until interrupted, or for duration seconds.
+        Subscribers are disconnected when the node stops, which ends DexStream.stream_events
+        """
+
+        async def _run():
+            await self.start()
+            if duration is None:
+                await asyncio.Event().wait()
+            else:
+                await asyncio.sleep(duration)
+                await self.stop()
+
+        asyncio.run(_run())
+
+    def start_thread(self, duration: Optional[float] = None) -> threading.Thread:
+        """
+        Serves from a daemon thread with its own event loop, returns when the node is ready
+        """
+        thread = threading.Thread(target=self.run, args=(duration,), daemon=True)
+        thread.start()
+        self.started.wait()
+        return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pools', type=int, default=200)
+    parser.add_argument('--events-per-second', type=float, default=50.0)
+    parser.add_argument('--block-time', type=float, default=12.0)
+    parser.add_argument('--chain-id', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8545)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--duration', type=float, default=None)
+    args = parser.parse_args()
+
+    tokens, pools, storage = synthetic_market(args.pools, seed=args.seed)
+
+    node = LocalNode(SyntheticChain(tokens, pools, storage, seed=args.seed),
+                     chain_id=args.chain_id,
+                     events_per_second=args.events_per_second,
+                     block_time=args.block_time,
+                     port=args.port)
+
+    print(f'Serving {len(pools)} synthetic pools at {node.http_url}, {node.ws_url}')
+    node.run(args.duration)
@@ -0,0 +1,104 @@
+"""
+Benchmark: data.log_decoder fast path vs. json.loads + eth_utils.decode_hex + eth_abi.decode
+
+Run from the repository root:
+
+python -m benchmarks.log_decoding [frames file]
+
+Frames are Sync/Swap eth_subscription notifications in the format nodes send them.
+Pass a file of frames recorded from a node (one raw websocket message per line),
+otherwise frames are generated with random values
+"""
+import sys
+import json
+import random
+import eth_abi
+import eth_utils
+
+from benchmarks.utils import timeit
+from data import log_decoder
+from data.dex_streams import SYNC_EVENT_SELECTOR, SWAP_EVENT_SELECTOR
+
+
+def synthetic_frames(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    frames = []
+
+    for i in range(n):
+        if rng.random() < 0.5:
+            topics = [SYNC_EVENT_SELECTOR]
+            data = eth_abi.encode(['uint112', 'uint112'], [rng.getrandbits(100), rng.getrandbits(80)])
+        else:
+            topics = [SWAP_EVENT_SELECTOR, '0x' + '00' * 12 + 'ab' * 20, '0x' + '00' * 12 + 'cd' * 20]
+            data = eth_abi.encode(['int256', 'int256', 'uint160', 'uint128', 'int24'],
+                                  [-rng.getrandbits(60), rng.getrandbits(80), rng.getrandbits(150),
+                                   rng.getrandbits(100), rng.randint(-887272, 887272)])
+        log = {
+            'address': '0x' + rng.getrandbits(160).to_bytes(20, 'big').hex(),
+            'topics': topics,
+            'data': eth_utils.encode_hex(data),
+            'blockNumber': hex(17000000 + i // 20),
+            'transactionHash': '0x' + rng.getrandbits(256).to_bytes(32, 'big').hex(),
+            'transactionIndex': hex(i % 200),
+            'blockHash': '0x' + rng.getrandbits(256).to_bytes(32, 'big').hex(),
+            'logIndex': hex(i % 500),
+            'removed': False,
+        }
+        frames.append(json.dumps({
+            'jsonrpc': '2.0',
+            'method': 'eth_subscription',
+            'params': {'subscription': '0x9ce59a13059e417087c02d3236a0b1cc', 'result': log},
+        }))
+
+    return frames
+
+
+def eth_abi_decode(frames: list) -> list:
+    values = []
+    for frame in frames:
+        event = json.loads(frame)['params']['result']
+        if event['topics'][0] == SYNC_EVENT_SELECTOR:
+            values.append(eth_abi.decode(['uint112', 'uint112'], eth_utils.decode_hex(event['data'])))
+        else:
+            values.append(eth_abi.decode(['int256', 'int256', 'uint160', 'uint128', 'int24'],
+                                         eth_utils.decode_hex(event['data'])))
+    return values
+
+
+def fast_decode(frames: list) -> list:
+    values = []
+    for frame in frames:
+        event = log_decoder.loads(frame)['params']['result']
+        if event['topics'][0] == SYNC_EVENT_SELECTOR:
+            values.append(log_decoder.decode_sync(event['data']))
+        else:
+            values.append(log_decoder.decode_swap(event['data']))
+    return values
+
+
+def run(frames: list):
+    assert [tuple(v) for v in eth_abi_decode(frames)] == fast_decode(frames)
+
+    n = len(frames)
+    eth_abi_took = timeit(lambda: eth_abi_decode(frames), number=5)
+    fast_took = timeit(lambda: fast_decode(frames), number=5)
+
+    print(f'{n:>7} frames ({log_decoder.loads.__module__}) | '
+          f'eth_abi: {eth_abi_took / n * 1e6:7.2f} us/frame | fast: {fast_took / n * 1e6:6.2f} us/frame | '
+          f'x{eth_abi_took / fast_took:.1f}')
+
+
+def load_frames(path: str) -> list:
+    # only Sync, Swap logs are decoded
+    with open(path, 'r') as f:
+        frames = [line.strip() for line in f if line.strip()]
+    return [frame for frame in frames
+            if json.loads(frame).get('params', {}).get('result', {}).get('topics', [None])[0]
+            in [SYNC_EVENT_SELECTOR, SWAP_EVENT_SELECTOR]]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(load_frames(sys.argv[1]))
+    else:
+        run(synthetic_frames(10000))
@@ -0,0 +1,49 @@
+"""
+Benchmark: swap path generation startup time with the 'dfs' and 'join' path generators
+
+Run from the repository root:
+
+python -m benchmarks.path_generation
+"""
+import time
+
+from data.dex import DexBase
+from benchmarks.utils import synthetic_market
+
+
+class SyntheticDexBase(DexBase):
+
+    def __init__(self, storage, *args, **kwargs):
+        self.synthetic_storage = storage
+        super().__init__(*args, **kwargs)
+
+    def _fetch_pool_data(self, chains=None):
+        return self.synthetic_storage
+
+    def _fetch_v3_pool_state(self, multicall_results):
+        return {}
+
+
+def run(n_pools: int, max_swap_number: int, path_generator: str, symbol: str = 'ETH/USDT'):
+    # a sparser market than the default, so that 4-hop paths over 20k pools still fit in memory
+    tokens, pools, storage = synthetic_market(n_pools, n_pools // 2, hub_share=0.3)
+    rpc_endpoints = {chain: 'http://localhost:8545' for chain in tokens}
+
+    dex = SyntheticDexBase(storage, rpc_endpoints, tokens, pools, [symbol], max_swap_number, path_generator)
+    dex._load_pool_data()
+
+    s = time.perf_counter()
+    dex._generate_swap_paths()
+    dex._build_price_index()
+    e = time.perf_counter()
+
+    n_paths = dex.swap_paths[symbol]['path'].shape[0]
+    print(f'{n_pools:>6} pools | {max_swap_number} hops | {path_generator:>4} | '
+          f'{n_paths:>8} paths | {e - s:8.3f} secs')
+
+
+if __name__ == '__main__':
+    for n in [1000, 5000, 20000]:
+        for hops in [3, 4]:
+            for generator in ['dfs', 'join']:
+                run(n, hops, generator)
@@ -0,0 +1,42 @@
+"""
+Benchmark: DEX.update_price_for_symbol batch pricing vs. the per-path loop
+
+Run from the repository root:
+
+python -m benchmarks.path_pricing
+"""
+import numpy as np
+
+from benchmarks.utils import synthetic_market, OfflineDEX, timeit
+
+
+def run(n_pools: int, symbol: str = 'ETH/USDT', max_swap_number: int = 3):
+    tokens, pools, storage = synthetic_market(n_pools)
+    chain = list(tokens.keys())[0]
+
+    dex = OfflineDEX(tokens, pools, storage, [symbol], max_swap_number, batch_pricing=True)
+    n_paths = dex.swap_paths[symbol]['path'].shape[0]
+
+    dex.batch_pricing = False
+    dex.update_price_for_symbol(chain, symbol)
+    loop_price = dex.swap_paths[symbol]['price'].copy()
+    loop_fee = dex.swap_paths[symbol]['fee'].copy()
+    loop_took = timeit(lambda: dex.update_price_for_symbol(chain, symbol), number=10)
+
+    dex.batch_pricing = True
+    dex.update_price_for_symbol(chain, symbol)
+    batch_price = dex.swap_paths[symbol]['price'].copy()
+    batch_fee = dex.swap_paths[symbol]['fee'].copy()
+    batch_took = timeit(lambda: dex.update_price_for_symbol(chain, symbol), number=100)
+
+    assert np.allclose(loop_price, batch_price, rtol=1e-12)
+    assert np.allclose(loop_fee, batch_fee, rtol=1e-12)
+
+    print(f'{n_pools:>6} pools | {n_paths:>6} paths | '
+          f'loop: {loop_took * 1000:9.3f} ms | batch: {batch_took * 1000:7.3f} ms | '
+          f'x{loop_took / batch_took:.1f}')
+
+
+if __name__ == '__main__':
+    for n in [10, 100, 1000]:
+        run(n)
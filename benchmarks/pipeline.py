@@ -0,0 +1,186 @@
+"""
+Benchmark: the whole DEX -> queue -> strategy pipeline against the local stand-in node (benchmarks.local_node)
+
+DEX is loaded through Multicall queries to the node, DexStream subscribes to its blocks and logs over a websocket,
+and the strategy side (benchmarks.replay.strategy_process) scans the spreads of every compare_paths pair per event
+
+Run from the repository root:
+
+python -m benchmarks.pipeline [--pools 200] [--events-per-second 50] [--multiplier 10] [--duration 30]
+                              [--transport board|delta] [--coalesce]
+
+--events-per-second: the pool event rate to reproduce, ex) the rate of a mainnet recording of our pools
+                     (benchmarks.replay prints frames/sec, run it with --speed 1)
+--multiplier: the node sends events at events_per_second * multiplier, and produces blocks that much faster
+"""
+import time
+import asyncio
+import argparse
+import requests
+import websockets
+import multiprocessing
+from typing import List
+
+import data.dex_streams
+from benchmarks.local_node import LocalNode, SyntheticChain
+from benchmarks.replay import TimedPublisher, strategy_process, percentiles, print_stages
+from benchmarks.utils import synthetic_market
+from data.dex import DEX
+from data.dex_streams import DexStream, topology_message
+from data.price_board import PriceBoard, ensure_resource_tracker
+from strategies.spread_scanner import generate_compare_paths
+
+
+class ReceiveClock:
+    """
+    Takes the place of the FrameRecorder of DexStream to stamp messages with the time their frame was received
+    """
+
+    def __init__(self, publisher: TimedPublisher):
+        self.publisher = publisher
+        self.frames = 0
+
+    def write(self, chain: str, frame: str or bytes):
+        self.publisher.received = time.time()
+        self.frames += 1
+
+
+def node_process(n_pools: int,
+                 seed: int,
+                 events_per_second: float,
+                 block_time: float,
+                 port: int):
+    tokens, pools, storage = synthetic_market(n_pools, seed=seed)
+    node = LocalNode(SyntheticChain(tokens, pools, storage, seed=seed),
+                     events_per_second=events_per_second,
+                     block_time=block_time,
+                     port=port)
+    node.run()
+
+
+def wait_for_node(http_url: str, timeout: float = 10.0):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            requests.post(http_url, json={'jsonrpc': '2.0', 'id': 1, 'method': 'eth_chainId', 'params': []})
+            return
+        except requests.ConnectionError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def run(n_pools: int = 200,
+        trading_symbols: List[str] = ('ETH/USDT',),
+        events_per_second: float = 50.0,
+        multiplier: float = 10.0,
+        block_time: float = 12.0,
+        duration: float = 30.0,
+        transport: str = 'board',
+        coalesce: bool = False,
+        port: int = 18545,
+        seed: int = 0):
+    # no gas price requests to Blocknative
+    data.dex_streams.BLOCKNATIVE_TOKEN = None
+
+    tokens, pools, storage = synthetic_market(n_pools, seed=seed)
+    chain = list(tokens.keys())[0]
+
+    node = multiprocessing.Process(target=node_process,
+                                   args=(n_pools, seed, events_per_second * multiplier, block_time / multiplier, port))
+    node.start()
+
+    http_url, ws_url = f'http://127.0.0.1:{port}', f'ws://127.0.0.1:{port}'
+    wait_for_node(http_url)
+
+    s = time.time()
+    dex = DEX({chain: http_url}, tokens, pools, list(trading_symbols), 3)
+    print(f'DEX loaded {len(pools)} pools from the node in {time.time() - s:.3f} secs')
+
+    queue = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    publisher = TimedPublisher(queue)
+    clock = ReceiveClock(publisher)
+
+    price_board = None
+    if transport == 'board':
+        ensure_resource_tracker()
+        price_board = PriceBoard.create({s: len(dex.swap_paths[s]['price']) for s in dex.trading_symbols})
+
+    dex_stream = DexStream(dex,
+                           {chain: ws_url},
+                           publisher,
+                           price_board=price_board,
+                           deltas=transport == 'delta',
+                           coalesce=coalesce,
+                           recorder=clock,
+                           trace_latency=True)
+
+    p = multiprocessing.Process(target=strategy_process, args=(queue, results))
+    p.start()
+
+    queue.put({
+        'source': 'dex',
+        'type': 'setup',
+        'compare_paths': generate_compare_paths(dex, dex.pools),
+        'reserves': {},
+        'price_board': price_board.layout if price_board else None,
+    })
+    queue.put(topology_message(dex))
+
+    async def _stream():
+        # the websocket is dropped when the node is terminated, which ends DexStream.stream_events
+        try:
+            await dex_stream.stream_events(chain)
+        except (websockets.ConnectionClosedOK, websockets.ConnectionClosedError):
+            pass
+
+    async def _stop():
+        await asyncio.sleep(duration)
+        node.terminate()
+
+    async def _run():
+        await asyncio.gather(_stream(), _stop())
+
+    s = time.time()
+    asyncio.run(_run())
+    e = time.time()
+
+    queue.put({'type': 'stop'})
+    result = results.get()
+    p.join()
+    node.join()
+
+    if price_board:
+        price_board.close()
+
+    latencies = result['latencies']
+
+    print(f'Node rate: {events_per_second * multiplier:,.0f} events/sec, a block every {block_time / multiplier:.3f} secs')
+    print(f'DexStream received {clock.frames} frames in {e - s:.3f} secs ({clock.frames / max(e - s, 1e-9):,.0f} frames/sec)')
+    print(f'Strategy received {len(latencies)} messages '
+          f'({len(latencies) / max(result["took"], 1e-9):,.0f} messages/sec)')
+    print(f'End-to-end latency: {percentiles(latencies)}')
+    print_stages(result['stages'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pools', type=int, default=200)
+    parser.add_argument('--events-per-second', type=float, default=50.0)
+    parser.add_argument('--multiplier', type=float, default=10.0)
+    parser.add_argument('--block-time', type=float, default=12.0)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--transport', choices=['board', 'delta'], default='board')
+    parser.add_argument('--coalesce', action='store_true')
+    parser.add_argument('--port', type=int, default=18545)
+    args = parser.parse_args()
+
+    run(args.pools,
+        events_per_second=args.events_per_second,
+        multiplier=args.multiplier,
+        block_time=args.block_time,
+        duration=args.duration,
+        transport=args.transport,
+        coalesce=args.coalesce,
+        port=args.port)
@@ -0,0 +1,181 @@
+"""
+Benchmark: replays recorded websocket frames through the full DEX -> queue -> strategy pipeline offline
+
+Record frames with strategies.dex_arb_base.dex_stream_process(..., record_path='<path>')
+or with data.recorder.FrameRecorder, then run from the repository root:
+
+python -m benchmarks.replay <path> [--speed 10] [--transport board|delta] [--coalesce]
+
+--speed: 1 replays at recorded speed, 10 ten times faster, 0 (default) as fast as possible
+
+The strategy side runs in another process and scans the spreads of every compare_paths pair per event,
+latency is measured from the moment a frame is handed to DexStream to the moment the strategy finished scanning
+"""
+import time
+import asyncio
+import argparse
+import numpy as np
+import multiprocessing
+from typing import Any, Dict, List
+
+import data.dex_streams
+from data.dex_streams import DexStream, topology_message
+from data.latency import LatencyTracker, stamp, STAGES, TOTAL, DEQUEUE, SCAN
+from data.price_board import PriceBoard, PriceMirror, ensure_resource_tracker
+from data.recorder import ReplayDEX, read_recording, replay_frames
+from strategies.spread_scanner import SpreadScanner, generate_compare_paths
+
+
+class TimedPublisher:
+    """
+    Stamps messages with the time the frame that caused them was received
+    """
+
+    def __init__(self, queue: multiprocessing.Queue):
+        self.queue = queue
+        self.received = 0.0
+
+    def put(self, message: Dict[str, Any]):
+        message['received'] = self.received
+        self.queue.put(message)
+
+
+def strategy_process(queue: multiprocessing.Queue, results: multiprocessing.Queue):
+    """
+    Strategy side of the pipeline: the spread scanning of strategies.dex_arb_base.strategy
+    """
+    scanners = {}
+    prices = None
+    latency = LatencyTracker()
+    latencies = []
+    first, last = None, None
+
+    while True:
+        data = queue.get()
+        data_type = data['type']
+
+        trace = data.get('trace')
+        if trace is not None:
+            trace[DEQUEUE] = stamp()
+
+        if data_type == 'stop':
+            break
+
+        elif data_type == 'setup':
+            scanners = {symbol: SpreadScanner(paths) for symbol, paths in data['compare_paths'].items()}
+            if data['price_board']:
+                prices = PriceBoard.attach(data['price_board'])
+
+        elif data_type == 'topology':
+            if prices is None:
+                prices = PriceMirror(data['swap_paths'])
+
+        elif data_type in ['event', 'delta']:
+            if data_type == 'delta':
+                prices.apply(data)
+
+            scanner = scanners[data['symbol']]
+            if len(scanner):
+                prices.read(data['symbol'], scanner.max_spread)
+
+            if trace is not None:
+                trace[SCAN] = stamp()
+                latency.record(trace)
+
+            now = time.time()
+            latencies.append(now - data['received'])
+            first = first or data['received']
+            last = now
+
+    if isinstance(prices, PriceBoard):
+        prices.close()
+
+    results.put({'latencies': latencies, 'took': (last - first) if latencies else 0.0, 'stages': latency.summary()})
+
+
+def print_stages(stages: Dict[str, float]):
+    """
+    :param stages: data.latency.LatencyTracker.summary()
+    """
+    for stage in STAGES + [TOTAL]:
+        if f'{stage}_count' in stages:
+            print(f'  {stage:>8}: p50 {stages[f"{stage}_p50"]:.1f} us, '
+                  f'p99 {stages[f"{stage}_p99"]:.1f} us, p999 {stages[f"{stage}_p999"]:.1f} us')
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return '-'
+    p50, p90, p99 = np.percentile(np.array(values) * 1000, [50, 90, 99])
+    return f'p50 {p50:.3f} ms, p90 {p90:.3f} ms, p99 {p99:.3f} ms'
+
+
+def run(path: str, speed: float = 0, transport: str = 'board', coalesce: bool = False):
+    # replays have to run offline: no gas price requests
+    data.dex_streams.BLOCKNATIVE_TOKEN = None
+
+    setup, frames = read_recording(path)
+    dex = ReplayDEX(setup)
+
+    queue = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    publisher = TimedPublisher(queue)
+
+    price_board = None
+    if transport == 'board':
+        ensure_resource_tracker()
+        price_board = PriceBoard.create({s: len(dex.swap_paths[s]['price']) for s in dex.trading_symbols})
+
+    dex_stream = DexStream(dex,
+                           {},
+                           publisher,
+                           price_board=price_board,
+                           deltas=transport == 'delta',
+                           coalesce=coalesce,
+                           trace_latency=True)
+
+    p = multiprocessing.Process(target=strategy_process, args=(queue, results))
+    p.start()
+
+    queue.put({
+        'source': 'dex',
+        'type': 'setup',
+        'compare_paths': generate_compare_paths(dex, dex.pools),
+        'reserves': {},
+        'price_board': price_board.layout if price_board else None,
+    })
+    queue.put(topology_message(dex))
+
+    def _on_frame(received: float):
+        publisher.received = received
+
+    s = time.time()
+    took = asyncio.run(replay_frames(dex_stream, frames, speed or None, _on_frame))
+    e = time.time()
+
+    queue.put({'type': 'stop'})
+    result = results.get()
+    p.join()
+
+    if price_board:
+        price_board.close()
+
+    latencies = result['latencies']
+
+    print(f'Replayed {len(frames)} frames in {e - s:.3f} secs ({len(frames) / max(e - s, 1e-9):,.0f} frames/sec)')
+    print(f'DexStream handling: {percentiles(took)}')
+    print(f'Strategy received {len(latencies)} messages '
+          f'({len(latencies) / max(result["took"], 1e-9):,.0f} messages/sec)')
+    print(f'End-to-end latency: {percentiles(latencies)}')
+    print_stages(result['stages'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--speed', type=float, default=0)
+    parser.add_argument('--transport', choices=['board', 'delta'], default='board')
+    parser.add_argument('--coalesce', action='store_true')
+    args = parser.parse_args()
+
+    run(args.path, args.speed, args.transport, args.coalesce)
@@ -0,0 +1,111 @@
+"""
+Benchmark: SpreadScanner vs. the pair by pair loop of the strategy loop over compare_paths
+
+- scan: the spreads, max spread of every pair
+- per event: the work of the strategy loop per event, with one path re-priced by each event.
+  Scanning, making the spreads InfluxDB fields and encoding them in line protocol
+  (which external.influxdb.InfluxDB does when the point is written, but in the same process)
+  - all: every pair made into a field, which the strategy loop used to do
+  - changed: only the pairs of which the spread changed (SpreadScanner.changed)
+
+Run from the repository root:
+
+python -m benchmarks.spread_scanning
+"""
+import numpy as np
+from typing import Dict
+
+from benchmarks.utils import timeit
+from external.influxdb import line_protocol
+from strategies.spread_scanner import SpreadScanner
+
+MEASUREMENT = 'DEX_ARB_BASE_ETHUSDT'
+
+
+def loop_scan(compare_paths: Dict[str, tuple], price: list, fee: list, spreads: dict) -> str:
+    max_spread = -1
+    max_spread_key = ''
+
+    for path_name, path_index in compare_paths.items():
+        name_1, name_2 = path_name.split('/')
+        key_1 = f'{name_1}/{name_2}'
+        key_2 = f'{name_2}/{name_1}'
+
+        price_1 = price[path_index[0]]
+        price_2 = price[path_index[1]]
+
+        total_fee = fee[path_index[0]] + fee[path_index[1]]
+
+        spread_1 = ((price_1 / price_2 - 1) - total_fee) * 100
+        spread_2 = ((price_2 / price_1 - 1) - total_fee) * 100
+
+        if spread_1 > max_spread:
+            max_spread_key = key_1
+            max_spread = spread_1
+
+        if spread_2 > max_spread:
+            max_spread_key = key_2
+            max_spread = spread_2
+
+        spreads[key_1] = spread_1
+        spreads[key_2] = spread_2
+
+    return max_spread_key
+
+
+def event_all(scanner: SpreadScanner, price: np.ndarray, fee: np.ndarray) -> str:
+    spreads, position = scanner.max_spread(price, fee)
+    return line_protocol(MEASUREMENT, dict(zip(scanner.keys, spreads.tolist())), 0)
+
+
+def event_changed(scanner: SpreadScanner, price: np.ndarray, fee: np.ndarray) -> str:
+    spreads, position = scanner.max_spread(price, fee)
+    changed = scanner.changed(spreads)
+    return line_protocol(MEASUREMENT, changed, 0) if changed else None
+
+
+def run(n_pairs: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+
+    n_paths = int(np.sqrt(2 * n_pairs)) + 2
+    price = (1800 * (1 + rng.normal(0, 0.002, n_paths))).tolist()
+    fee = rng.choice([0.0005, 0.003, 0.006], n_paths).tolist()
+
+    pairs = [(i, j) for i in range(n_paths) for j in range(i + 1, n_paths)][:n_pairs]
+    compare_paths = {f'PATH{i}/PATH{j}': (i, j) for i, j in pairs}
+
+    loop_spreads = {}
+    loop_key = loop_scan(compare_paths, price, fee, loop_spreads)
+    loop_took = timeit(lambda: loop_scan(compare_paths, price, fee, {}), number=5)
+
+    scanner = SpreadScanner(compare_paths)
+    spreads, position = scanner.max_spread(price, fee)
+    scan_took = timeit(lambda: scanner.max_spread(price, fee), number=50)
+
+    assert scanner.keys[position] == loop_key
+    assert np.allclose(spreads, [loop_spreads[k] for k in scanner.keys], rtol=1e-12)
+
+    print(f'{len(compare_paths):>7} pairs | scan      | '
+          f'loop: {loop_took * 1000:9.3f} ms | numpy: {scan_took * 1000:7.3f} ms | '
+          f'x{loop_took / scan_took:.1f}')
+
+    price = np.array(price)
+    fee = np.array(fee)
+
+    def _event(fn):
+        # an event re-prices one path
+        price[rng.integers(n_paths)] *= 1 + rng.normal(0, 0.0001)
+        return fn(scanner, price, fee)
+
+    all_took = timeit(lambda: _event(event_all), number=5)
+    scanner.changed(scanner.scan(price, fee))
+    changed_took = timeit(lambda: _event(event_changed), number=50)
+
+    print(f'{len(compare_paths):>7} pairs | per event | '
+          f' all: {all_took * 1000:9.3f} ms | changed: {changed_took * 1000:7.3f} ms | '
+          f'x{all_took / changed_took:.1f}')
+
+
+if __name__ == '__main__':
+    for n in [10000, 100000]:
+        run(n)
@@ -0,0 +1,123 @@
+import time
+import random
+from typing import Any, Callable, Dict, List, Optional
+
+from data.dex import DEX
+
+HUB_TOKENS = ['ETH', 'USDT', 'USDC', 'DAI', 'BTC']
+
+
+def synthetic_market(n_pools: int,
+                     n_tokens: int = None,
+                     chain: str = 'ethereum',
+                     exchanges: List[str] = ('uniswap', 'sushiswap'),
+                     hub_share: float = 0.7,
+                     seed: int = 0) -> tuple:
+    """
+    Generates tokens, pools and pool storage values that look like a real market:
+    hub_share of the pools are paired with a hub token (ETH, USDT, USDC, DAI, BTC),
+    and every token has a USD price so that all swap paths quote similar prices
+
+    :return: (tokens, pools, storage)
+    tokens, pools are in the format of data.dex.DEX
+    storage is in the format of the value returned from DexBase._fetch_pool_data
+    """
+    rng = random.Random(seed)
+
+    if n_tokens is None:
+        n_tokens = max(len(HUB_TOKENS) + 1, n_pools // 4)
+
+    token_names = HUB_TOKENS + [f'TKN{i}' for i in range(n_tokens - len(HUB_TOKENS))]
+    tokens = {chain: {t: [f'0x{i + 1:040x}', rng.choice([6, 8, 18])] for i, t in enumerate(token_names)}}
+    tokens[chain]['USDT'][1] = 6
+    tokens[chain]['ETH'][1] = 18
+
+    usd_price = {t: 10 ** rng.uniform(-2, 3) for t in token_names}
+    usd_price['USDT'] = 1.0
+    usd_price['ETH'] = 1800.0
+
+    pools = []
+    storage = {}
+    seen = set()
+
+    while len(pools) < n_pools:
+        token0 = rng.choice(HUB_TOKENS) if rng.random() < hub_share else rng.choice(token_names)
+        token1 = rng.choice(token_names)
+        exchange = rng.choice(exchanges)
+        version = rng.choice([2, 3])
+
+        key = (exchange, version, frozenset([token0, token1]))
+        if token0 == token1 or key in seen:
+            continue
+        seen.add(key)
+
+        pool_idx = len(pools)
+        pools.append({
+            'chain': chain,
+            'exchange': exchange,
+            'version': version,
+            'name': f'{token0}/{token1}',
+            'address': f'0x{pool_idx + 1:040x}',
+            'fee': 3000 if version == 2 else rng.choice([100, 500, 3000]),
+            'token0': token0,
+            'token1': token1,
+        })
+
+        decimals0 = tokens[chain][token0][1]
+        decimals1 = tokens[chain][token1][1]
+
+        # amount of token1 for 1 token0, in raw units, with a small random deviation
+        raw_price = usd_price[token0] / usd_price[token1] * 10 ** (decimals1 - decimals0)
+        raw_price *= rng.uniform(0.995, 1.005)
+
+        if version == 2:
+            reserve0 = int(10 ** 6 / usd_price[token0] * 10 ** decimals0)
+            reserve1 = int(reserve0 * raw_price)
+            storage[str(pool_idx)] = (reserve0, reserve1, 0)
+        else:
+            sqrt_price = int(raw_price ** 0.5 * 2 ** 96)
+            storage[str(pool_idx)] = (sqrt_price, 0, 0, 0, 0, 0, True)
+
+    return tokens, pools, storage
+
+
+class OfflineDEX(DEX):
+    """
+    DEX that is loaded from synthetic storage values instead of Multicall queries
+    Used for benchmarking without any RPC endpoints
+    """
+
+    def __init__(self,
+                 tokens: Dict[str, Dict[str, List[str or int]]],
+                 pools: List[Dict[str, Any]],
+                 storage: Dict[str, Any],
+                 trading_symbols: List[str],
+                 max_swap_number: int = 3,
+                 **kwargs):
+
+        self.synthetic_storage = storage
+        rpc_endpoints = {chain: 'http://localhost:8545' for chain in tokens}
+        super().__init__(rpc_endpoints, tokens, pools, trading_symbols, max_swap_number, **kwargs)
+
+    def _fetch_pool_data(self, chains: Optional[List[str]] = None) -> Dict[str, Any]:
+        chains = chains or self.chains_list
+        return {
+            pool_idx: storage_data
+            for pool_idx, storage_data in self.synthetic_storage.items()
+            if self.pools[int(pool_idx)]['chain'] in chains
+        }
+
+    def _fetch_v3_pool_state(self, multicall_results: Dict[str, Any]) -> Dict[str, Any]:
+        return {}
+
+
+def timeit(fn: Callable, number: int = 100) -> float:
+    """
+    Returns the average time in seconds a single call to fn takes
+    """
+    fn()  # warm up
+    s = time.perf_counter()
+    for _ in range(number):
+        fn()
+    e = time.perf_counter()
+    return (e - s) / number
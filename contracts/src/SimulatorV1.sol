@@ -52,6 +52,41 @@ contract SimulatorV1 {
         return amountOut;
     }
 
+    function simulateSwapInBatch(
+        SwapParams[][] calldata routes,
+        uint256[] calldata amountsIn
+    ) public returns (uint256[][] memory amountsOut) {
+        // simulates every route with every amount in: amountsOut[route][amountIn]
+        uint256 routesLength = routes.length;
+        uint256 amountsInLength = amountsIn.length;
+
+        amountsOut = new uint256[][](routesLength);
+
+        for (uint256 i; i < routesLength; ) {
+            amountsOut[i] = new uint256[](amountsInLength);
+            SwapParams[] memory route = routes[i];
+
+            if (route.length > 0) {
+                for (uint256 j; j < amountsInLength; ) {
+                    route[0].amount = amountsIn[j];
+
+                    // a reverting route returns 0 instead of reverting the whole batch
+                    try this.simulateSwapIn(route) returns (uint256 amountOut) {
+                        amountsOut[i][j] = amountOut;
+                    } catch {}
+
+                    unchecked {
+                        ++j;
+                    }
+                }
+            }
+
+            unchecked {
+                ++i;
+            }
+        }
+    }
+
     function simulateUniswapV2SwapIn(
         SwapParams memory params
     ) public view returns (uint256 amountOut) {
@@ -0,0 +1,54 @@
+import os
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Bump this when the layout of cached arrays changes, so that old cache files get rebuilt
+CACHE_VERSION = 1
+
+
+def cache_key(*objects: Any) -> str:
+    """
+    Returns a hash of JSON serializable objects (tokens, pools, trading_symbols, max_swap_number, ...)
+    Cached values are only reused when the key they were saved with matches
+    """
+    payload = json.dumps([CACHE_VERSION, *objects], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def load_cache(cache_dir: str, name: str, key: str) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Loads the arrays saved with save_cache
+    Returns None if there is no cache file, or if it was saved with a different key
+    """
+    path = Path(cache_dir) / f'{name}.npz'
+
+    if not path.exists():
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as f:
+            if str(f['key']) != key:
+                return None
+            return {k: f[k] for k in f.files if k != 'key'}
+    except (OSError, ValueError, KeyError) as e:
+        print(f'Failed to load cache {path}: {e}')
+        return None
+
+
+def save_cache(cache_dir: str, name: str, key: str, arrays: Dict[str, np.ndarray]):
+    """
+    Saves arrays to <cache_dir>/<name>.npz along with the key
+    The file is written to a temporary path first, so that a crash never leaves a broken cache behind
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    path = Path(cache_dir) / f'{name}.npz'
+    tmp_path = Path(cache_dir) / f'{name}.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, key=np.array(key), **arrays)
+
+    os.replace(tmp_path, path)
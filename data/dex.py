@@ -1,21 +1,26 @@
 import numpy as np
 from web3 import Web3
-from typing import Any, Dict, List
-from multicall import Call, Multicall
+from typing import Any, Dict, List, Optional
+from multicall import Call
 
-from simulation import UniswapV2Simulator, UniswapV3Simulator
+from data.cache import cache_key, load_cache, save_cache
+from data.multicall_loader import ChunkedMulticall
+from simulation import UniswapV2Simulator, UniswapV3Simulator, UniswapV3Pool, ArbitrageOptimizer
+from simulation.kernels import load_kernels
+from simulation.uniswap_v3_math import compress_tick, tick_position
+from simulation.uniswap_v2 import to_uint
 
-# Dimension of DEX.storage_array
+# Fields of a directed pool index (DEX.storage_index, DEX.swap_paths[symbol]['path'])
 CHAIN = 0
 EXCHANGE = 1
 TOKEN_IN = 2
 TOKEN_OUT = 3
 VERSION = 4
-STORAGE = 5
 
 V2 = 0
 V3 = 1
 
+# Columns of DEX.storage_array
 DECIMALS0 = 0
 DECIMALS1 = 1
 RESERVE0 = 2
@@ -25,6 +30,11 @@ FEE = 5
 TOKEN0_IN = 6
 POOL_INDEX = 7
 
+STORAGE_COLUMNS = 8
+
+# log index of pool states loaded with Multicall, which are the states after every log of the block
+SNAPSHOT_LOG_INDEX = 2 ** 32
+
 
 class DexBase:
 
@@ -33,7 +43,12 @@ class DexBase:
                  tokens: Dict[str, Dict[str, List[str or int]]],
                  pools: List[Dict[str, Any]],
                  trading_symbols: List[str],
-                 max_swap_number: int = 3):
+                 max_swap_number: int = 3,
+                 path_generator: str = 'dfs',
+                 cache_dir: str = None,
+                 v3_tick_words: int = 2,
+                 multicall_chunk_size: int = 500,
+                 multicall_retries: int = 3):
         """
         :param rpc_endpoints:
         ex) {'ethereum': '<RPC URL>'}
@@ -56,18 +71,68 @@ class DexBase:
 
         :param max_swap_number: the maximum number of swaps in a trade
         ex) 1, 2, 3, ...
+
+        :param path_generator: how swap paths are searched for on the token graph
+        - 'dfs': bounded-depth depth first search over the adjacency list of each token
+        - 'join': extends all partial paths one swap at a time by joining NumPy arrays of hop candidates
+
+        :param cache_dir: directory to save generated swap paths in
+        Swap paths are reused on the next start-up if tokens, pools, trading_symbols, max_swap_number
+        haven't changed. If None, swap paths are generated on every start-up
+
+        :param v3_tick_words: the number of tickBitmap words to load on each side of the current tick
+        of Uniswap V3 variant pools. A word holds 256 * tickSpacing ticks
+        ex) 500 fee tier pools, v3_tick_words=2: ticks within +-5120 (=+-~50% of the price) are loaded
+
+        :param multicall_chunk_size: the max number of calls in a single Multicall query
+        Queries of all chains and chunks are sent concurrently, and pinned to the same block per chain
+
+        :param multicall_retries: the number of times a failed Multicall chunk is retried before it's split in half
         """
+        if path_generator not in ['dfs', 'join']:
+            raise ValueError(f'path_generator should be one of: dfs, join. Got: {path_generator}')
+
         self.rpc_endpoints = rpc_endpoints
         self.tokens = tokens
         self.pools = pools
         self.trading_symbols = trading_symbols
         self.max_swap_number = max_swap_number
+        self.path_generator = path_generator
+        self.cache_dir = cache_dir
+        self.v3_tick_words = v3_tick_words
+
+        # swap paths only depend on these values, and are cached with this key
+        self.swap_paths_key = cache_key(tokens, pools, trading_symbols, max_swap_number)
 
         self.sim_v2 = UniswapV2Simulator()
         self.sim_v3 = UniswapV3Simulator()
+        self.optimizer = ArbitrageOptimizer()
 
         self.web3 = {k: Web3(Web3.HTTPProvider(v)) for k, v in rpc_endpoints.items()}
 
+        self.multicall = ChunkedMulticall(rpc_endpoints,
+                                          chunk_size=multicall_chunk_size,
+                                          retries=multicall_retries)
+
+        """
+        block_numbers
+        : The last block of each chain that the state of all pools is complete up to
+        : Set to the block pool data is loaded at, and moved forward by DexStream with new blocks and resyncs
+
+        ex) {'ethereum': 17000000}
+        """
+        self.block_numbers: Dict[str, int] = {}
+
+        """
+        pinned_blocks
+        : The block of each chain that the Multicall queries of the load in progress are sent at
+        : block_numbers is only set to it once the loaded values are applied,
+          so a failed load leaves block_numbers as it was
+
+        ex) {'ethereum': 17000012}
+        """
+        self.pinned_blocks: Dict[str, int] = {}
+
         # extract keys from tokens, pools
         self.chains_list = sorted(list(tokens.keys()))
         self.exchanges_list = sorted(set([p['exchange'] for p in pools]))
@@ -83,23 +148,89 @@ class DexBase:
         self.exchange_to_id = {k: i for i, k in enumerate(self.exchanges_list)}
         self.token_to_id = {k: i for i, k in enumerate(self.tokens_list)}
 
+        """
+        storage_rows
+        : Maps the 5-dimensional index of a directed pool to its row in storage_array
+        : Every pool has two rows, one for token0 -> token1, and one for token1 -> token0
+        : Pools that share the same index (ex. Uniswap V3 pools with different fee levels)
+          share the same rows, and the pool that comes last in pools is stored
+
+        ex) {(0, 0, 1, 2, 0): 0, (0, 0, 2, 1, 0): 1, ...}
+        """
+        self.storage_rows = {}
+
+        for pool in pools:
+            chain_idx = self.chain_to_id[pool['chain']]
+            exchange_idx = self.exchange_to_id[pool['exchange']]
+            token0_idx = self.token_to_id[pool['token0']]
+            token1_idx = self.token_to_id[pool['token1']]
+            version_idx = V2 if pool['version'] == 2 else V3
+
+            for idx in [(chain_idx, exchange_idx, token0_idx, token1_idx, version_idx),
+                        (chain_idx, exchange_idx, token1_idx, token0_idx, version_idx)]:
+                if idx not in self.storage_rows:
+                    self.storage_rows[idx] = len(self.storage_rows)
+
+        # the reverse of storage_rows: np.ndarray: (rows, 5)
+        self.storage_keys = np.array(list(self.storage_rows.keys()), dtype=np.int64).reshape(-1, 5)
+
         """
         storage_array
-        : 6-dimensional array that stores storage values from pool contracts
+        : 2-dimensional array that stores storage values from pool contracts, one row per directed pool
+        : Rows are looked up with storage_rows, so the memory used grows with the number of pools,
+          not with the number of tokens
+        : reserve0, reserve1, sqrtPriceX96 are a float cache of exact_reserves, exact_sqrt_prices,
+          call DEX.refresh_storage before reading them
         """
         self.storage_array = np.zeros((
-            len(self.chains_list),      # chains
-            len(self.exchanges_list),   # exchanges
-            len(tokens_list),           # token in
-            len(tokens_list),           # token out
-            2,                          # uniswap variant version: 2, 3
-            8                           # decimals0, decimals1, reserve0, reserve1, sqrtPriceX96,
+            len(self.storage_rows),     # directed pools
+            STORAGE_COLUMNS             # decimals0, decimals1, reserve0, reserve1, sqrtPriceX96,
                                         # fee, token0_is_input, pool_index
         ))
 
+        """
+        exact_reserves
+        : reserve0, reserve1 of Uniswap V2 variant pools as Python ints, in the same rows as storage_array
+        : storage_array is float64 and can't hold uint112 reserves exactly, so swap simulations
+          that have to match on-chain results read reserves from here
+
+        ex) np.array([[16739446124543287006567, 30195815093427], ...], dtype=object)
+        """
+        self.exact_reserves = np.zeros((len(self.storage_rows), 2), dtype=object)
+
+        """
+        exact_sqrt_prices
+        : sqrtPriceX96 of Uniswap V3 variant pools as Python ints, in the same rows as storage_array
+        : uint160 values lose their lower bits in float64
+
+        ex) np.array([0, 3361437066223186580131307, ...], dtype=object)
+        """
+        self.exact_sqrt_prices = np.zeros(len(self.storage_rows), dtype=object)
+
+        """
+        stale_rows
+        : rows of storage_array whose exact values changed after their float values were last computed
+        : update_reserves, update_sqrt_price only write the exact values, the float values are recomputed
+          for these rows in refresh_storage, right before storage_array is read for pricing.
+          Many events on a pool before a re-price (ex. DexStream.coalesce, backfills) convert it only once
+
+        ex) {0, 1, 14, 15}
+        """
+        self.stale_rows = set()
+
+        """
+        v3_pools
+        : Local state of Uniswap V3 variant pools (slot0, liquidity, tick bitmap, ticks) by pool index
+        : Used to simulate swaps offline with UniswapV3Simulator
+        : Filled in from _load_pool_data(), and kept up to date with Swap, Mint, Burn events
+
+        ex) {0: UniswapV3Pool, 1: UniswapV3Pool, ...}
+        """
+        self.v3_pools = {}
+
         """
         storage_index
-        : Keeps the 5-dimensional index of storage_array by chains
+        : Keeps the 5-dimensional index of directed pools by chains
         : Used to generate swap paths
         : Filled in from _load_pool_data()
         
@@ -107,6 +238,16 @@ class DexBase:
         """
         self.storage_index = {c: [] for c in self.chains_list}
 
+        """
+        pool_blocks
+        : (block number, log index) of the last event applied to each pool, by pool index
+        : Pools loaded with Multicall are at (the block loaded at, SNAPSHOT_LOG_INDEX)
+        : Used to skip events that are already applied when DexStream resyncs after reconnecting
+
+        ex) np.array([[17000000, 4294967296], [17000012, 87], ...])
+        """
+        self.pool_blocks = np.zeros((len(pools), 2), dtype=np.int64)
+
         """
         swap_paths
         : contains information about swap paths, pool indexes, tags, tokens involved, price, fee
@@ -121,21 +262,99 @@ class DexBase:
         """
         self.swap_paths = {s: None for s in self.trading_symbols}
 
+        """
+        pool_to_paths
+        : reverse index of swap_paths, from pool index to the (path row, hop) pairs using the pool
+        : Used to re-price only the paths that go through an updated pool
+        : Filled in from _generate_swap_paths()
+
+        ex) {0: {'ETH/USDT': np.array([[0, 0], [4, 1], ...])}, ...}
+        """
+        self.pool_to_paths = {}
+
+        """
+        price_index
+        : flat hop indexes of swap_paths gathered once at load() time
+        : Used to batch price every path of a symbol with NumPy fancy indexing
+        : Filled in from _build_price_index()
+
+        ex) {'ETH/USDT': {'hop_rows': np.ndarray,
+                          'hop_mask': np.ndarray,
+                          'hop_v2': np.ndarray,
+                          'hop_token0_in': np.ndarray,
+                          'hop_scale': np.ndarray,
+                          'chain_rows': Dict[int, np.ndarray]}, ...}
+        """
+        self.price_index = {s: None for s in self.trading_symbols}
+
     def load(self):
         """
         Make sure to call this method in DEX
         """
         self._load_pool_data()
         self._generate_swap_paths()
+        self._build_price_index()
 
     def _load_pool_data(self):
         """
         Loads all storage values from multiple pool contracts using Multicall
         this enables users to bulk query data on the blockchain
+
+        The timings of the queries are kept in DEX.multicall.timings, refer to ChunkedMulticall.report
         """
-        calls_by_chain = {c: [] for c in self.chains_list}
+        self.multicall.reset_timings()
+
+        multicall_results = self._fetch_pool_data()
+        self._fill_pool_data(multicall_results)
+        self._fill_v3_pool_state(multicall_results, self._fetch_v3_pool_state(multicall_results))
+
+        self.block_numbers.update(self.pinned_blocks)
+
+        for pool_idx, pool in enumerate(self.pools):
+            self.set_pool_block(pool_idx, self.block_numbers.get(pool['chain'], 0))
+
+    def set_pool_block(self, pool_idx: int, block_number: int, log_index: int = SNAPSHOT_LOG_INDEX):
+        """
+        Records the position of the last event applied to the pool at DEX.pools[pool_idx]
+        """
+        self.pool_blocks[pool_idx] = (block_number, log_index)
+
+    def is_new_event(self, pool_idx: int, block_number: int, log_index: int) -> bool:
+        """
+        Returns False if the event at (block_number, log_index) of the pool is already applied
+        """
+        last_block, last_log_index = self.pool_blocks[pool_idx]
+        return block_number > last_block or (block_number == last_block and log_index > last_log_index)
+
+    def _multicall(self, calls_by_chain: Dict[str, List[Call]]) -> Dict[str, Any]:
+        """
+        Sends the calls in chunks at the block numbers pinned by _fetch_pool_data
+        """
+        unpinned = [c for c, calls in calls_by_chain.items() if calls and c not in self.pinned_blocks]
+        if unpinned:
+            self.pinned_blocks.update(self.multicall.get_block_numbers(unpinned))
+
+        return self.multicall({c: calls for c, calls in calls_by_chain.items() if calls}, self.pinned_blocks)
+
+    def _fetch_pool_data(self, chains: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Sends the Multicall queries and returns the raw storage values by pool index
+        ex) {'0': (sqrtPriceX96, tick, ...), '1': (reserve0, reserve1, blockTimestampLast), ...}
+
+        :param chains: only load the pools of these chains, all chains if None
+        """
+        chains = chains or self.chains_list
+
+        # every query of this load is sent at the latest block of each chain as of now
+        for chain in chains:
+            self.pinned_blocks.pop(chain, None)
+
+        calls_by_chain = {c: [] for c in chains}
 
         for pool_idx, pool in enumerate(self.pools):
+            if pool['chain'] not in calls_by_chain:
+                continue
+
             if pool['version'] == 2:
                 """
                 Reference: https://github.com/Uniswap/v2-core/blob/master/contracts/UniswapV2Pair.sol
@@ -158,15 +377,117 @@ class DexBase:
             calls_by_chain[pool['chain']].append(call)
 
         # Send multicall queries
-        multicall_results = {}
-        for exchange, calls in calls_by_chain.items():
-            multicall = Multicall(calls, _w3=self.web3[exchange])
-            multicall_results = {
-                **multicall_results,
-                **multicall()
+        return self._multicall(calls_by_chain)
+
+    def _fetch_v3_pool_state(self, multicall_results: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Loads the state of Uniswap V3 variant pools needed for offline swap simulations
+        with three rounds of Multicall queries:
+
+        1. liquidity, tickSpacing
+        2. tickBitmap words within v3_tick_words words of the current tick
+        3. liquidityGross, liquidityNet of the initialized ticks in those words
+
+        :param multicall_results: the value returned from _fetch_pool_data, which has slot0 of V3 pools
+        :return: {'0': {'liquidity': int,
+                        'tick_spacing': int,
+                        'tick_bitmap': {word_pos: word},
+                        'ticks': {tick: (liquidityGross, liquidityNet)}}, ...}
+        """
+        v3_pools = {str(i): pool for i, pool in enumerate(self.pools)
+                    if pool['version'] == 3 and str(i) in multicall_results}
+
+        if not v3_pools:
+            return {}
+
+        # 1. liquidity, tickSpacing
+        calls_by_chain = {c: [] for c in self.chains_list}
+
+        for pool_idx, pool in v3_pools.items():
+            calls_by_chain[pool['chain']].extend([
+                Call(pool['address'], 'liquidity()(uint128)', [(f'{pool_idx}_liquidity', None)]),
+                Call(pool['address'], 'tickSpacing()(int24)', [(f'{pool_idx}_tick_spacing', None)]),
+            ])
+
+        results = self._multicall(calls_by_chain)
+
+        # 2. tickBitmap words around the current tick
+        calls_by_chain = {c: [] for c in self.chains_list}
+        words = {}
+
+        for pool_idx, pool in v3_pools.items():
+            tick = multicall_results[pool_idx][1]
+            word_pos, _ = tick_position(compress_tick(tick, results[f'{pool_idx}_tick_spacing']))
+            words[pool_idx] = list(range(word_pos - self.v3_tick_words, word_pos + self.v3_tick_words + 1))
+
+            for w in words[pool_idx]:
+                calls_by_chain[pool['chain']].append(
+                    Call(pool['address'], ['tickBitmap(int16)(uint256)', w], [(f'{pool_idx}_word_{w}', None)])
+                )
+
+        results.update(self._multicall(calls_by_chain))
+
+        # 3. liquidityGross, liquidityNet of initialized ticks
+        calls_by_chain = {c: [] for c in self.chains_list}
+        ticks = {}
+
+        for pool_idx, pool in v3_pools.items():
+            tick_spacing = results[f'{pool_idx}_tick_spacing']
+            ticks[pool_idx] = []
+
+            for w in words[pool_idx]:
+                word = results[f'{pool_idx}_word_{w}']
+                for bit in range(256):
+                    if word & (1 << bit):
+                        ticks[pool_idx].append(((w << 8) + bit) * tick_spacing)
+
+            for t in ticks[pool_idx]:
+                signature = 'ticks(int24)(uint128,int128,uint256,uint256,int56,uint160,uint32,bool)'
+                calls_by_chain[pool['chain']].append(
+                    Call(pool['address'], [signature, t], [(f'{pool_idx}_gross_{t}', None),
+                                                           (f'{pool_idx}_net_{t}', None)])
+                )
+
+        results.update(self._multicall(calls_by_chain))
+
+        return {
+            pool_idx: {
+                'liquidity': results[f'{pool_idx}_liquidity'],
+                'tick_spacing': results[f'{pool_idx}_tick_spacing'],
+                'tick_bitmap': {w: results[f'{pool_idx}_word_{w}'] for w in words[pool_idx]},
+                'ticks': {t: (results[f'{pool_idx}_gross_{t}'], results[f'{pool_idx}_net_{t}'])
+                          for t in ticks[pool_idx]},
             }
+            for pool_idx in v3_pools
+        }
 
-        # Fill in storage_index, storage_array
+    def _fill_v3_pool_state(self, multicall_results: Dict[str, Any], v3_state: Dict[str, Any]):
+        """
+        Fills in DEX.v3_pools with slot0 from _fetch_pool_data and the state from _fetch_v3_pool_state
+        Pools without state are filled in with 0 liquidity and no loaded ticks
+        """
+        for pool_idx, pool in enumerate(self.pools):
+            if pool['version'] != 3 or str(pool_idx) not in multicall_results:
+                continue
+
+            sqrt_price, tick = multicall_results[str(pool_idx)][:2]
+            state = v3_state.get(str(pool_idx), {})
+            ticks = state.get('ticks', {})
+
+            self.v3_pools[pool_idx] = UniswapV3Pool(sqrt_price_x96=sqrt_price,
+                                                    tick=tick,
+                                                    liquidity=state.get('liquidity', 0),
+                                                    fee=pool['fee'],
+                                                    tick_spacing=state.get('tick_spacing'),
+                                                    ticks={t: v[1] for t, v in ticks.items()},
+                                                    tick_bitmap=state.get('tick_bitmap', {}),
+                                                    liquidity_gross={t: v[0] for t, v in ticks.items()},
+                                                    loaded_words=state.get('tick_bitmap', {}).keys())
+
+    def _fill_pool_data(self, multicall_results: Dict[str, Any]):
+        """
+        Fills in storage_index, storage_array with the values returned from _fetch_pool_data
+        """
         for pool_idx, storage_data in multicall_results.items():
             pool: Dict[str, Any] = self.pools[int(pool_idx)]
 
@@ -202,13 +523,39 @@ class DexBase:
                 sqrt_price = storage_data[0]
                 data = [decimals0, decimals1, 0, 0, sqrt_price, fee]
 
-            self.storage_array[idx_1] = data + [1, int(pool_idx)]  # token_in is token0
-            self.storage_array[idx_2] = data + [0, int(pool_idx)]  # token_in is not token0
+            self.storage_array[self.storage_rows[idx_1]] = data + [1, int(pool_idx)]  # token_in is token0
+            self.storage_array[self.storage_rows[idx_2]] = data + [0, int(pool_idx)]  # token_in is not token0
+
+            rows = [self.storage_rows[idx_1], self.storage_rows[idx_2]]
+
+            if version_idx == V2:
+                self.exact_reserves[rows, 0] = int(storage_data[0])
+                self.exact_reserves[rows, 1] = int(storage_data[1])
+            else:
+                self.exact_sqrt_prices[rows] = int(storage_data[0])
 
     def _generate_swap_paths(self):
         """
         Generates all the swap paths up to max_swap_number swaps
         This internal function has to be called after DEX.storage_index has been filled
+
+        If cache_dir is set, swap paths saved from a previous start-up are reused
+        as long as they were generated from the same tokens, pools, trading_symbols, max_swap_number
+        """
+        swap_rows = self._load_swap_rows_cache()
+
+        if swap_rows is None:
+            swap_rows = self._generate_swap_rows()
+            self._save_swap_rows_cache(swap_rows)
+
+        self._set_swap_paths(swap_rows)
+
+    def _generate_swap_rows(self) -> Dict[str, np.ndarray]:
+        """
+        Swap paths are searched for on a token graph, where every directed pool in storage_index
+        is an edge going from token_in to token_out. Refer to DexBase._search_paths
+
+        :return: {symbol: np.ndarray: (n, max_swap_number) rows of storage_array, empty hops are -1}
         """
 
         # Dictionary that looks like: {'ETH/USDT': [3, 1], 'BTC/USDT': [3, 0], ...}
@@ -217,52 +564,78 @@ class DexBase:
             for symbol in self.trading_symbols
         }
 
-        chain_swap_paths = {}
+        chain_swap_rows = {}
 
         for chain, index in self.storage_index.items():
-            index_arr = np.array(index)
-
-            symbol_swap_paths = {}
+            # rows of storage_array that are used as the edges of the token graph, in the order they were loaded
+            edges = np.array(list(dict.fromkeys(self.storage_rows[idx] for idx in index)), dtype=np.int64)
 
             """
             Loop through each symbol from token_in_out (=symbols in trading_symbols)
             and generate viable swap paths that can occur within a blockchain.
             This means that there will be multiple viable swap paths for a trading symbol per chain.
             """
-            for symbol, in_out in token_in_out.items():
-                pool_samples = self.__sample_pools(index_arr, in_out)
-                paths = self.__generate_paths(pool_samples)
+            chain_swap_rows[chain] = {
+                symbol: self._search_paths(edges, *in_out)
+                for symbol, in_out in token_in_out.items()
+            }
 
-                paths_arr = np.array(paths)
-                if paths_arr.shape[0] != 0:
-                    symbol_swap_paths[symbol] = paths_arr
-                else:
-                    symbol_swap_paths[symbol] = paths_arr.reshape((0, 3, 5)).astype(np.int64)
+        # concatenate the paths generated for each chain
+        return {
+            symbol: np.concatenate([chain_swap_rows[chain][symbol] for chain in self.chains_list])
+            for symbol in self.trading_symbols
+        }
 
-            chain_swap_paths[chain] = symbol_swap_paths
+    def _load_swap_rows_cache(self) -> Optional[Dict[str, np.ndarray]]:
+        if not self.cache_dir:
+            return None
 
-        def _get_pool_indexes(_symbol_paths: np.ndarray) -> List[int]:
-            indexes = []
-            for i in np.arange(_symbol_paths.shape[0]):
-                idx = _symbol_paths[i]
-                if np.sum(idx) != 0:
-                    pool_idx = self.storage_array[tuple(idx)][POOL_INDEX]
-                    indexes.append(int(pool_idx))
-            return indexes
+        cached = load_cache(self.cache_dir, self.__swap_rows_cache_name(), self.swap_paths_key)
+        if cached is None:
+            return None
+
+        # symbols are saved by their position in trading_symbols, because they contain '/'
+        return {symbol: cached[f'rows_{i}'] for i, symbol in enumerate(self.trading_symbols)}
+
+    def _save_swap_rows_cache(self, swap_rows: Dict[str, np.ndarray]):
+        if not self.cache_dir:
+            return
+
+        arrays = {f'rows_{i}': swap_rows[symbol] for i, symbol in enumerate(self.trading_symbols)}
+        save_cache(self.cache_dir, self.__swap_rows_cache_name(), self.swap_paths_key, arrays)
+
+    def __swap_rows_cache_name(self) -> str:
+        return f'swap_paths-{"-".join(self.chains_list)}'
+
+    def _set_swap_paths(self, swap_rows: Dict[str, np.ndarray]):
+        """
+        Fills in swap_paths, pool_to_paths from the rows of storage_array used in each swap path
+        """
+        self.pool_to_paths = {i: {} for i in range(len(self.pools))}
 
-        # concatenate the paths generated for each chain
         for symbol in self.trading_symbols:
-            symbol_paths_list = [chain_swap_paths[chain][symbol] for chain in self.chains_list]
-            symbol_paths_array = np.concatenate(symbol_paths_list)
+            # rows of storage_array used in each hop, empty hops are -1
+            rows = swap_rows[symbol]
+            hop_mask = rows >= 0
 
-            pool_indexes = [
-                _get_pool_indexes(symbol_paths_array[i])
-                for i in np.arange(symbol_paths_array.shape[0])
-            ]
+            symbol_paths_array = np.where(hop_mask[:, :, None], self.storage_keys[rows], 0)
+
+            hop_pools = self.storage_array[rows, POOL_INDEX].astype(np.int64)
+            hop_counts = hop_mask.sum(axis=1)
+            pool_indexes = [p[:n] for p, n in zip(hop_pools.tolist(), hop_counts.tolist())]
+
+            # build pool_to_paths by grouping (path row, hop) pairs by the pool used
+            path_rows, hops = np.nonzero(hop_mask)
+            path_pools = hop_pools[path_rows, hops]
+            order = np.argsort(path_pools, kind='stable')
+            row_hops = np.stack([path_rows, hops], axis=1)[order]
+            unique_pools, starts = np.unique(path_pools[order], return_index=True)
+
+            for pool_idx, pool_row_hops in zip(unique_pools.tolist(), np.split(row_hops, starts[1:])):
+                self.pool_to_paths[pool_idx][symbol] = pool_row_hops
 
             # get unique tokens from pool index that isn't all 0's
-            _tokens_involved = symbol_paths_array[:, :, [TOKEN_IN, TOKEN_OUT]].reshape(-1, 2)
-            tokens_involved = np.unique(_tokens_involved[~np.all(_tokens_involved == 0, axis=1)])
+            tokens_involved = np.unique(symbol_paths_array[:, :, [TOKEN_IN, TOKEN_OUT]][hop_mask])
 
             price_arr = np.zeros(symbol_paths_array.shape[0])
             fee_arr = np.zeros(symbol_paths_array.shape[0])
@@ -272,14 +645,12 @@ class DexBase:
             Each tag will look like: ethereum-0, ethereum-1, polygon-0, ...
             This step is completely unnecessary to the main logic
             """
-            chain_path_counter = {chain: 0 for chain in self.chains_list}
-            tags = []
-            for i in np.arange(symbol_paths_array.shape[0]):
-                chain_idx = symbol_paths_array[i][0][0]
-                chain = self.chains_list[chain_idx]
-                tag = f'{chain}-{chain_path_counter[chain]}'
-                chain_path_counter[chain] += 1
-                tags.append(tag)
+            chain_counts = np.bincount(symbol_paths_array[:, 0, CHAIN], minlength=len(self.chains_list))
+            tags = [
+                f'{chain}-{i}'
+                for chain, count in zip(self.chains_list, chain_counts.tolist())
+                for i in range(count)
+            ]
 
             self.swap_paths[symbol] = {
                 'path': symbol_paths_array,     # np.ndarray: (n, max_swap_number, 5)
@@ -290,118 +661,203 @@ class DexBase:
                 'fee': fee_arr,                 # np.ndarray: (1, n) --> n should match the number of paths
             }
 
-    def __sample_pools(self, index_arr: np.ndarray, in_out: List[int]) -> Dict[int, List[List[List[int]]]]:
-        # Step #1
-        # Sampling pools that can be used in n-hop swaps with token_in, token_out constraints
-        # Sampling before finding swap paths can reduce the time it takes to build viable swap paths
-        swap_nums = range(1, self.max_swap_number + 1)
-        pool_samples = {n: [] for n in swap_nums}
+    def _search_paths(self, edges: np.ndarray, token_in: int, token_out: int) -> np.ndarray:
+        """
+        Finds all the swap paths from token_in to token_out using up to max_swap_number edges
 
-        for n in swap_nums:
-            token_in, token_out = in_out
+        A viable swap path:
+        - starts with a pool that takes token_in, and ends with a pool that returns token_out
+        - connects token_out of each pool to token_in of the next pool
+        - doesn't return token_out before the last pool
+        - doesn't buy from a pool, and sell on the same pool in the last two swaps
+          ex) ETH -> USDT -> ETH
+          (ETH/USDT, USDT/ETH pools on the same exchange, version are considered equal)
 
-            no_path = False
+          This isn't necessarily true in Uniswap V3 variants, because different fee levels can exist.
+          However, we exclude that scenario for simplicity.
 
-            # setup an empty list of pool samples that could be used in each nth step of the swap path
-            filtered_pools = [[]] * self.max_swap_number
+        Paths are sorted by the number of swaps, and then by the order of edges in each swap
 
-            for i in range(n):
-                if i == 0:
-                    # token_in is int here
-                    condition_1 = index_arr[:, TOKEN_IN] == token_in
-                else:
-                    # token_in in List[int] here
-                    condition_1 = np.isin(index_arr[:, TOKEN_IN], token_in)
+        :param edges: rows of storage_array that can be used in the paths
+        :return: np.ndarray: (n, max_swap_number) rows of storage_array, empty hops are filled with -1
+        """
+        if self.path_generator == 'join':
+            paths_by_swaps = self.__join_paths(edges, token_in, token_out)
+        else:
+            paths_by_swaps = self.__dfs_paths(edges, token_in, token_out)
 
-                if i == n - 1:
-                    condition_2 = index_arr[:, TOKEN_OUT] == token_out
-                else:
-                    condition_2 = index_arr[:, TOKEN_OUT] != token_out
+        padded = [
+            np.pad(paths.reshape(-1, n_swaps),
+                   ((0, 0), (0, self.max_swap_number - n_swaps)),
+                   constant_values=-1)
+            for n_swaps, paths in enumerate(paths_by_swaps, start=1)
+        ]
+        return np.concatenate(padded).astype(np.int64)
 
-                condition = condition_1 & condition_2
-                filtered = index_arr[condition]
-                if filtered.shape[0] > 0:
-                    filtered_pools[i] = filtered.tolist()
-                else:
-                    no_path = True
-                    break
+    def __swaps_to_token_out(self, edges: np.ndarray, token_out: int) -> np.ndarray:
+        """
+        Breadth first search from token_out on the reversed token graph
+        Returns the minimum number of swaps needed to reach token_out from each token,
+        max_swap_number + 1 if token_out can't be reached within max_swap_number swaps
+
+        This is used to prune partial paths that can never end in token_out
+        """
+        edge_token_in = self.storage_keys[edges, TOKEN_IN]
+        edge_token_out = self.storage_keys[edges, TOKEN_OUT]
 
-                # set the next token_in to be current token_outs
-                token_in = list(filtered[:, TOKEN_OUT])
+        swaps = np.full(len(self.tokens_list), self.max_swap_number + 1)
+        swaps[token_out] = 0
 
-            if not no_path:
-                pool_samples[n] = filtered_pools
+        for n_swaps in range(1, self.max_swap_number + 1):
+            reached = edge_token_in[swaps[edge_token_out] == n_swaps - 1]
+            swaps[reached] = np.minimum(swaps[reached], n_swaps)
 
-        return pool_samples
+        return swaps
 
-    def __generate_paths(self, pool_samples: Dict[int, List[List[List[int]]]]) -> List[List[List[int]]]:
+    def __dfs_paths(self, edges: np.ndarray, token_in: int, token_out: int) -> List[np.ndarray]:
         """
-        :param pool_samples: returned value of DEX._sample_pools
+        Bounded-depth depth first search over the adjacency list of the token graph
+
+        :return: paths_by_swaps[n - 1] is the np.ndarray of paths with n swaps
+        """
+        edge_keys = dict(zip(edges.tolist(), self.storage_keys[edges].tolist()))
+        swaps_to_token_out = self.__swaps_to_token_out(edges, token_out).tolist()
+
+        # adjacency[n][token]: edges that take the token in, and can reach token_out in n swaps or less
+        # edges are kept in the order of edges
+        adjacency = [{} for _ in range(self.max_swap_number + 1)]
+        for row, key in edge_keys.items():
+            for n_swaps in range(swaps_to_token_out[key[TOKEN_OUT]] + 1, self.max_swap_number + 1):
+                adjacency[n_swaps].setdefault(key[TOKEN_IN], []).append(row)
+
+        paths_by_swaps = [[] for _ in range(self.max_swap_number)]
+
+        def __is_round_trip(_prev_key: List[int], _key: List[int]) -> bool:
+            return (_prev_key[EXCHANGE] == _key[EXCHANGE] and
+                    _prev_key[VERSION] == _key[VERSION] and
+                    _prev_key[TOKEN_IN] == _key[TOKEN_OUT] and
+                    _prev_key[TOKEN_OUT] == _key[TOKEN_IN])
+
+        def __search(_path: List[int]):
+            _key = edge_keys[_path[-1]]
+            if _key[TOKEN_OUT] == token_out:
+                if len(_path) == 1 or not __is_round_trip(edge_keys[_path[-2]], _key):
+                    paths_by_swaps[len(_path) - 1].append(list(_path))
+                return
+
+            for _next_row in adjacency[self.max_swap_number - len(_path)].get(_key[TOKEN_OUT], []):
+                _path.append(_next_row)
+                __search(_path)
+                _path.pop()
+
+        for row in adjacency[self.max_swap_number].get(token_in, []):
+            __search([row])
+
+        return [np.array(paths, dtype=np.int64) for paths in paths_by_swaps]
+
+    def __join_paths(self, edges: np.ndarray, token_in: int, token_out: int) -> List[np.ndarray]:
         """
+        Vectorized version of DexBase.__dfs_paths
+        All partial paths are extended by one swap at a time, by joining them with
+        the hop candidates of their last token_out using CSR adjacency arrays
 
-        def __sample_paths_list(_n_total_hops: int,
-                                _nth_hop: int,
-                                _prev_pool: None or List[int],
-                                _sampled: List[List[int]],
-                                _pool_samples: Dict[int, List[List[List[int]]]],
-                                _paths: List[List[List[int]]]):
-            """
-            Uses recursive looping to fill in paths_list
-
-            :param _n_total_hops: the number of hops you are trying to sample. ex) 1, 2, 3, ...
-            :param _nth_hop: out of the _n_total_hops which _nth_hop are you on
-            :param _prev_pool: the previous pool index. ex) (0, 0, 1, 2, 0)
-            :param _sampled: the sampled pools we should append to _paths
-            :param _pool_samples: pool_samples we made from the above sampling process
-            :param _paths: the list that collects all viable combination of pools
-            """
+        :return: paths_by_swaps[n - 1] is the np.ndarray of paths with n swaps
+        """
+        keys = self.storage_keys
+        edge_token_in = keys[edges, TOKEN_IN]
+        swaps_to_token_out = self.__swaps_to_token_out(edges, token_out)
+        edge_swaps_to_token_out = swaps_to_token_out[keys[edges, TOKEN_OUT]] + 1
+
+        def __csr_adjacency(_n_swaps: int) -> tuple:
+            # edges that can reach token_out in _n_swaps or less, sorted by token_in
+            # the sort is stable, so the order of edges is kept
+            _edges = edges[edge_swaps_to_token_out <= _n_swaps]
+            _token_in = keys[_edges, TOKEN_IN]
+            _degree = np.bincount(_token_in, minlength=len(self.tokens_list))
+            return _edges[np.argsort(_token_in, kind='stable')], _degree, np.cumsum(_degree) - _degree
+
+        paths_by_swaps = []
+        frontier = edges[(edge_token_in == token_in) & (edge_swaps_to_token_out <= self.max_swap_number)]
+        frontier = frontier.reshape(-1, 1)
+
+        for n_swaps in range(1, self.max_swap_number + 1):
+            last_rows = frontier[:, -1]
+            done = keys[last_rows, TOKEN_OUT] == token_out
+
+            if n_swaps == 1:
+                paths_by_swaps.append(frontier[done])
+            else:
+                # the last swap sells on the same pool that was bought from in the previous swap
+                prev_keys = keys[frontier[:, -2]]
+                last_keys = keys[last_rows]
+                round_trip = ((prev_keys[:, EXCHANGE] == last_keys[:, EXCHANGE]) &
+                              (prev_keys[:, VERSION] == last_keys[:, VERSION]) &
+                              (prev_keys[:, TOKEN_IN] == last_keys[:, TOKEN_OUT]) &
+                              (prev_keys[:, TOKEN_OUT] == last_keys[:, TOKEN_IN]))
+                paths_by_swaps.append(frontier[done & ~round_trip])
+
+            if n_swaps == self.max_swap_number:
+                break
+
+            # join the paths that haven't reached token_out with their next hop candidates
+            csr_edges, degree, offsets = __csr_adjacency(self.max_swap_number - n_swaps)
+            frontier = frontier[~done]
+            next_tokens = keys[frontier[:, -1], TOKEN_OUT]
+            counts = degree[next_tokens]
+            parents = np.repeat(np.arange(frontier.shape[0]), counts)
+            within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            children = csr_edges[np.repeat(offsets[next_tokens], counts) + within]
+            frontier = np.hstack([frontier[parents], children.reshape(-1, 1)])
+
+        return paths_by_swaps
+
+    def _get_rows(self, indexes: np.ndarray) -> np.ndarray:
+        """
+        Vectorized lookup of storage_rows
+        :param indexes: np.ndarray: (n, 5) indexes of directed pools
+        :return: np.ndarray: (n,) rows of storage_array
+        """
+        dims = (len(self.chains_list), len(self.exchanges_list), len(self.tokens_list), len(self.tokens_list), 2)
+        storage_codes = np.ravel_multi_index(tuple(self.storage_keys.T), dims)
+        sorter = np.argsort(storage_codes)
+        codes = np.ravel_multi_index(tuple(indexes.T), dims)
+        return sorter[np.searchsorted(storage_codes, codes, sorter=sorter)]
 
-            for _p in _pool_samples[_n_total_hops][_nth_hop]:
-                _sampled[_nth_hop] = _p
-                if _prev_pool is None or _prev_pool[TOKEN_OUT] == _p[TOKEN_IN]:
-                    if _nth_hop == _n_total_hops - 1:
-                        if _prev_pool:
-                            """
-                            Exclude swaps that buy from the previous step, and sells on this one
-                            ex) ETH -> USDT -> ETH
-                            (ETH/USDT, USDT/ETH pools on the same exchange, version are considered equal)
-
-                            This isn't necessarily true in Uniswap V3 variants, because different fee levels can exist.
-                            However, we exclude that scenario for simplicity.
-                            """
-                            same_exchange = _prev_pool[EXCHANGE] == _p[EXCHANGE]
-                            same_version = _prev_pool[VERSION] == _p[VERSION]
-                            same_pool = _prev_pool[TOKEN_IN] == _p[TOKEN_OUT] and _prev_pool[TOKEN_OUT] == _p[
-                                TOKEN_IN]
-                            if not (same_exchange and same_version and same_pool):
-                                _paths.append(_sampled.copy())
-                        else:
-                            _paths.append(_sampled.copy())
-                    else:
-                        __sample_paths_list(_n_total_hops,
-                                            _nth_hop + 1,
-                                            _p,
-                                            _sampled,
-                                            _pool_samples,
-                                            _paths)
-
-        # Step #2
-        # Generate swap paths by applying conditional checks to see if token_in, token_out is in sync
-        paths = []
-        empty_pool = [0, 0, 0, 0, 0]
-
-        for i in range(1, self.max_swap_number + 1):
-            if len(pool_samples[i]) > 0:
-                sampled = [empty_pool] * self.max_swap_number
-                prev_pool = None
-                __sample_paths_list(_n_total_hops=i,
-                                    _nth_hop=0,
-                                    _prev_pool=prev_pool,
-                                    _sampled=sampled,
-                                    _pool_samples=pool_samples,
-                                    _paths=paths)
-
-        return paths
+    def _build_price_index(self):
+        """
+        Gathers the hop indexes of every swap path into flat index arrays
+        This internal function has to be called after DEX.swap_paths has been generated
+
+        Values that don't change after loading (version, token0_is_input, decimals) are
+        resolved here, so that each price update only has to read reserves/sqrtPriceX96
+        """
+        for symbol in self.trading_symbols:
+            paths_arr = self.swap_paths[symbol]['path']
+
+            # an empty hop is filled with [0, 0, 0, 0, 0], and points to row 0 of storage_array
+            hop_mask = np.any(paths_arr != 0, axis=2)
+            hop_rows = np.zeros(hop_mask.shape, dtype=np.int64)
+            hop_rows[hop_mask] = self._get_rows(paths_arr[hop_mask])
+
+            hops = self.storage_array[hop_rows]
+            hop_v2 = paths_arr[:, :, VERSION] == V2
+            hop_token0_in = hops[:, :, TOKEN0_IN] == 1
+            hop_scale = 10.0 ** (hops[:, :, DECIMALS0] - hops[:, :, DECIMALS1])
+
+            chain_ids = paths_arr[:, 0, CHAIN]
+            chain_rows = {
+                self.chain_to_id[chain]: np.flatnonzero(chain_ids == self.chain_to_id[chain])
+                for chain in self.chains_list
+            }
+
+            self.price_index[symbol] = {
+                'hop_rows': hop_rows,            # np.ndarray: (n, max_swap_number), rows of storage_array
+                'hop_mask': hop_mask,            # np.ndarray: (n, max_swap_number), False for empty hops
+                'hop_v2': hop_v2,                # np.ndarray: (n, max_swap_number)
+                'hop_token0_in': hop_token0_in,  # np.ndarray: (n, max_swap_number)
+                'hop_scale': hop_scale,          # np.ndarray: (n, max_swap_number), 10 ** (decimals0 - decimals1)
+                'chain_rows': chain_rows,        # Dict[int, np.ndarray]: path rows that start in each chain
+            }
 
 
 class NoSymbolError(Exception):
@@ -420,13 +876,41 @@ class DEX(DexBase):
                  tokens: Dict[str, Dict[str, List[str or int]]],
                  pools: List[Dict[str, Any]],
                  trading_symbols: List[str],
-                 max_swap_number: int = 3):
-
+                 max_swap_number: int = 3,
+                 path_generator: str = 'dfs',
+                 cache_dir: str = None,
+                 v3_tick_words: int = 2,
+                 batch_pricing: bool = True,
+                 multicall_chunk_size: int = 500,
+                 multicall_retries: int = 3,
+                 kernels: str = 'numpy'):
+        """
+        :param path_generator: refer to DexBase
+        :param cache_dir: refer to DexBase
+        :param v3_tick_words: refer to DexBase
+        :param multicall_chunk_size: refer to DexBase
+        :param multicall_retries: refer to DexBase
+
+        :param batch_pricing: price all swap paths of a symbol at once using NumPy fancy indexing
+                              on DEX.price_index, rather than looping through each path and hop.
+                              Set to False to fall back to the per-path loop
+        :param kernels: backend of the batch path pricing, estimate_amounts_out math (simulation.kernels)
+                        - numpy: vectorized NumPy
+                        - numba: loops compiled with Numba, falls back to numpy if Numba isn't installed
+        """
         super().__init__(rpc_endpoints,
                          tokens,
                          pools,
                          trading_symbols,
-                         max_swap_number)
+                         max_swap_number,
+                         path_generator,
+                         cache_dir,
+                         v3_tick_words,
+                         multicall_chunk_size,
+                         multicall_retries)
+
+        self.batch_pricing = batch_pricing
+        self.kernels = load_kernels(kernels)
 
         self.load()
 
@@ -455,8 +939,10 @@ class DEX(DexBase):
                   t1: int,
                   v: int) -> tuple:
 
-        idx = (c, e, t0, t1, v)
-        dec0, dec1, res0, res1, sqrt, fee, tok0, _ = self.storage_array[idx]
+        self.refresh_storage()
+
+        row = self.storage_rows[(c, e, t0, t1, v)]
+        dec0, dec1, res0, res1, sqrt, fee, tok0, _ = self.storage_array[row]
 
         if v == V2:
             price = self.sim_v2.reserves_to_price(res0, res1, dec0, dec1, bool(tok0))
@@ -489,66 +975,451 @@ class DEX(DexBase):
         if symbol not in self.trading_symbols:
             raise NoSymbolError(f'{symbol} not in {self.trading_symbols}')
 
+        if self.batch_pricing:
+            self._batch_update_price_for_symbol(chain, symbol)
+        else:
+            self._loop_update_price_for_symbol(chain, symbol)
+
+    def _batch_update_price_for_symbol(self, chain: str, symbol: str):
+        """
+        Vectorized version of DEX._loop_update_price_for_symbol
+        Prices every path of the symbol that starts in chain with a handful of NumPy operations
+        """
+        rows = self.price_index[symbol]['chain_rows'][self.chain_to_id[chain]]
+        if rows.shape[0] == 0:
+            return
+
+        price, fee = self._batch_path_prices(symbol, rows)
+        self.swap_paths[symbol]['price'][rows] = price
+        self.swap_paths[symbol]['fee'][rows] = fee
+
+    def _batch_path_prices(self, symbol: str, rows: np.ndarray) -> tuple:
+        """
+        Returns the price, fee of the swap paths at rows of DEX.swap_paths[symbol]
+        The math is identical to that of DEX.get_price, applied to every hop at once
+        """
+        self.refresh_storage()
+
+        index = self.price_index[symbol]
+        return self.kernels.path_prices(self.storage_array[:, RESERVE0],
+                                        self.storage_array[:, RESERVE1],
+                                        self.storage_array[:, SQRT_PRICE],
+                                        self.storage_array[:, FEE],
+                                        index['hop_rows'],
+                                        index['hop_mask'],
+                                        index['hop_v2'],
+                                        index['hop_token0_in'],
+                                        index['hop_scale'],
+                                        np.asarray(rows, dtype=np.int64))
+
+    def estimate_amounts_out(self,
+                             symbol: str,
+                             rows: np.ndarray or List[int],
+                             amounts_in: np.ndarray or List[int],
+                             sell: bool = False) -> np.ndarray:
+        """
+        Estimates the amounts out of swapping amounts_in through the swap paths at rows of DEX.swap_paths[symbol]
+        in float64, to screen paths before simulating them exactly with get_v2_amounts_out or get_route
+
+        Uniswap V2 variant hops use the constant product formula on the reserves,
+        Uniswap V3 variant hops assume the swap stays within the current tick (refer to simulation.kernels)
+
+        :param sell: refer to DEX.get_v2_amounts_out
+        :param amounts_in: amounts in the smallest unit of token_in (1 USDT = 1,000,000)
+        :return: np.ndarray: (len(rows), len(amounts_in))
+        """
+        self.refresh_storage()
+
+        index = self.price_index[symbol]
+        rows = np.asarray(rows, dtype=np.int64)
+
+        # V3 liquidity isn't in storage_array, so it's gathered for the V3 hops of the paths
+        liquidity = np.zeros(self.storage_array.shape[0])
+        hop_mask = index['hop_mask'][rows] & ~index['hop_v2'][rows]
+        for row in np.unique(index['hop_rows'][rows][hop_mask]).tolist():
+            v3_pool = self.v3_pools.get(int(self.storage_array[row, POOL_INDEX]))
+            if v3_pool is not None:
+                liquidity[row] = v3_pool.liquidity
+
+        return self.kernels.path_amounts_out(np.asarray(amounts_in, dtype=np.float64),
+                                             self.storage_array[:, RESERVE0],
+                                             self.storage_array[:, RESERVE1],
+                                             self.storage_array[:, SQRT_PRICE],
+                                             liquidity,
+                                             self.storage_array[:, FEE],
+                                             index['hop_rows'],
+                                             index['hop_mask'],
+                                             index['hop_v2'],
+                                             index['hop_token0_in'],
+                                             rows,
+                                             sell)
+
+    def get_v2_amounts_out(self,
+                           symbol: str,
+                           rows: np.ndarray or List[int],
+                           amounts_in: np.ndarray or List[int],
+                           sell: bool = False) -> np.ndarray:
+        """
+        Simulates swapping amounts_in through the swap paths at rows of DEX.swap_paths[symbol]
+        using exact reserves, and returns the same values as SimulatorV1.simulateSwapIn
+        Only paths that go through Uniswap V2 variant pools can be simulated
+
+        ex) symbol: ETH/USDT
+        - sell=False: buy, USDT -> ETH, the hops of the path in order
+        - sell=True: sell, ETH -> USDT, the hops of the path in reverse order
+
+        :param amounts_in: amounts in the smallest unit of token_in (1 USDT = 1,000,000)
+        :return: np.ndarray of Python ints: (len(rows), len(amounts_in)), 0 if the swap would revert
+        """
+        index = self.price_index[symbol]
+        rows = np.asarray(rows, dtype=np.int64)
+
+        hop_rows = index['hop_rows'][rows]
+        hop_mask = index['hop_mask'][rows]
+        hop_token0_in = index['hop_token0_in'][rows]
+
+        if not np.all(index['hop_v2'][rows][hop_mask]):
+            raise ValueError(f'{symbol}: only swap paths of Uniswap V2 variant pools can be simulated offline')
+
+        reserve0 = self.exact_reserves[hop_rows, 0]
+        reserve1 = self.exact_reserves[hop_rows, 1]
+
+        # selling swaps token_out -> token_in of each hop
+        token0_in = ~hop_token0_in if sell else hop_token0_in
+        reserves_in = np.where(token0_in, reserve0, reserve1)
+        reserves_out = np.where(token0_in, reserve1, reserve0)
+        fees = np.rint(self.storage_array[hop_rows, FEE] * 1000000).astype(np.int64)
+
+        amounts = np.tile(to_uint(amounts_in), (len(rows), 1))
+        hops = reversed(range(hop_mask.shape[1])) if sell else range(hop_mask.shape[1])
+
+        for h in hops:
+            mask = hop_mask[:, h]
+            for fee in np.unique(fees[mask, h]):
+                # empty hops are skipped, and hops are grouped by fee
+                hop = mask & (fees[:, h] == fee)
+                amounts[hop] = self.sim_v2.get_amounts_out(amounts[hop],
+                                                           reserves_in[hop, h][:, None],
+                                                           reserves_out[hop, h][:, None],
+                                                           fee)
+
+        return amounts
+
+    def get_route(self, symbol: str, buy_row: int, sell_row: int) -> List[Dict[str, Any]]:
+        """
+        Returns the cyclic arbitrage route of buying through swap path buy_row
+        and selling through swap path sell_row of DEX.swap_paths[symbol], in the format of ArbitrageOptimizer
+
+        ex) symbol: ETH/USDT
+        - buy: USDT -> ETH, the hops of buy_row in order
+        - sell: ETH -> USDT, the hops of sell_row in reverse order
+        """
+        index = self.price_index[symbol]
+        pool_indexes = self.swap_paths[symbol]['pool_indexes']
+
+        route = []
+
+        for row, sell in [(buy_row, False), (sell_row, True)]:
+            hops = np.flatnonzero(index['hop_mask'][row])
+
+            for h in (hops[::-1] if sell else hops):
+                pool_idx = pool_indexes[row][h]
+                # selling swaps token_out -> token_in of each hop
+                token0_in = bool(index['hop_token0_in'][row, h]) != sell
+
+                if index['hop_v2'][row, h]:
+                    reserve0, reserve1 = self.exact_reserves[index['hop_rows'][row, h]]
+                    route.append({
+                        'version': 2,
+                        'reserve_in': reserve0 if token0_in else reserve1,
+                        'reserve_out': reserve1 if token0_in else reserve0,
+                        'fee': self.pools[pool_idx]['fee'],
+                    })
+                else:
+                    route.append({
+                        'version': 3,
+                        'pool': self.v3_pools[pool_idx],
+                        'zero_for_one': token0_in,
+                    })
+
+        return route
+
+    def get_optimal_amounts_in(self,
+                               symbol: str,
+                               pairs: np.ndarray or List[List[int]],
+                               max_amount_in: int,
+                               tolerance: float = 1e-6) -> tuple:
+        """
+        Sizes every buy/sell swap path pair of DEX.swap_paths[symbol] in one call
+
+        :param pairs: (buy_row, sell_row) of swap paths, ex) [[0, 5], [5, 0], ...]
+        :param max_amount_in: in the smallest unit of token_in (1 USDT = 1,000,000)
+        :return: (amounts_in, profits), refer to ArbitrageOptimizer.optimal_amounts_in
+        """
+        routes = [self.get_route(symbol, buy_row, sell_row) for buy_row, sell_row in pairs]
+        return self.optimizer.optimal_amounts_in(routes, max_amount_in, tolerance)
+
+    def _loop_update_price_for_symbol(self, chain: str, symbol: str):
         chain_idx = self.chain_to_id[chain]
         paths_arr = self.swap_paths[symbol]['path']
 
         for i in np.arange(paths_arr.shape[0]):
-            path = paths_arr[i]
-
             # There is always a first pool, so check the first pool's chain id
-            if path[0][0] == chain_idx:
-                price = 1
-                fee = 1
-                for p_step in np.arange(path.shape[0]):
-                    idx = path[p_step]
-                    if np.sum(idx) == 0:
-                        break
-                    _p, _f = self.get_price(*idx)
-                    """
-                    Take the inverse of price.
-                    This is needed because if you are trying to BUY ETH with USDT,
-                    then token_in will be USDT, and token_out will be ETH.
-                    Thus, the quote amount of ETH you get for providing 1 USDT is currently: 0.0005387 ETH.
-                    However, we want the price to be in the format of ETH/USDT = 1856.32 USDT.
-                    (*This is the equivalent format of CEX price quotes. Binance ETH/USDT = 1856.xx USDT)
-                    To get this value, we take the inverse of price.
-                    1 / 0.0005387 = 1856.32
-                    """
-                    price = price * (1 / _p)
-                    fee = fee * (1 - _f)
-
-                self.swap_paths[symbol]['price'][i] = price
-                self.swap_paths[symbol]['fee'][i] = 1 - fee
+            if paths_arr[i][0][0] == chain_idx:
+                self._loop_update_path_price(symbol, i)
+
+    def _loop_update_path_price(self, symbol: str, i: int):
+        path = self.swap_paths[symbol]['path'][i]
+
+        price = 1
+        fee = 1
+        for p_step in np.arange(path.shape[0]):
+            idx = path[p_step]
+            if np.sum(idx) == 0:
+                break
+            _p, _f = self.get_price(*idx)
+            """
+            Take the inverse of price.
+            This is needed because if you are trying to BUY ETH with USDT,
+            then token_in will be USDT, and token_out will be ETH.
+            Thus, the quote amount of ETH you get for providing 1 USDT is currently: 0.0005387 ETH.
+            However, we want the price to be in the format of ETH/USDT = 1856.32 USDT.
+            (*This is the equivalent format of CEX price quotes. Binance ETH/USDT = 1856.xx USDT)
+            To get this value, we take the inverse of price.
+            1 / 0.0005387 = 1856.32
+            """
+            price = price * (1 / _p)
+            fee = fee * (1 - _f)
+
+        self.swap_paths[symbol]['price'][i] = price
+        self.swap_paths[symbol]['fee'][i] = 1 - fee
+
+    def update_pool(self,
+                    pool_idx: int,
+                    reserve0: int = None,
+                    reserve1: int = None,
+                    sqrt_price: int = None,
+                    liquidity: int = None,
+                    tick: int = None,
+                    reprice: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Updates the storage values of the pool at DEX.pools[pool_idx] and re-prices
+        only the swap paths that go through this pool, using DEX.pool_to_paths
+
+        - Uniswap V2 variants: reserve0, reserve1
+        - Uniswap V3 variants: sqrt_price, liquidity, tick (values from Swap events)
+
+        Returns the symbols that had their prices updated, with the rows of DEX.swap_paths[symbol] re-priced
+        ex) {'ETH/USDT': np.array([0, 3, 7])}
+
+        If reprice is False, only the storage values are updated and the rows returned have to be
+        re-priced later with DEX.reprice (used to re-price once for many updates)
+        """
+        pool = self.pools[pool_idx]
+        chain = pool['chain']
+        exchange = pool['exchange']
+        token0 = pool['token0']
+        token1 = pool['token1']
+
+        if pool['version'] == 2:
+            self.update_reserves(chain, exchange, token0, token1, reserve0, reserve1)
+        else:
+            self.update_sqrt_price(chain, exchange, token0, token1, sqrt_price)
+            if pool_idx in self.v3_pools:
+                self.v3_pools[pool_idx].update_slot0(sqrt_price, tick, liquidity)
+
+        symbols = {}
+
+        for symbol, row_hops in self.pool_to_paths[pool_idx].items():
+            rows = np.unique(row_hops[:, 0])
+            if reprice:
+                self.reprice(symbol, rows)
+            symbols[symbol] = rows
+
+        return symbols
+
+    def reprice(self, symbol: str, rows: np.ndarray):
+        """
+        Re-prices the rows of DEX.swap_paths[symbol] from the current storage values
+        """
+        if self.batch_pricing:
+            price, fee = self._batch_path_prices(symbol, rows)
+            self.swap_paths[symbol]['price'][rows] = price
+            self.swap_paths[symbol]['fee'][rows] = fee
+        else:
+            for i in rows:
+                self._loop_update_path_price(symbol, i)
+
+    def update_position(self, pool_idx: int, tick_lower: int, tick_upper: int, liquidity_delta: int):
+        """
+        Updates the ticks, liquidity of the Uniswap V3 variant pool at DEX.pools[pool_idx]
+        with the values from Mint (liquidity_delta > 0), Burn (liquidity_delta < 0) events
+
+        Prices don't change with Mint, Burn events, so no swap paths are re-priced
+        """
+        self.v3_pools[pool_idx].update_position(tick_lower, tick_upper, liquidity_delta)
+
+    def pool_state(self, pool_idx: int) -> tuple:
+        """
+        Returns the values of the pool at DEX.pools[pool_idx] that events change, with its position in DEX.pool_blocks
+        (ticks changed by Mint, Burn events aren't included, they're reverted with the events)
+
+        - Uniswap V2 variants: (block number, log index, reserve0, reserve1)
+        - Uniswap V3 variants: (block number, log index, sqrtPriceX96, tick, liquidity)
+        """
+        block_number, log_index = self.pool_blocks[pool_idx].tolist()
+
+        if self.pools[pool_idx]['version'] == 2:
+            return (block_number, log_index, *self.get_reserves(pool_idx))
+
+        v3_pool = self.v3_pools[pool_idx]
+        return block_number, log_index, v3_pool.sqrt_price_x96, v3_pool.tick, v3_pool.liquidity
+
+    def restore_pool_state(self,
+                           pool_idx: int,
+                           state: tuple,
+                           positions: List[tuple] = ()) -> Dict[str, np.ndarray]:
+        """
+        Puts the pool back in a state returned from DEX.pool_state
+
+        :param positions: (tick_lower, tick_upper, liquidity_delta) of the Mint, Burn events applied since,
+                          in the order they were applied
+        :return: the symbols with the rows of DEX.swap_paths[symbol] to re-price, in the format of DEX.update_pool
+        """
+        pool = self.pools[pool_idx]
+
+        if pool['version'] == 2:
+            _, _, reserve0, reserve1 = state
+            symbols = self.update_pool(pool_idx, reserve0=reserve0, reserve1=reserve1, reprice=False)
+        else:
+            _, _, sqrt_price, tick, liquidity = state
+            for tick_lower, tick_upper, liquidity_delta in reversed(positions):
+                self.update_position(pool_idx, tick_lower, tick_upper, -liquidity_delta)
+            symbols = self.update_pool(pool_idx, sqrt_price=sqrt_price, liquidity=liquidity, tick=tick, reprice=False)
+
+        self.set_pool_block(pool_idx, state[0], state[1])
+
+        return symbols
+
+    def resnapshot(self, chain: str) -> Dict[str, np.ndarray]:
+        """
+        Reloads the state of the pools of chain with Multicall queries pinned to the latest block,
+        and re-prices the swap paths that go through them
+
+        Used to resync when too many blocks were missed to backfill them with logs
+        Returns the symbols re-priced with their rows, in the format of DEX.update_pool
+        """
+        return self.apply_snapshot(chain, self.fetch_snapshot(chain))
+
+    def fetch_snapshot(self, chain: str) -> tuple:
+        """
+        Sends the Multicall queries of DEX.resnapshot without changing the state of the pools,
+        so that it can run in a worker thread (refer to DexStream.resync)
+
+        :return: (storage values, V3 pool state, block number the queries were sent at), for DEX.apply_snapshot
+        """
+        multicall_results = self._fetch_pool_data([chain])
+        v3_state = self._fetch_v3_pool_state(multicall_results)
+        return multicall_results, v3_state, self.pinned_blocks.get(chain)
+
+    def apply_snapshot(self, chain: str, snapshot: tuple) -> Dict[str, np.ndarray]:
+        """
+        Sets the pools of chain to the values returned from DEX.fetch_snapshot, and re-prices their swap paths
+        """
+        multicall_results, v3_state, block_number = snapshot
+
+        if block_number is not None:
+            self.block_numbers[chain] = block_number
+
+        self._fill_v3_pool_state(multicall_results, v3_state)
+
+        rows_by_symbol = {}
+
+        for pool_idx, storage_data in multicall_results.items():
+            pool_idx = int(pool_idx)
+            pool = self.pools[pool_idx]
+
+            if pool['version'] == 2:
+                self.update_reserves(chain, pool['exchange'], pool['token0'], pool['token1'],
+                                     storage_data[0], storage_data[1])
+            else:
+                self.update_sqrt_price(chain, pool['exchange'], pool['token0'], pool['token1'], storage_data[0])
+
+            self.set_pool_block(pool_idx, self.block_numbers.get(chain, 0))
+
+            for symbol, row_hops in self.pool_to_paths[pool_idx].items():
+                rows_by_symbol.setdefault(symbol, []).append(row_hops[:, 0])
+
+        symbols = {}
+
+        for symbol, rows_list in rows_by_symbol.items():
+            rows = np.unique(np.concatenate(rows_list))
+            self.reprice(symbol, rows)
+            symbols[symbol] = rows
+
+        return symbols
+
+    def get_reserves(self, pool_idx: int) -> List[int]:
+        """
+        Returns the exact reserve0, reserve1 of the Uniswap V2 variant pool at DEX.pools[pool_idx]
+        """
+        pool = self.pools[pool_idx]
+        idx = self.get_index(pool['chain'], pool['exchange'], pool['token0'], pool['token1'], 2)
+        return self.exact_reserves[self.storage_rows[idx]].tolist()
 
     def update_reserves(self,
                         chain: str,
                         exchange: str,
                         token0: str,
                         token1: str,
-                        reserve0: float,
-                        reserve1: float):
+                        reserve0: int,
+                        reserve1: int):
 
         idx_1 = self.get_index(chain, exchange, token0, token1, 2)
         idx_2 = (idx_1[0], idx_1[1], idx_1[3], idx_1[2], idx_1[4])
 
-        self.storage_array[idx_1][RESERVE0] = reserve0
-        self.storage_array[idx_1][RESERVE1] = reserve1
-
-        self.storage_array[idx_2][RESERVE0] = reserve0
-        self.storage_array[idx_2][RESERVE1] = reserve1
+        rows = [self.storage_rows[idx_1], self.storage_rows[idx_2]]
+        self.exact_reserves[rows, 0] = int(reserve0)
+        self.exact_reserves[rows, 1] = int(reserve1)
+        self.stale_rows.update(rows)
 
     def update_sqrt_price(self,
                           chain: str,
                           exchange: str,
                           token0: str,
                           token1: str,
-                          sqrt_price: float):
+                          sqrt_price: int):
 
         idx_1 = self.get_index(chain, exchange, token0, token1, 3)
         idx_2 = (idx_1[0], idx_1[1], idx_1[3], idx_1[2], idx_1[4])
 
-        self.storage_array[idx_1][SQRT_PRICE] = sqrt_price
-        self.storage_array[idx_2][SQRT_PRICE] = sqrt_price
+        rows = [self.storage_rows[idx_1], self.storage_rows[idx_2]]
+        self.exact_sqrt_prices[rows] = int(sqrt_price)
+        self.stale_rows.update(rows)
+
+    def get_sqrt_price(self, pool_idx: int) -> int:
+        """
+        Returns the exact sqrtPriceX96 of the Uniswap V3 variant pool at DEX.pools[pool_idx]
+        """
+        pool = self.pools[pool_idx]
+        idx = self.get_index(pool['chain'], pool['exchange'], pool['token0'], pool['token1'], 3)
+        return self.exact_sqrt_prices[self.storage_rows[idx]]
+
+    def refresh_storage(self):
+        """
+        Recomputes the float reserves, sqrtPriceX96 of storage_array from the exact values,
+        only for the rows changed since the last call (DEX.stale_rows)
+        """
+        if not self.stale_rows:
+            return
+
+        rows = np.fromiter(self.stale_rows, dtype=np.int64, count=len(self.stale_rows))
+        self.stale_rows.clear()
+
+        # float(int) rounds to the nearest float64, rather than truncating
+        self.storage_array[rows, RESERVE0] = self.exact_reserves[rows, 0].astype(np.float64)
+        self.storage_array[rows, RESERVE1] = self.exact_reserves[rows, 1].astype(np.float64)
+        self.storage_array[rows, SQRT_PRICE] = self.exact_sqrt_prices[rows].astype(np.float64)
 
     def debug_message(self,
                       chain: str,
@@ -1,7 +1,6 @@
 import os
 import json
 import time
-import eth_abi
 import asyncio
 import aiohttp
 import datetime
@@ -11,15 +10,33 @@ import numpy as np
 import aioprocessing
 from functools import partial
 from dotenv import load_dotenv
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from data.dex import DEX
-from data.utils import reconnecting_websocket_loop, calculate_next_block_base_fee
+from data.journal import UndoJournal
+from data.latency import stamp, RECEIVE, DECODE, UPDATE, REPRICE, PUBLISH
+from data.price_board import PriceBoard, board_message_format
+from data.recorder import FrameRecorder
+from data.log_decoder import loads, decode_sync, decode_swap, decode_mint, decode_burn, decode_int_topic
+from data.utils import reconnecting_websocket_loop, json_rpc, calculate_next_block_base_fee
 
 load_dotenv(override=True)
 
 BLOCKNATIVE_TOKEN = os.getenv('BLOCKNATIVE_TOKEN')
 
+# 0x prefixed, lowercase hex strings, the same format as topics in logs
+SYNC_EVENT_SELECTOR, SWAP_EVENT_SELECTOR, MINT_EVENT_SELECTOR, BURN_EVENT_SELECTOR = [
+    eth_utils.encode_hex(eth_utils.keccak(text=event)) for event in [
+        'Sync(uint112,uint112)',  # Uniswap V2 variants
+        'Swap(address,address,int256,int256,uint160,uint128,int24)',  # Uniswap V3 variants
+        'Mint(address,address,int24,int24,uint128,uint256,uint256)',
+        'Burn(address,int24,int24,uint128,uint256,uint256)',
+    ]
+]
+
+# Topics in a nested list are OR'ed
+POOL_EVENT_SELECTORS = [SYNC_EVENT_SELECTOR, SWAP_EVENT_SELECTOR, MINT_EVENT_SELECTOR, BURN_EVENT_SELECTOR]
+
 
 def default_message_format(symbol: str,
                            message: Dict[str, Any],
@@ -50,6 +67,52 @@ def default_message_format(symbol: str,
     }
 
 
+def topology_message(dex: DEX) -> Dict[str, Any]:
+    """
+    Values of DEX.swap_paths that don't change after DEX.load (path, pool_indexes, tag),
+    sent once at setup along with the prices at load time,
+    so that event messages only have to carry what changed
+
+    :return: {'source': 'dex', 'type': 'topology', 'swap_paths': {symbol: {'path', 'pool_indexes', 'tag', 'price', 'fee'}}}
+    """
+    return {
+        'source': 'dex',
+        'type': 'topology',
+        'swap_paths': {
+            symbol: {
+                'path': paths['path'].tolist(),
+                'pool_indexes': paths['pool_indexes'],
+                'tag': paths['tag'],
+                'price': paths['price'].tolist(),
+                'fee': paths['fee'].tolist(),
+            }
+            for symbol, paths in dex.swap_paths.items()
+        },
+    }
+
+
+def delta_message_format(symbol: str,
+                         message: Dict[str, Any],
+                         block_number: int,
+                         rows: np.ndarray) -> Dict[str, Any]:
+    """
+    Event message with only the rows of the swap paths that were re-priced,
+    the rest is sent once with topology_message
+
+    :param message: value of DEX.swap_paths[symbol]
+    :param rows: rows of DEX.swap_paths[symbol] re-priced, refer to DEX.update_pool
+    """
+    return {
+        'source': 'dex',
+        'type': 'delta',
+        'block': block_number,
+        'symbol': symbol,
+        'rows': rows.tolist(),
+        'price': message['price'][rows].tolist(),
+        'fee': message['fee'][rows].tolist(),
+    }
+
+
 class DexStream:
 
     def __init__(self,
@@ -57,7 +120,18 @@ class DexStream:
                  ws_endpoints: Dict[str, str],
                  publisher: Optional[aioprocessing.AioQueue] = None,
                  message_formatter: Callable = default_message_format,
-                 debug: bool = False):
+                 debug: bool = False,
+                 price_board: Optional[PriceBoard] = None,
+                 deltas: bool = False,
+                 coalesce: bool = False,
+                 coalesce_interval: float = 0.05,
+                 recorder: Optional[FrameRecorder] = None,
+                 trace_latency: bool = False,
+                 resync: bool = True,
+                 max_backfill_blocks: int = 1000,
+                 logs_block_range: int = 500,
+                 reorg_depth: int = 64,
+                 publish_reserves: bool = False):
         """
         :param dex: DEX instance
 
@@ -69,51 +143,564 @@ class DexStream:
 
         :param message_formatter: is used to format message sent through the publisher
                                   this data will be accessed from the main process
+
+        :param price_board: if given, prices/fees are written to the shared memory board
+                            and only (symbol, block, version) notifications are sent through the publisher
+                            (message_formatter isn't used in this case)
+
+        :param deltas: if True, event messages only carry the re-priced rows (delta_message_format),
+                       send topology_message at setup when using this
+
+        :param coalesce: if True, pool updates of the same block are applied first, and the swap paths are
+                         re-priced/published once per symbol when:
+                         1. an event of a new block arrives, 2. coalesce_interval seconds pass,
+                         3. stream_new_blocks receives a new block
+                         published messages have 'updates': the number of pool updates folded into them
+
+        :param recorder: if given, raw websocket frames are recorded to replay later, refer to data.recorder
+
+        :param trace_latency: if True, event messages have 'trace': the monotonic timestamps (ns) of the stages
+                              the event went through (receive, decode, update, reprice, publish),
+                              and block messages the time the newHeads frame was received and published,
+                              refer to data.latency
+
+        :param resync: if True, the pools are brought up to the latest block every time a stream (re)connects,
+                       with the logs of the missed blocks, refer to DexStream.resync
+
+        :param max_backfill_blocks: if more blocks than this were missed, the pools are re-loaded with Multicall
+                                    rather than backfilled with logs
+
+        :param logs_block_range: the max number of blocks in a single eth_getLogs request
+
+        :param reorg_depth: the number of latest blocks kept in the undo journal of each chain,
+                            reorgs up to this depth are rolled back, refer to data.journal
+
+        :param publish_reserves: if True, the exact reserves of the Uniswap V2 variant pools updated are added to
+                                 the published messages as 'reserves': {pool_idx: [reserve0, reserve1]},
+                                 for strategies that simulate V2 swaps offline
         """
         self.dex = dex
         self.ws_endpoints = ws_endpoints
         self.publisher = publisher
         self.message_formatter = message_formatter
         self.debug = debug
+        self.price_board = price_board
+        self.deltas = deltas
+        self.coalesce = coalesce
+        self.coalesce_interval = coalesce_interval
+        self.recorder = recorder
+        self.trace_latency = trace_latency
+        self.resync_on_connect = resync
+        self.max_backfill_blocks = max_backfill_blocks
+        self.logs_block_range = logs_block_range
+        self.publish_reserves = publish_reserves
+
+        # latency trace of the frame being handled
+        self.trace: Optional[Dict[str, int]] = None
+
+        # chain -> {'block': int, 'rows': {symbol: [np.ndarray]}, 'updates': int, 'reserves': dict,
+        #           'timer': asyncio.TimerHandle, 'trace': dict}
+        self.pending_updates = {}
+
+        # chain -> np.ndarray, refer to handle_new_block
+        self.historical_gas = {}
+
+        # chain -> UndoJournal of the pool states changed by the latest blocks
+        self.journals = {chain: UndoJournal(reorg_depth) for chain in dex.chains_list}
+
+        # chain -> asyncio.Lock, so that streams of a chain that (re)connect together don't resync at the same time
+        self.resync_locks = {}
 
     def publish(self, data: Any):
         if self.publisher:
             self.publisher.put(data)
 
-    def start_streams(self):
-        streams = []
+    def receive(self, chain: str, frame: str or bytes):
+        """
+        Called with every websocket frame received: starts the latency trace of the frame and records it
+        """
+        if self.trace_latency:
+            self.trace = {RECEIVE: stamp()}
+        if self.recorder:
+            self.recorder.write(chain, frame)
+
+    def trace_stage(self, stage: str):
+        if self.trace is not None:
+            self.trace[stage] = stamp()
+
+    def publish_symbols(self,
+                        symbols: Dict[str, np.ndarray],
+                        block_number: int,
+                        updates: Optional[int] = None,
+                        reserves: Optional[Dict[int, List[int]]] = None):
+        """
+        Publishes the updated prices of symbols, through the price board if there is one
 
-        for chain in self.dex.chains_list:
-            block_stream = reconnecting_websocket_loop(
-                partial(self.stream_new_blocks, chain),
-                tag=f'{chain.upper()}_Blocks'
-            )
-            streams.append(block_stream)
+        :param symbols: symbols with the rows re-priced, returned from DEX.update_pool
+        :param updates: number of pool updates folded into this publish (coalesce mode)
+        :param reserves: exact reserves of the V2 pools updated, sent along with every message (publish_reserves)
+        """
+        for symbol, rows in symbols.items():
+            swap_paths = self.dex.swap_paths[symbol]
+            if self.price_board:
+                version = self.price_board.write(symbol, swap_paths['price'], swap_paths['fee'], block_number)
+                message = board_message_format(symbol, block_number, version)
+            elif self.deltas:
+                message = delta_message_format(symbol, swap_paths, block_number, rows)
+            else:
+                message = self.message_formatter(symbol, swap_paths, block_number)
+
+            if updates is not None:
+                message['updates'] = updates
+
+            if reserves:
+                message['reserves'] = reserves
+
+            if self.trace is not None:
+                message['trace'] = {**self.trace, PUBLISH: stamp()}
+
+            self.publish(message)
+
+    def update_pool(self, chain: str, block_number: int, pool_idx: int, **values):
+        """
+        Updates the pool with DEX.update_pool and publishes the re-priced symbols,
+        or with coalesce=True, adds the update to the pending updates of the block
+        """
+        reserves = None
+        if self.publish_reserves and values.get('reserve0') is not None:
+            reserves = {pool_idx: [values['reserve0'], values['reserve1']]}
+
+        if not self.coalesce:
+            symbols = self.dex.update_pool(pool_idx, reprice=False, **values)
+            self.trace_stage(UPDATE)
+            for symbol, rows in symbols.items():
+                self.dex.reprice(symbol, rows)
+            self.trace_stage(REPRICE)
+            self.publish_symbols(symbols, block_number, reserves=reserves)
+            return
+
+        pending = self.pending_updates.get(chain)
+
+        if pending is not None and pending['block'] != block_number:
+            self.flush_updates(chain)
+            pending = None
+
+        if pending is None:
+            loop = asyncio.get_event_loop()
+            pending = {
+                'block': block_number,
+                'rows': {},
+                'updates': 0,
+                'reserves': {},
+                'timer': loop.call_later(self.coalesce_interval, self.flush_updates, chain),
+                # the first update of the block is traced
+                'trace': self.trace,
+            }
+            self.pending_updates[chain] = pending
+
+        symbols = self.dex.update_pool(pool_idx, reprice=False, **values)
+        self.trace_stage(UPDATE)
+
+        for symbol, rows in symbols.items():
+            pending['rows'].setdefault(symbol, []).append(rows)
+        pending['updates'] += 1
+        if reserves:
+            pending['reserves'].update(reserves)
+
+    def flush_updates(self, chain: str):
+        """
+        Re-prices the rows touched by the pending updates of chain once, and publishes each symbol once
+        """
+        pending = self.pending_updates.pop(chain, None)
+
+        if pending is None:
+            return
+
+        pending['timer'].cancel()
+
+        # publish with the trace of the block, and go back to the trace of the frame being handled
+        trace = self.trace
+        self.trace = pending['trace']
+
+        symbols = self.reprice(pending['rows'])
+        self.trace_stage(REPRICE)
+
+        self.publish_symbols(symbols, pending['block'], pending['updates'], pending['reserves'])
+        self.trace = trace
+
+        if self.debug:
+            print(f'{datetime.datetime.now()} Block #{pending["block"]}: '
+                  f'{pending["updates"]} updates -> {len(symbols)} symbols published')
+
+    def v2_reserves(self, pools: Set[int]) -> Optional[Dict[int, List[int]]]:
+        """
+        Returns the exact reserves of the Uniswap V2 variant pools in pools to publish, None if publish_reserves is off
+        """
+        if not self.publish_reserves:
+            return None
+        return {i: self.dex.get_reserves(i) for i in sorted(pools) if self.dex.pools[i]['version'] == 2}
+
+    def reprice(self, rows_by_symbol: Dict[str, List[np.ndarray]]) -> Dict[str, np.ndarray]:
+        """
+        Re-prices the rows collected from many pool updates once per symbol
+
+        :param rows_by_symbol: the rows returned from DEX.update_pool(reprice=False) by symbol
+        :return: the symbols re-priced with their rows, in the format of DEX.update_pool
+        """
+        symbols = {}
+        for symbol, rows_list in rows_by_symbol.items():
+            rows = np.unique(np.concatenate(rows_list))
+            self.dex.reprice(symbol, rows)
+            symbols[symbol] = rows
+        return symbols
+
+    def start_streams(self, multiplex: bool = True):
+        """
+        :param multiplex: if True, uses a single websocket per chain for new blocks and all pool events
+                          (stream_events), otherwise opens a websocket per stream
+        """
+        streams = []
 
         for chain in self.dex.chains_list:
-            v2_stream = reconnecting_websocket_loop(
-                partial(self.stream_uniswap_v2_events, chain),
-                tag=f'{chain.upper()}_V2'
-            )
-            v3_stream = reconnecting_websocket_loop(
-                partial(self.stream_uniswap_v3_events, chain),
-                tag=f'{chain.upper()}_V3'
-            )
-            streams.extend([asyncio.ensure_future(f) for f in [v2_stream, v3_stream]])
+            if multiplex:
+                streams.append(reconnecting_websocket_loop(
+                    partial(self.stream_events, chain),
+                    tag=f'{chain.upper()}_Events'
+                ))
+            else:
+                streams.extend([
+                    reconnecting_websocket_loop(partial(self.stream_new_blocks, chain), tag=f'{chain.upper()}_Blocks'),
+                    reconnecting_websocket_loop(partial(self.stream_uniswap_v2_events, chain), tag=f'{chain.upper()}_V2'),
+                    reconnecting_websocket_loop(partial(self.stream_uniswap_v3_events, chain), tag=f'{chain.upper()}_V3'),
+                ])
 
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(asyncio.wait(streams))
+        loop.run_until_complete(asyncio.wait([asyncio.ensure_future(f) for f in streams]))
 
-    async def stream_uniswap_v2_events(self, chain: str):
-        filtered_pools = [
-            pool for pool in self.dex.pools
-            if pool['chain'] == chain and pool['version'] == 2
-        ]
-        pools = {pool['address'].lower(): pool for pool in filtered_pools}
+    def chain_pools(self, chain: str, versions: tuple = (2, 3)) -> Dict[str, int]:
+        """
+        :return: address (lowercase) -> index of the pool in DEX.pools
+        """
+        return {
+            pool['address'].lower(): pool_idx for pool_idx, pool in enumerate(self.dex.pools)
+            if pool['chain'] == chain and pool['version'] in versions
+        }
+
+    async def resync(self, chain: str) -> Optional[Dict[str, Any]]:
+        """
+        Brings the pools of chain up to the latest block before streaming (re)starts,
+        so that logs sent while the websocket was down aren't lost
+
+        Resyncs of a chain run one at a time: with separate V2, V3 streams (multiplex=False),
+        the stream that reconnects second waits for the resync of the first one,
+        then only resyncs the blocks produced in the meantime (usually none)
+
+        - the logs of our pools in the blocks after DEX.block_numbers[chain] are fetched with eth_getLogs
+          and applied in order, then the swap paths they touched are re-priced and published once
+        - if more than max_backfill_blocks blocks were missed, or eth_getLogs fails, the pools are re-loaded
+          with Multicall queries pinned to the latest block instead (DEX.fetch_snapshot, DEX.apply_snapshot)
+
+        Logs the subscriptions send again for resynced blocks are skipped with DEX.pool_blocks
+
+        :return: None if there was nothing to resync
+        ex) {'from': 17000001, 'to': 17000012, 'method': 'eth_getLogs', 'logs': 84, 'took': 0.12}
+        """
+        if not self.resync_on_connect or chain not in self.dex.block_numbers:
+            # pool data wasn't loaded from a node
+            return None
+
+        if chain not in self.resync_locks:
+            self.resync_locks[chain] = asyncio.Lock()
+
+        async with self.resync_locks[chain]:
+            return await self._resync(chain)
+
+    async def _resync(self, chain: str) -> Optional[Dict[str, Any]]:
+        s = time.time()
+        synced = self.dex.block_numbers[chain]
+
+        if chain in self.pending_updates:
+            self.flush_updates(chain)
+
+        async with aiohttp.ClientSession() as session:
+            latest = int(await json_rpc(session, self.dex.rpc_endpoints[chain], 'eth_blockNumber', []), base=16)
+
+            if latest <= synced:
+                return None
+
+            result = None
+
+            if latest - synced <= self.max_backfill_blocks:
+                try:
+                    logs = await self.get_logs(session, chain, synced + 1, latest)
+                    symbols, pools = self.backfill(chain, logs)
+                    result = {'method': 'eth_getLogs', 'logs': len(logs)}
+                except Exception as e:
+                    print(f'{chain.upper()} eth_getLogs backfill failed: {e}')
+
+        if result is None:
+            # the Multicall queries run in a worker thread, so that the streams of other chains aren't held up,
+            # then the pools are set on the event loop
+            loop = asyncio.get_running_loop()
+            snapshot = await loop.run_in_executor(None, self.dex.fetch_snapshot, chain)
+            symbols = self.dex.apply_snapshot(chain, snapshot)
+            pools = set(self.chain_pools(chain).values())
+            # states before the snapshot can't be rolled back to
+            self.journals[chain].clear()
+            latest = self.dex.block_numbers[chain]
+            result = {'method': 'Multicall', 'logs': 0}
+
+        self.dex.block_numbers[chain] = latest
+
+        # the resync isn't traced as a frame
+        self.trace = None
+
+        self.publish_symbols(symbols, latest, reserves=self.v2_reserves(pools))
+
+        result.update({'from': synced + 1, 'to': latest, 'took': time.time() - s})
+
+        print(f'{datetime.datetime.now()} {chain.upper()} resynced blocks #{synced + 1} - #{latest} '
+              f'with {result["method"]} ({result["logs"]} logs) -> took: {result["took"]} seconds')
+
+        return result
+
+    async def get_logs(self,
+                       session: aiohttp.ClientSession,
+                       chain: str,
+                       from_block: int,
+                       to_block: int) -> List[Dict[str, Any]]:
+        """
+        Returns the logs of our pools from from_block to to_block (inclusive), in the order they were emitted
+        Requests of logs_block_range blocks are sent concurrently
+        """
+        url = self.dex.rpc_endpoints[chain]
+        log_filter = {'address': list(self.chain_pools(chain).keys()), 'topics': [POOL_EVENT_SELECTORS]}
+
+        requests = []
+        for block_number in range(from_block, to_block + 1, self.logs_block_range):
+            params = {
+                **log_filter,
+                'fromBlock': hex(block_number),
+                'toBlock': hex(min(block_number + self.logs_block_range - 1, to_block)),
+            }
+            requests.append(json_rpc(session, url, 'eth_getLogs', [params]))
+
+        logs = [log for result in await asyncio.gather(*requests) for log in result if not log.get('removed')]
+        logs.sort(key=lambda log: (int(log['blockNumber'], base=16), int(log['logIndex'], base=16)))
+        return logs
+
+    def backfill(self, chain: str, logs: List[Dict[str, Any]]) -> Tuple[Dict[str, np.ndarray], Set[int]]:
+        """
+        Applies logs returned from get_logs without publishing, and re-prices the swap paths they touched once
+
+        :return: the symbols re-priced with their rows (in the format of DEX.update_pool), the pools updated
+        """
+        pools = self.chain_pools(chain)
+        rows_by_symbol = {}
+        updated = set()
+
+        for event in logs:
+            pool_idx = pools.get(event['address'].lower())
+            if pool_idx is None:
+                continue
+
+            block_number, log_index = int(event['blockNumber'], base=16), int(event['logIndex'], base=16)
+            entry = self.journal_entry(chain, block_number, event.get('blockHash'))
+
+            if not self.dex.is_new_event(pool_idx, block_number, log_index):
+                continue
+
+            if entry is not None and pool_idx not in entry['pools']:
+                entry['pools'][pool_idx] = self.dex.pool_state(pool_idx)
+            self.dex.set_pool_block(pool_idx, block_number, log_index)
+
+            event_selector = event['topics'][0]
+
+            if event_selector == SYNC_EVENT_SELECTOR:
+                data = decode_sync(event['data'])
+                symbols = self.dex.update_pool(pool_idx, reserve0=data[0], reserve1=data[1], reprice=False)
+            elif event_selector == SWAP_EVENT_SELECTOR:
+                data = decode_swap(event['data'])
+                symbols = self.dex.update_pool(pool_idx, sqrt_price=data[2], liquidity=data[3], tick=data[4],
+                                               reprice=False)
+            elif event_selector in [MINT_EVENT_SELECTOR, BURN_EVENT_SELECTOR]:
+                position = self.update_position(pool_idx, event)
+                if entry is not None:
+                    entry['positions'].setdefault(pool_idx, []).append(position)
+                continue
+            else:
+                continue
+
+            updated.add(pool_idx)
+            for symbol, rows in symbols.items():
+                rows_by_symbol.setdefault(symbol, []).append(rows)
+
+        return self.reprice(rows_by_symbol), updated
+
+    def journal_entry(self, chain: str, block_number: int, block_hash: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Returns the undo journal entry of the block of a log, None for logs without a block hash
+
+        If we have another block on the height of the log, that block was dropped by a reorg,
+        and it's rolled back along with the blocks after it before the log is applied
+        """
+        if block_hash is None:
+            return None
 
-        sync_event_selector = self.dex.web3[chain].keccak(
-            text='Sync(uint112,uint112)'
-        ).hex()
+        journal = self.journals[chain]
+        known_hash = journal.hashes.get(block_number)
+
+        if known_hash is not None and known_hash != block_hash:
+            symbols, pools = self.rollback(chain, block_number)
+            self.publish_symbols(symbols, block_number - 1, reserves=self.v2_reserves(pools))
+
+        return journal.entry(block_hash, block_number)
+
+    def rollback(self, chain: str, from_block: int) -> Tuple[Dict[str, np.ndarray], Set[int]]:
+        """
+        Rolls the pools of chain back to their states before from_block with the undo journal,
+        and re-prices the swap paths that go through the pools restored
+
+        :return: the symbols re-priced with their rows in the format of DEX.update_pool, and the pools restored
+        """
+        s = time.time()
+
+        # pending updates are of the blocks rolled back, or before them
+        if chain in self.pending_updates:
+            self.flush_updates(chain)
+
+        blocks = self.journals[chain].pop_blocks(from_block)
+        rows_by_symbol = {}
+        restored = set()
+
+        # latest block first, so that each pool ends up in the state before the earliest block that changed it
+        for _, entry in blocks:
+            for pool_idx, state in entry['pools'].items():
+                symbols = self.dex.restore_pool_state(pool_idx, state, entry['positions'].get(pool_idx, []))
+                restored.add(pool_idx)
+                for symbol, rows in symbols.items():
+                    rows_by_symbol.setdefault(symbol, []).append(rows)
+
+        if chain in self.dex.block_numbers:
+            self.dex.block_numbers[chain] = min(self.dex.block_numbers[chain], from_block - 1)
+
+        symbols = self.reprice(rows_by_symbol)
+
+        print(f'{datetime.datetime.now()} {chain.upper()} reorg: rolled back {len(blocks)} blocks from #{from_block}, '
+              f'{len(restored)} pools restored -> took: {time.time() - s} seconds')
+
+        return symbols, restored
+
+    def handle_removed_log(self, chain: str, event: Dict[str, Any]):
+        """
+        A log with removed: True is sent for every log of a block dropped by a reorg.
+        The first of them rolls back the block and the blocks after it,
+        the logs of the new blocks are sent by the subscription after them
+        """
+        block_number = self.journals[chain].get_block_number(event.get('blockHash'))
+
+        if block_number is None:
+            # already rolled back, or older than the journal
+            return
+
+        symbols, pools = self.rollback(chain, block_number)
+        self.publish_symbols(symbols, block_number - 1, reserves=self.v2_reserves(pools))
+
+    async def check_reorg(self, chain: str, block: Dict[str, Any]):
+        """
+        Compares a new block with the blocks we have. If the new block isn't built on them,
+        the dropped blocks are rolled back and the logs of the new blocks are re-applied with DexStream.resync
+
+        Ancestors of the new block are requested from the node until one matches a block we have
+        """
+        block_hash = block.get('hash')
+        if block_hash is None:
+            return
+
+        journal = self.journals[chain]
+        block_number = int(block['number'], base=16)
+
+        if journal.hashes.get(block_number) == block_hash:
+            # logs of the block came before it
+            return
+
+        # blocks we have on this height and above aren't on the new chain
+        fork_block = block_number if any(n >= block_number for n in journal.hashes) else None
+
+        number, expected_hash = block_number - 1, block.get('parentHash')
+
+        if number in journal.hashes and journal.hashes[number] != expected_hash:
+            async with aiohttp.ClientSession() as session:
+                while number in journal.hashes and journal.hashes[number] != expected_hash:
+                    fork_block = number
+                    ancestor = await json_rpc(session, self.dex.rpc_endpoints[chain],
+                                              'eth_getBlockByNumber', [hex(number), False])
+                    number, expected_hash = number - 1, ancestor['parentHash']
+
+        if fork_block is not None:
+            symbols, pools = self.rollback(chain, fork_block)
+            await self.resync(chain)
+            self.publish_symbols(symbols, block_number, reserves=self.v2_reserves(pools))
+
+        journal.set_hash(block_number, block_hash)
+
+    async def stream_events(self, chain: str):
+        """
+        Streams new blocks, Uniswap V2 and V3 events of chain through a single websocket
+
+        The log subscription is filtered by the addresses of our pools on the node,
+        and Sync, Swap, Mint, Burn events are OR'ed in a single topic filter.
+        Notifications are routed by their subscription id
+        """
+        pools = self.chain_pools(chain)
+
+        async with websockets.connect(self.ws_endpoints[chain]) as ws:
+            # request id -> subscription
+            requests = {
+                1: ['newHeads'],
+                2: ['logs', {'address': list(pools.keys()), 'topics': [POOL_EVENT_SELECTORS]}],
+            }
+
+            for request_id, params in requests.items():
+                subscription = {
+                    'jsonrpc': '2.0',
+                    'id': request_id,
+                    'method': 'eth_subscribe',
+                    'params': params,
+                }
+                await ws.send(json.dumps(subscription))
+
+            # logs missed before the subscriptions are applied first, the subscriptions queue up meanwhile
+            await self.resync(chain)
+
+            # subscription id -> request id
+            subscriptions = {}
+
+            while True:
+                frame = await asyncio.wait_for(ws.recv(), timeout=60 * 10)
+                self.receive(chain, frame)
+                msg = loads(frame)
+
+                if 'id' in msg:
+                    # response to eth_subscribe
+                    if 'error' in msg:
+                        raise Exception(f'eth_subscribe {requests[msg["id"]]} failed: {msg["error"]}')
+                    subscriptions[msg['result']] = msg['id']
+                    continue
+
+                params = msg['params']
+                request_id = subscriptions.get(params['subscription'])
+
+                if request_id == 1:
+                    await self.new_block(chain, params['result'])
+                elif request_id == 2:
+                    event = params['result']
+                    pool_idx = pools.get(event['address'].lower())
+                    if pool_idx is not None:
+                        self.handle_pool_event(chain, pool_idx, event)
+
+    async def stream_uniswap_v2_events(self, chain: str):
+        pools = self.chain_pools(chain, versions=(2,))
 
         async with websockets.connect(self.ws_endpoints[chain]) as ws:
             subscription = {
@@ -122,104 +709,176 @@ class DexStream:
                 'method': 'eth_subscribe',
                 'params': [
                     'logs',
-                    {'topics': [sync_event_selector]}
+                    {'address': list(pools.keys()), 'topics': [SYNC_EVENT_SELECTOR]}
                 ]
             }
 
             await ws.send(json.dumps(subscription))
             _ = await ws.recv()
 
+            await self.resync(chain)
+
             while True:
                 msg = await asyncio.wait_for(ws.recv(), timeout=60 * 10)
-                event = json.loads(msg)['params']['result']
+                self.receive(chain, msg)
+                event = loads(msg)['params']['result']
                 address = event['address'].lower()
 
                 if address in pools:
-                    s = time.time()
-                    block_number = int(event['blockNumber'], base=16)
-                    pool = pools[address]
-                    data = eth_abi.decode(
-                        ['uint112', 'uint112'],
-                        eth_utils.decode_hex(event['data'])
-                    )
-
-                    chain = pool['chain']
-                    exchange = pool['exchange']
-                    token0 = pool['token0']
-                    token1 = pool['token1']
-
-                    self.dex.update_reserves(chain, exchange, token0, token1, data[0], data[1])
-
-                    symbols = self.dex.get_symbols_to_update(token0, token1)
-                    for symbol in symbols:
-                        self.dex.update_price_for_symbol(chain, symbol)
-                        self.publish(self.message_formatter(symbol, self.dex.swap_paths[symbol], block_number))
-                    e = time.time()
-
-                    if self.debug:
-                        dbg_msg = self.dex.debug_message(chain, exchange, token0, token1, 2)
-                        print(f'{datetime.datetime.now()} {dbg_msg} -> Update took: {e - s} seconds')
+                    self.handle_pool_event(chain, pools[address], event)
 
     async def stream_uniswap_v3_events(self, chain: str):
-        filtered_pools = [
-            pool for pool in self.dex.pools
-            if pool['chain'] == chain and pool['version'] == 3
-        ]
-        pools = {pool['address'].lower(): pool for pool in filtered_pools}
-
-        swap_event_selector = self.dex.web3[chain].keccak(
-            text='Swap(address,address,int256,int256,uint160,uint128,int24)'
-        ).hex()
+        pools = self.chain_pools(chain, versions=(3,))
 
         async with websockets.connect(self.ws_endpoints[chain]) as ws:
+            """
+            Mint, Burn events don't change prices, but change the ticks/liquidity of pools,
+            which are used to simulate swaps offline
+            Topics in a nested list are OR'ed: Swap or Mint or Burn
+            """
             subscription = {
                 'json': '2.0',
                 'id': 1,
                 'method': 'eth_subscribe',
                 'params': [
                     'logs',
-                    {'topics': [swap_event_selector]}
+                    {'address': list(pools.keys()),
+                     'topics': [[SWAP_EVENT_SELECTOR, MINT_EVENT_SELECTOR, BURN_EVENT_SELECTOR]]}
                 ]
             }
 
             await ws.send(json.dumps(subscription))
             _ = await ws.recv()
 
+            await self.resync(chain)
+
             while True:
                 msg = await asyncio.wait_for(ws.recv(), timeout=60 * 10)
-                event = json.loads(msg)['params']['result']
+                self.receive(chain, msg)
+                event = loads(msg)['params']['result']
                 address = event['address'].lower()
 
                 if address in pools:
-                    # we don't need the sender, recipient data in topics
-                    s = time.time()
-                    block_number = int(event['blockNumber'], base=16)
-                    pool = pools[address]
-                    data = eth_abi.decode(
-                        ['int256', 'int256', 'uint160', 'uint128', 'int24'],
-                        eth_utils.decode_hex(event['data'])
-                    )
-
-                    chain = pool['chain']
-                    exchange = pool['exchange']
-                    token0 = pool['token0']
-                    token1 = pool['token1']
-
-                    self.dex.update_sqrt_price(chain, exchange, token0, token1, data[2])
-
-                    symbols = self.dex.get_symbols_to_update(token0, token1)
-                    for symbol in symbols:
-                        self.dex.update_price_for_symbol(chain, symbol)
-                        self.publish(self.message_formatter(symbol, self.dex.swap_paths[symbol], block_number))
-                    e = time.time()
-
-                    if self.debug:
-                        dbg_msg = self.dex.debug_message(chain, exchange, token0, token1, 3)
-                        print(f'{datetime.datetime.now()} {dbg_msg} -> Update took: {e - s} seconds')
+                    self.handle_pool_event(chain, pools[address], event)
+
+    def handle_pool_event(self, chain: str, pool_idx: int, event: Dict[str, Any]):
+        """
+        Updates DEX with a log of the pool at DEX.pools[pool_idx]:
+        Sync (Uniswap V2 variants), Swap, Mint, Burn (Uniswap V3 variants)
+        """
+        s = time.time()
+        block_number = int(event['blockNumber'], base=16)
+
+        if event.get('removed'):
+            # the block of the log was dropped by a reorg
+            self.handle_removed_log(chain, event)
+            return
+
+        entry = self.journal_entry(chain, block_number, event.get('blockHash'))
+
+        log_index = event.get('logIndex')
+        if log_index is not None:
+            log_index = int(log_index, base=16)
+            if not self.dex.is_new_event(pool_idx, block_number, log_index):
+                # already applied by resync
+                return
+
+        if entry is not None and pool_idx not in entry['pools']:
+            # the state before the first change the block makes to the pool
+            entry['pools'][pool_idx] = self.dex.pool_state(pool_idx)
+
+        if log_index is not None:
+            self.dex.set_pool_block(pool_idx, block_number, log_index)
+
+        pool = self.dex.pools[pool_idx]
+        topics = event['topics']
+        event_selector = topics[0]
+
+        if event_selector == SYNC_EVENT_SELECTOR:
+            data = decode_sync(event['data'])
+            self.trace_stage(DECODE)
+
+            # re-prices only the paths that go through this pool
+            self.update_pool(chain, block_number, pool_idx, reserve0=data[0], reserve1=data[1])
+
+        elif event_selector == SWAP_EVENT_SELECTOR:
+            # we don't need the sender, recipient data in topics
+            data = decode_swap(event['data'])
+            self.trace_stage(DECODE)
+            self.update_pool(chain, block_number, pool_idx, sqrt_price=data[2], liquidity=data[3], tick=data[4])
+
+        elif event_selector in [MINT_EVENT_SELECTOR, BURN_EVENT_SELECTOR]:
+            position = self.update_position(pool_idx, event)
+            if entry is not None:
+                entry['positions'].setdefault(pool_idx, []).append(position)
+            return
+
+        else:
+            return
+
+        e = time.time()
+
+        if self.debug:
+            dbg_msg = self.dex.debug_message(chain, pool['exchange'], pool['token0'], pool['token1'], pool['version'])
+            print(f'{datetime.datetime.now()} {dbg_msg} -> Update took: {e - s} seconds')
+
+    def update_position(self, pool_idx: int, event: Dict[str, Any]) -> Tuple[int, int, int]:
+        """
+        Updates the ticks, liquidity of the pool with a Mint or Burn log
+
+        :return: tick_lower, tick_upper, liquidity_delta of the position
+        """
+        # Mint: tickLower, tickUpper are indexed topics, data: sender, amount, amount0, amount1
+        # Burn: tickLower, tickUpper are indexed topics, data: amount, amount0, amount1
+        topics = event['topics']
+        tick_lower, tick_upper = decode_int_topic(topics[2]), decode_int_topic(topics[3])
+        if topics[0] == MINT_EVENT_SELECTOR:
+            liquidity_delta = decode_mint(event['data'])
+        else:
+            liquidity_delta = -decode_burn(event['data'])
+
+        self.dex.update_position(pool_idx, tick_lower, tick_upper, liquidity_delta)
+        return tick_lower, tick_upper, liquidity_delta
 
     async def stream_new_blocks(self, chain: str):
+        async with websockets.connect(self.ws_endpoints[chain]) as ws:
+            subscription = {
+                'json': '2.0',
+                'id': 1,
+                'method': 'eth_subscribe',
+                'params': ['newHeads']
+            }
+
+            await ws.send(json.dumps(subscription))
+            _ = await ws.recv()
+
+            while True:
+                msg = await asyncio.wait_for(ws.recv(), timeout=60 * 10)
+                self.receive(chain, msg)
+                block = loads(msg)['params']['result']
+                await self.new_block(chain, block, wait=True)
+
+    async def new_block(self, chain: str, block: Dict[str, Any], wait: bool = False):
         """
-        Retrieves new blocks and calculates base fees accordingly
+        Handles a block from the newHeads subscription: a reorg is handled right away (DexStream.check_reorg),
+        before the logs that follow, then gas prices are updated with DexStream.handle_new_block
+
+        :param wait: if False, handle_new_block runs in the background,
+                     so that gas price requests don't hold up the events of the block
+        """
+        # the trace of the newHeads frame, the frames that follow start their own
+        trace = self.trace
+
+        await self.check_reorg(chain, block)
+
+        if wait:
+            await self.handle_new_block(chain, block, trace)
+        else:
+            asyncio.ensure_future(self.handle_new_block(chain, block, trace))
+
+    async def handle_new_block(self, chain: str, block: Dict[str, Any], trace: Optional[Dict[str, int]] = None):
+        """
+        Calculates base fees of new blocks
         Base fees are calculated adhering to the EIP-1559 implementation and
         max_price, max_priority_fee_per_gas, max_fee_per_gas are retrieved using Blocknative's gas estimator endpoint
 
@@ -233,75 +892,76 @@ class DexStream:
         filled in at real-time
         Thus, at start-up this data is an empty numpy array with all 0's
         """
-        historical_gas = np.zeros((3, 100))
+        if chain not in self.historical_gas:
+            self.historical_gas[chain] = np.zeros((3, 100))
+
+        historical_gas = self.historical_gas[chain]
 
         # index of historical_gas
         BASE_FEE = 0
         MAX_PRIORITY_FEE_PER_GAS = 1
         MAX_FEE_PER_GAS = 2
 
-        async with websockets.connect(self.ws_endpoints[chain]) as ws:
-            subscription = {
-                'json': '2.0',
-                'id': 1,
-                'method': 'eth_subscribe',
-                'params': ['newHeads']
-            }
+        gwei = 10 ** 9
 
-            await ws.send(json.dumps(subscription))
-            _ = await ws.recv()
+        block_number = int(block['number'], base=16)
+        base_fee = calculate_next_block_base_fee(block)
 
-            gwei = 10 ** 9
+        # updates of previous blocks are complete once a new block arrives
+        pending = self.pending_updates.get(chain)
+        if pending is not None and pending['block'] < block_number:
+            self.flush_updates(chain)
 
-            while True:
-                msg = await asyncio.wait_for(ws.recv(), timeout=60 * 10)
-                block = json.loads(msg)['params']['result']
-                block_number = int(block['number'], base=16)
-                base_fee = calculate_next_block_base_fee(block)
-
-                """
-                For Ethereum and Polygon, use gas price estimation tools provided by Blocknative
-                https://www.blocknative.com/gas-estimator
-                
-                Run only if a token is given
-                """
-                if chain in ['ethereum', 'polygon'] and BLOCKNATIVE_TOKEN:
-                    chain_id = 1 if 'ethereum' else 137
-                    headers = {'Authorization': BLOCKNATIVE_TOKEN}
-                    async with aiohttp.ClientSession(headers=headers) as session:
-                        async with session.get(f'https://api.blocknative.com/gasprices/blockprices?chainId={chain_id}') as r:
-                            res = await r.json()
-                            estimated_price = res['blockPrices'][0]['estimatedPrices'][0]
-
-                            max_priority_fee_per_gas = estimated_price['maxPriorityFeePerGas']
-                            max_fee_per_gas = estimated_price['maxFeePerGas']
-
-                            new_gas_data = [
-                                base_fee,
-                                int(max_priority_fee_per_gas * gwei),
-                                int(max_fee_per_gas * gwei)
-                            ]
-                else:
-                    new_gas_data = [base_fee, 0, 0]
-
-                """
-                update historical_gas data as you would an Deque data structure
-                
-                Currently this data does nothing, however, it can be used to optimize gas costs later
-                """
-                historical_gas[:, 0:-1] = historical_gas[:, 1:]
-                historical_gas[:, -1] = new_gas_data
-
-                data = {
-                    'source': 'dex',
-                    'type': 'block',
-                    'chain': chain,
-                    'block': block_number,
-                    'base_fee': int(historical_gas[BASE_FEE, -1]),
-                    'max_priority_fee_per_gas': int(historical_gas[MAX_PRIORITY_FEE_PER_GAS, -1]),
-                    'max_fee_per_gas': int(historical_gas[MAX_FEE_PER_GAS, -1]),
-                }
-                self.publish(data)
+        if chain in self.dex.block_numbers:
+            self.dex.block_numbers[chain] = max(self.dex.block_numbers[chain], block_number - 1)
+
+        """
+        For Ethereum and Polygon, use gas price estimation tools provided by Blocknative
+        https://www.blocknative.com/gas-estimator
+
+        Run only if a token is given
+        """
+        if chain in ['ethereum', 'polygon'] and BLOCKNATIVE_TOKEN:
+            chain_id = 1 if 'ethereum' else 137
+            headers = {'Authorization': BLOCKNATIVE_TOKEN}
+            async with aiohttp.ClientSession(headers=headers) as session:
+                async with session.get(f'https://api.blocknative.com/gasprices/blockprices?chainId={chain_id}') as r:
+                    res = await r.json()
+                    estimated_price = res['blockPrices'][0]['estimatedPrices'][0]
+
+                    max_priority_fee_per_gas = estimated_price['maxPriorityFeePerGas']
+                    max_fee_per_gas = estimated_price['maxFeePerGas']
+
+                    new_gas_data = [
+                        base_fee,
+                        int(max_priority_fee_per_gas * gwei),
+                        int(max_fee_per_gas * gwei)
+                    ]
+        else:
+            new_gas_data = [base_fee, 0, 0]
+
+        """
+        update historical_gas data as you would an Deque data structure
+
+        Currently this data does nothing, however, it can be used to optimize gas costs later
+        """
+        historical_gas[:, 0:-1] = historical_gas[:, 1:]
+        historical_gas[:, -1] = new_gas_data
+
+        data = {
+            'source': 'dex',
+            'type': 'block',
+            'chain': chain,
+            'block': block_number,
+            'base_fee': int(historical_gas[BASE_FEE, -1]),
+            'max_priority_fee_per_gas': int(historical_gas[MAX_PRIORITY_FEE_PER_GAS, -1]),
+            'max_fee_per_gas': int(historical_gas[MAX_FEE_PER_GAS, -1]),
+        }
+
+        if trace is not None:
+            data['trace'] = {**trace, PUBLISH: stamp()}
+
+        self.publish(data)
 
 
 if __name__ == '__main__':
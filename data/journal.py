@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class UndoJournal:
+    """
+    Per-block undo journal of the pool states of a chain, used to roll back blocks dropped by reorgs
+
+    Before a block first changes a pool, the state of the pool (DEX.pool_state) is saved in the entry of the block,
+    which is keyed by block hash. Mint/Burn positions applied in the block are kept as well, to be reverted.
+    Rolling back a block restores the saved states of only the pools it changed, so the cost of a rollback is
+    O(changed pools) rather than that of a reload.
+
+    Only the latest max_blocks blocks are kept: deeper reorgs can't be rolled back
+
+    ex) journal = UndoJournal()
+        entry = journal.entry(block_hash, block_number)
+        if pool_idx not in entry['pools']:
+            entry['pools'][pool_idx] = dex.pool_state(pool_idx)
+    """
+
+    def __init__(self, max_blocks: int = 64):
+        self.max_blocks = max_blocks
+
+        """
+        blocks
+        : block hash -> entry of the block, in the order the blocks were first seen
+
+        ex) {'0x...': {'number': 17000000,
+                       'pools': {3: (17000000, 12, reserve0, reserve1)},
+                       'positions': {0: [(tick_lower, tick_upper, liquidity_delta)]}}, ...}
+        """
+        self.blocks = OrderedDict()
+
+        # block number -> hash of the block we have on that height, from logs and new blocks
+        self.hashes: Dict[int, str] = {}
+
+    def entry(self, block_hash: str, block_number: int) -> Dict[str, Any]:
+        """
+        Returns the entry of the block, a new one if the block wasn't seen before
+        """
+        entry = self.blocks.get(block_hash)
+
+        if entry is None:
+            entry = {'number': block_number, 'pools': {}, 'positions': {}}
+            self.blocks[block_hash] = entry
+            self.set_hash(block_number, block_hash)
+
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+
+        return entry
+
+    def set_hash(self, block_number: int, block_hash: str):
+        self.hashes[block_number] = block_hash
+
+        # heights too old to be rolled back aren't needed
+        for number in [n for n in self.hashes if n <= block_number - self.max_blocks]:
+            del self.hashes[number]
+
+    def get_block_number(self, block_hash: str) -> Optional[int]:
+        entry = self.blocks.get(block_hash)
+        return None if entry is None else entry['number']
+
+    def pop_blocks(self, from_block: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Removes the entries of from_block and the blocks after it
+
+        :return: (block hash, entry) of the removed blocks, latest first
+        """
+        popped = [(h, e) for h, e in self.blocks.items() if e['number'] >= from_block]
+
+        for block_hash, _ in popped:
+            del self.blocks[block_hash]
+
+        for number in [n for n in self.hashes if n >= from_block]:
+            del self.hashes[number]
+
+        return popped[::-1]
+
+    def clear(self):
+        self.blocks.clear()
+        self.hashes.clear()
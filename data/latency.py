@@ -0,0 +1,173 @@
+"""
+Per-stage latency instrumentation of the data -> strategy -> execution path
+
+Each pool event carries a trace: {stage: time.monotonic_ns()} stamped at every stage it goes through,
+DexStream stamps the data stages and sends the trace along with the message,
+and the strategy stamps the rest and records the trace to a LatencyTracker.
+
+Pending orders are also simulated when a new block arrives, the block message carries a trace of BLOCK_STAGES
+(newHeads frame received -> block message put on the queue -> ...), which is recorded to a LatencyTracker of its own
+CLOCK_MONOTONIC is shared by all processes of a machine, so stamps from different processes can be compared
+"""
+import time
+import asyncio
+import numpy as np
+from typing import Dict, List
+
+# DexStream
+RECEIVE = 'receive'  # websocket frame received
+DECODE = 'decode'  # JSON envelope, log data decoded
+UPDATE = 'update'  # pool storage values updated
+REPRICE = 'reprice'  # swap paths going through the pool re-priced
+PUBLISH = 'publish'  # message put on the queue
+
+# strategy
+DEQUEUE = 'dequeue'  # message taken from the queue
+SCAN = 'scan'  # spreads of all compare_paths pairs calculated
+SIMULATE = 'simulate'  # the most profitable pair simulated
+SEND = 'send'  # bundle sent
+
+STAGES = [RECEIVE, DECODE, UPDATE, REPRICE, PUBLISH, DEQUEUE, SCAN, SIMULATE, SEND]
+
+# orders simulated from block messages, PUBLISH includes the gas price requests of DexStream.handle_new_block
+BLOCK_STAGES = [RECEIVE, PUBLISH, DEQUEUE, SIMULATE, SEND]
+
+TOTAL = 'total'
+
+stamp = time.monotonic_ns
+
+
+class LatencyHistogram:
+    """
+    HDR style histogram of latencies in nanoseconds
+
+    Values are counted in log-linear buckets: values below 2 ** precision_bits have a bucket each,
+    and every power of 2 above is split into 2 ** (precision_bits - 1) linear buckets.
+    Recording is a constant time array increment, and percentiles are within
+    a relative error of 2 ** -(precision_bits - 1) (0.8% with the default)
+    """
+
+    def __init__(self, precision_bits: int = 8, max_bits: int = 44):
+        """
+        :param precision_bits: the number of significant bits kept
+        :param max_bits: values above 2 ** max_bits ns (~4.9 hours) are counted in the last bucket
+        """
+        self.precision_bits = precision_bits
+        self.sub_buckets = 1 << precision_bits
+        self.half = self.sub_buckets >> 1
+        self.counts = np.zeros(self.sub_buckets + (max_bits - precision_bits + 1) * self.half, dtype=np.int64)
+
+        self.count = 0
+        self.max = 0
+
+    def index(self, value: int) -> int:
+        if value < self.sub_buckets:
+            return max(value, 0)
+        shift = value.bit_length() - self.precision_bits
+        return min(self.sub_buckets + (shift - 1) * self.half + (value >> shift) - self.half,
+                   len(self.counts) - 1)
+
+    def value_at(self, index: int) -> int:
+        """
+        :return: the middle value of the bucket at index
+        """
+        if index < self.sub_buckets:
+            return index
+        shift, sub_bucket = divmod(index - self.sub_buckets, self.half)
+        shift += 1
+        lower = (sub_bucket + self.half) << shift
+        return lower + (1 << shift) // 2
+
+    def record(self, value: int):
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> int:
+        """
+        :param q: percentile in [0, 100], ex) 99.9
+        """
+        if self.count == 0:
+            return 0
+        rank = max(int(np.ceil(q / 100 * self.count)), 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self.value_at(index), self.max)
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.max = 0
+
+
+class LatencyTracker:
+    """
+    Keeps a LatencyHistogram for each stage: the time from the previous stage stamped in a trace to the stage,
+    and one for the total time from the first stage to the last
+
+    ex) latency = LatencyTracker()
+        asyncio.ensure_future(latency.export_every(influxdb, 'DEX_ARB_BASE_LATENCY', 10))
+
+        trace = message['trace']
+        trace[DEQUEUE] = stamp()
+        ...
+        latency.record(trace)
+    """
+
+    def __init__(self, stages: List[str] = STAGES):
+        self.stages = stages
+        self.histograms = {stage: LatencyHistogram() for stage in stages + [TOTAL]}
+
+    def record(self, trace: Dict[str, int]):
+        previous = None
+        first = None
+
+        for stage in self.stages:
+            t = trace.get(stage)
+            if t is None:
+                continue
+            if previous is None:
+                first = t
+            else:
+                self.histograms[stage].record(t - previous)
+            previous = t
+
+        if first is not None:
+            self.histograms[TOTAL].record(previous - first)
+
+    def summary(self) -> Dict[str, float]:
+        """
+        :return: p50, p99, p999, max (in microseconds) and count of every stage recorded since the last reset
+        ex) {'scan_p50': 12.3, 'scan_p99': 40.1, 'scan_p999': 95.0, 'scan_max': 120.4, 'scan_count': 5000, ...}
+        """
+        data = {}
+
+        for stage, histogram in self.histograms.items():
+            if histogram.count == 0:
+                continue
+            data[f'{stage}_p50'] = histogram.percentile(50) / 1000
+            data[f'{stage}_p99'] = histogram.percentile(99) / 1000
+            data[f'{stage}_p999'] = histogram.percentile(99.9) / 1000
+            data[f'{stage}_max'] = histogram.max / 1000
+            data[f'{stage}_count'] = histogram.count
+
+        return data
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    async def export(self, influxdb, measurement: str):
+        """
+        Sends the summary of the latencies recorded since the last export, and starts a new period
+        :param influxdb: external.InfluxDB
+        """
+        data = self.summary()
+        self.reset()
+        if data:
+            await influxdb.send(measurement, data)
+
+    async def export_every(self, influxdb, measurement: str, interval: float = 10.0):
+        while True:
+            await asyncio.sleep(interval)
+            await self.export(influxdb, measurement)
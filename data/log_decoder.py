@@ -0,0 +1,91 @@
+"""
+Fast decoders of the logs DexStream subscribes to
+
+Sync, Swap, Mint, Burn have fixed layouts: every value is a 32 byte word,
+so the hex data string is sliced into words of 64 characters and converted with int(word, 16)
+instead of going through eth_utils.decode_hex and eth_abi.decode
+
+The JSON envelope of websocket messages is decoded with orjson or msgspec if installed (pip install orjson)
+"""
+import json
+from typing import Any, Callable, List, Tuple
+
+try:
+    import orjson
+
+    loads: Callable[[str or bytes], Any] = orjson.loads
+except ImportError:
+    try:
+        import msgspec
+
+        loads: Callable[[str or bytes], Any] = msgspec.json.decode
+    except ImportError:
+        loads: Callable[[str or bytes], Any] = json.loads
+
+WORD = 64  # 32 bytes in hex characters
+INT256_MIN = 1 << 255
+UINT256 = 1 << 256
+
+
+def to_signed(value: int) -> int:
+    """
+    Two's complement of a 256 bit word,
+    smaller signed integers (int24, ...) are sign extended to 256 bits in the ABI encoding
+    """
+    return value - UINT256 if value >= INT256_MIN else value
+
+
+def decode_words(data: str) -> List[int]:
+    """
+    :param data: 0x prefixed hex string of log data
+    :return: the 32 byte words of data as unsigned integers
+    """
+    return [int(data[i:i + WORD], 16) for i in range(2, len(data), WORD)]
+
+
+def decode_sync(data: str) -> Tuple[int, int]:
+    """
+    Sync(uint112 reserve0, uint112 reserve1)
+    """
+    return int(data[2:66], 16), int(data[66:130], 16)
+
+
+def decode_swap(data: str) -> Tuple[int, int, int, int, int]:
+    """
+    Swap(address indexed sender, address indexed recipient,
+         int256 amount0, int256 amount1, uint160 sqrtPriceX96, uint128 liquidity, int24 tick)
+
+    :return: (amount0, amount1, sqrt_price_x96, liquidity, tick)
+    """
+    return (to_signed(int(data[2:66], 16)),
+            to_signed(int(data[66:130], 16)),
+            int(data[130:194], 16),
+            int(data[194:258], 16),
+            to_signed(int(data[258:322], 16)))
+
+
+def decode_mint(data: str) -> int:
+    """
+    Mint(address sender, address indexed owner, int24 indexed tickLower, int24 indexed tickUpper,
+         uint128 amount, uint256 amount0, uint256 amount1)
+
+    :return: amount (liquidity added)
+    """
+    return int(data[66:130], 16)
+
+
+def decode_burn(data: str) -> int:
+    """
+    Burn(address indexed owner, int24 indexed tickLower, int24 indexed tickUpper,
+         uint128 amount, uint256 amount0, uint256 amount1)
+
+    :return: amount (liquidity removed)
+    """
+    return int(data[2:66], 16)
+
+
+def decode_int_topic(topic: str) -> int:
+    """
+    Decodes indexed signed integers, ex) tickLower, tickUpper of Mint, Burn
+    """
+    return to_signed(int(topic, 16))
@@ -0,0 +1,190 @@
+import time
+import asyncio
+import aiohttp
+import eth_abi
+import eth_utils
+from multicall import Call
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+# Multicall3 is deployed at the same address on every chain we trade on
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+
+AGGREGATE_SELECTOR = eth_utils.function_signature_to_4byte_selector('aggregate((address,bytes)[])')
+
+
+class MulticallError(Exception):
+
+    def __init__(self, msg: str):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class ChunkedMulticall:
+    """
+    Sends Multicall3 aggregate queries in chunks of at most chunk_size calls,
+    with the chunks of every chain running concurrently (up to concurrency requests per chain)
+
+    - every chunk is pinned to the block number given for its chain, so that all results come from one block
+    - a chunk that fails is retried on its own with exponential backoff, and split in half if it keeps failing
+      (ex. the provider limits the gas or size of a call)
+    - the timing of every chunk is kept in timings
+
+    ex) multicall = ChunkedMulticall({'ethereum': '<RPC URL>'})
+        blocks = multicall.get_block_numbers(['ethereum'])
+        results = multicall({'ethereum': [Call(...), ...]}, blocks)
+    """
+
+    def __init__(self,
+                 rpc_endpoints: Dict[str, str],
+                 chunk_size: int = 500,
+                 retries: int = 3,
+                 backoff: float = 0.5,
+                 concurrency: int = 8,
+                 timeout: float = 30.0,
+                 multicall_addresses: Optional[Dict[str, str]] = None):
+        """
+        :param chunk_size: the max number of calls in a single eth_call
+        :param retries: the number of times a chunk is retried before it's split in half
+        :param backoff: seconds to wait before the first retry, doubled on every retry
+        :param concurrency: the max number of requests in flight per chain
+        :param multicall_addresses: Multicall3 address of each chain, MULTICALL3_ADDRESS if not given
+        """
+        self.rpc_endpoints = rpc_endpoints
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.multicall_addresses = multicall_addresses or {}
+
+        """
+        timings of the chunks sent, cleared with reset_timings
+        ex) [{'chain': 'ethereum', 'block': 17000000, 'calls': 500, 'attempts': 1, 'took': 0.21}, ...]
+        """
+        self.timings: List[Dict[str, Any]] = []
+
+    def __call__(self,
+                 calls_by_chain: Dict[str, List[Call]],
+                 block_numbers: Dict[str, int]) -> Dict[str, Any]:
+        return run_sync(self.call(calls_by_chain, block_numbers))
+
+    def get_block_numbers(self, chains: List[str]) -> Dict[str, int]:
+        return run_sync(self.block_numbers(chains))
+
+    async def rpc(self, session: aiohttp.ClientSession, chain: str, method: str, params: list) -> Any:
+        payload = {'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params}
+        async with session.post(self.rpc_endpoints[chain], json=payload) as r:
+            res = await r.json(content_type=None)
+        if 'error' in res:
+            raise MulticallError(f'{chain} {method} failed: {res["error"]}')
+        return res['result']
+
+    async def block_numbers(self, chains: List[str]) -> Dict[str, int]:
+        async with self._session() as session:
+            blocks = await asyncio.gather(*[self.rpc(session, c, 'eth_blockNumber', []) for c in chains])
+        return {c: int(b, 16) for c, b in zip(chains, blocks)}
+
+    async def call(self,
+                   calls_by_chain: Dict[str, List[Call]],
+                   block_numbers: Dict[str, int]) -> Dict[str, Any]:
+        """
+        :return: the values of all calls by their return names, same as multicall.Multicall
+        """
+        semaphores = {chain: asyncio.Semaphore(self.concurrency) for chain in calls_by_chain}
+
+        async with self._session() as session:
+            chunks = []
+            for chain, calls in calls_by_chain.items():
+                for i in range(0, len(calls), self.chunk_size):
+                    chunks.append(self._chunk(session,
+                                              semaphores[chain],
+                                              chain,
+                                              calls[i:i + self.chunk_size],
+                                              block_numbers[chain]))
+            outputs = await asyncio.gather(*chunks)
+
+        results = {}
+        for output in outputs:
+            results.update(output)
+        return results
+
+    async def _chunk(self,
+                     session: aiohttp.ClientSession,
+                     semaphore: asyncio.Semaphore,
+                     chain: str,
+                     calls: List[Call],
+                     block_number: int) -> Dict[str, Any]:
+        data = AGGREGATE_SELECTOR + eth_abi.encode(['(address,bytes)[]'], [[(c.target, c.data) for c in calls]])
+        params = [
+            {'to': self.multicall_addresses.get(chain, MULTICALL3_ADDRESS), 'data': eth_utils.encode_hex(data)},
+            hex(block_number),
+        ]
+
+        s = time.time()
+        error = None
+
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                async with semaphore:
+                    result = await self.rpc(session, chain, 'eth_call', params)
+                _, outputs = eth_abi.decode(['uint256', 'bytes[]'], eth_utils.decode_hex(result))
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, MulticallError) as e:
+                error = e
+        else:
+            if len(calls) == 1:
+                raise MulticallError(f'{chain} Multicall of {calls[0]} at block {block_number} failed: {error}')
+
+            # the chunk may be too large for the provider: retry each half on its own
+            half = len(calls) // 2
+            first, second = await asyncio.gather(
+                self._chunk(session, semaphore, chain, calls[:half], block_number),
+                self._chunk(session, semaphore, chain, calls[half:], block_number),
+            )
+            return {**first, **second}
+
+        self.timings.append({
+            'chain': chain,
+            'block': block_number,
+            'calls': len(calls),
+            'attempts': attempt + 1,
+            'took': time.time() - s,
+        })
+
+        results = {}
+        for call, output in zip(calls, outputs):
+            results.update(Call.decode_output(output, call.signature, call.returns))
+        return results
+
+    def reset_timings(self):
+        self.timings = []
+
+    def _session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    def report(self) -> str:
+        """
+        ex) ethereum @17000000: 12 chunks, 5800 calls, slowest chunk 0.412 secs, 1 retries
+        """
+        lines = []
+        for chain in sorted(set(t['chain'] for t in self.timings)):
+            timings = [t for t in self.timings if t['chain'] == chain]
+            lines.append(f'{chain} @{timings[0]["block"]}: {len(timings)} chunks, '
+                         f'{sum(t["calls"] for t in timings)} calls, '
+                         f'slowest chunk {round(max(t["took"] for t in timings), 3)} secs, '
+                         f'{sum(t["attempts"] - 1 for t in timings)} retries')
+        return '\n'.join(lines)
+
+
+def run_sync(coroutine) -> Any:
+    """
+    Runs coroutine on a new event loop in a worker thread,
+    so that it can be called whether or not an event loop is running in this thread
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
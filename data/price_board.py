@@ -0,0 +1,238 @@
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from typing import Any, Callable, Dict
+
+# index of the int64 header of each symbol's board
+SEQUENCE = 0
+BLOCK = 1
+HEADER_SIZE = 2
+
+# retries of PriceBoard.read that spin before yielding the CPU to the writer
+SPIN_RETRIES = 10
+
+
+class PriceBoard:
+    """
+    Shares DEX.swap_paths[symbol]['price'], ['fee'] with other processes through shared memory,
+    so that only a small notification (symbol, block, version) has to go through the queue
+
+    Each symbol has its own shared memory block laid out as:
+    - header: int64 [sequence, block]
+    - price: float64 [n]
+    - fee: float64 [n]
+
+    Writes are guarded with a seqlock: the sequence is odd while the writer is updating the board,
+    and readers retry if the sequence was odd or changed while they were reading.
+    Readers never raise on contention: if no consistent read can be made in time, they return a stale marker.
+    The version of the board is sequence // 2.
+
+    There is a single writer (the process running DexStream) per board.
+    Readers attach to the board with the layout sent in the setup message.
+    The resource tracker of every process that attached to a board unlinks it when the process exits,
+    so the writer and readers should share one tracker: call ensure_resource_tracker() before forking
+
+    ex) writer = PriceBoard.create({'ETH/USDT': 120})
+        publisher.put({'type': 'setup', 'price_board': writer.layout, ...})
+
+        reader = PriceBoard.attach(layout)
+        spreads, position = reader.read('ETH/USDT', scanner.max_spread)
+    """
+
+    def __init__(self,
+                 layout: Dict[str, tuple],
+                 shms: Dict[str, shared_memory.SharedMemory],
+                 owner: bool):
+        """
+        :param layout: {symbol: (shared memory name, number of swap paths)}
+        :param shms: {symbol: SharedMemory}
+        :param owner: the creator of the board unlinks the shared memory on close
+        """
+        self.layout = layout
+        self.shms = shms
+        self.owner = owner
+
+        self.header = {}
+        self.price = {}
+        self.fee = {}
+
+        for symbol, (_, n) in layout.items():
+            buf = shms[symbol].buf
+            self.header[symbol] = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=buf)
+            self.price[symbol] = np.ndarray((n,), dtype=np.float64, buffer=buf, offset=HEADER_SIZE * 8)
+            self.fee[symbol] = np.ndarray((n,), dtype=np.float64, buffer=buf, offset=(HEADER_SIZE + n) * 8)
+
+    @classmethod
+    def create(cls, sizes: Dict[str, int]) -> 'PriceBoard':
+        """
+        :param sizes: number of swap paths of each symbol, ex) {'ETH/USDT': 120}
+        """
+        layout = {}
+        shms = {}
+
+        for symbol, n in sizes.items():
+            # shared memory of size 0 isn't allowed
+            shm = shared_memory.SharedMemory(create=True, size=max((HEADER_SIZE + 2 * n) * 8, 8))
+            shm.buf[:] = b'\x00' * shm.size
+            layout[symbol] = (shm.name, n)
+            shms[symbol] = shm
+
+        return cls(layout, shms, owner=True)
+
+    @classmethod
+    def attach(cls, layout: Dict[str, tuple]) -> 'PriceBoard':
+        shms = {}
+
+        for symbol, (name, _) in layout.items():
+            shms[symbol] = shared_memory.SharedMemory(name=name)
+
+        return cls(layout, shms, owner=False)
+
+    def write(self,
+              symbol: str,
+              price: np.ndarray,
+              fee: np.ndarray,
+              block_number: int = 0) -> int:
+        """
+        Copies price, fee to the board of symbol
+        :return: the new version of the board
+        """
+        header = self.header[symbol]
+
+        header[SEQUENCE] += 1  # odd: write in progress
+        self.price[symbol][:] = price
+        self.fee[symbol][:] = fee
+        header[BLOCK] = block_number
+        header[SEQUENCE] += 1  # even: write done
+
+        return int(header[SEQUENCE]) // 2
+
+    def version(self, symbol: str) -> int:
+        return int(self.header[symbol][SEQUENCE]) // 2
+
+    def read(self,
+             symbol: str,
+             fn: Callable[[np.ndarray, np.ndarray], Any],
+             timeout: float = 0.01,
+             stale: Any = None) -> Any:
+        """
+        Runs fn(price, fee) on the board of symbol without copying the board,
+        and retries if the writer updated the board in the meantime
+
+        fn should only read from price, fee (they are views of the shared memory)
+        and shouldn't keep references to them
+
+        The first SPIN_RETRIES retries spin, after that the reader yields the CPU to the writer between retries.
+        If no consistent read could be made within timeout seconds (ex. the writer is copying a large board
+        on a busy machine), stale is returned: every write is followed by a new notification,
+        so the caller can skip this one and read the board again with the next
+
+        :return: the return value of fn, or stale
+        """
+        header = self.header[symbol]
+        retries = 0
+        deadline = None
+
+        while True:
+            sequence = int(header[SEQUENCE])
+            if sequence % 2 == 0:
+                result = fn(self.price[symbol], self.fee[symbol])
+                if int(header[SEQUENCE]) == sequence:
+                    return result
+
+            retries += 1
+            if retries < SPIN_RETRIES:
+                continue
+
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                return stale
+
+            time.sleep(0)
+
+    def snapshot(self, symbol: str) -> tuple:
+        """
+        :return: (price, fee, block, version) copies of the board of symbol, None if the board was stale
+        """
+        return self.read(symbol, lambda price, fee: (price.copy(),
+                                                      fee.copy(),
+                                                      int(self.header[symbol][BLOCK]),
+                                                      self.version(symbol)))
+
+    def close(self):
+        # numpy views have to be released before the shared memory can be closed
+        self.header = {}
+        self.price = {}
+        self.fee = {}
+
+        for shm in self.shms.values():
+            shm.close()
+            if self.owner:
+                shm.unlink()
+
+        self.shms = {}
+
+
+def ensure_resource_tracker():
+    """
+    Starts the resource tracker in the current process, so that processes forked afterwards share it.
+    Otherwise a reader attaching to a PriceBoard starts its own tracker,
+    which unlinks the board when the reader exits, and warns about leaked shared memory
+    """
+    resource_tracker.ensure_running()
+
+
+def board_message_format(symbol: str, block_number: int, version: int) -> Dict[str, Any]:
+    """
+    Notification sent instead of default_message_format when DexStream writes to a PriceBoard
+    """
+    return {
+        'source': 'dex',
+        'type': 'event',
+        'block': block_number,
+        'symbol': symbol,
+        'version': version,
+    }
+
+
+class PriceMirror:
+    """
+    Local copy of DEX.swap_paths[symbol]['price'], ['fee'] kept by the strategy process,
+    made from the topology message and patched in place with delta messages
+    (refer to data.dex_streams.topology_message, delta_message_format)
+
+    Has the same read interface as PriceBoard, so the strategy doesn't depend on the transport used
+    """
+
+    def __init__(self, topology: Dict[str, Dict[str, Any]]):
+        """
+        :param topology: value of 'swap_paths' of the topology message
+        ex) {'ETH/USDT': {'path': List, 'pool_indexes': List, 'tag': List, 'price': List, 'fee': List}}
+        """
+        self.price = {s: np.array(v['price'], dtype=np.float64) for s, v in topology.items()}
+        self.fee = {s: np.array(v['fee'], dtype=np.float64) for s, v in topology.items()}
+        self.block = {s: 0 for s in topology}
+        self.versions = {s: 0 for s in topology}
+
+    def apply(self, message: Dict[str, Any]) -> np.ndarray:
+        """
+        Patches the rows of the delta message in place
+        :return: the rows updated
+        """
+        symbol = message['symbol']
+        rows = np.asarray(message['rows'], dtype=np.int64)
+
+        self.price[symbol][rows] = message['price']
+        self.fee[symbol][rows] = message['fee']
+        self.block[symbol] = message['block']
+        self.versions[symbol] += 1
+
+        return rows
+
+    def version(self, symbol: str) -> int:
+        return self.versions[symbol]
+
+    def read(self, symbol: str, fn: Callable[[np.ndarray, np.ndarray], Any], **kwargs) -> Any:
+        # the mirror is patched in this process, so reads are always consistent
+        return fn(self.price[symbol], self.fee[symbol])
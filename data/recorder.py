@@ -0,0 +1,217 @@
+import time
+import gzip
+import json
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+from data.dex import DEX
+from data.log_decoder import loads
+
+
+class FrameRecorder:
+    """
+    Records the raw websocket frames DexStream receives (logs, newHeads) with their receive timestamps
+    to a gzip compressed, append-only file of JSON lines:
+
+    - {'type': 'setup', 'tokens': ..., 'pools': ..., 'trading_symbols': ..., 'storage': ..., 'v3_state': ...}
+      the state of DEX when recording started, used to load ReplayDEX
+    - {'type': 'frame', 't': 1692000000.123, 'chain': 'ethereum', 'frame': '<raw websocket message>'}
+
+    Every open appends a new gzip member, which gzip readers read as a single stream,
+    so a recording can be continued after a restart
+    """
+
+    def __init__(self, path: str, flush_every: int = 100):
+        self.path = path
+        self.flush_every = flush_every
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+        self.unflushed = 0
+
+    def write_setup(self, dex: DEX):
+        self._write({
+            'type': 'setup',
+            'tokens': dex.tokens,
+            'pools': dex.pools,
+            'trading_symbols': dex.trading_symbols,
+            'max_swap_number': dex.max_swap_number,
+            **dex_snapshot(dex),
+        })
+        self.flush()
+
+    def write(self, chain: str, frame: str or bytes, received: Optional[float] = None):
+        if isinstance(frame, bytes):
+            frame = frame.decode('utf-8')
+
+        self._write({
+            'type': 'frame',
+            't': time.time() if received is None else received,
+            'chain': chain,
+            'frame': frame,
+        })
+
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.unflushed = 0
+
+    def close(self):
+        self.file.close()
+
+    def _write(self, record: Dict[str, Any]):
+        self.file.write(json.dumps(record) + '\n')
+
+
+def dex_snapshot(dex: DEX) -> Dict[str, Any]:
+    """
+    Current pool state of DEX in the format of DexBase._fetch_pool_data, _fetch_v3_pool_state
+    """
+    storage = {}
+    v3_state = {}
+
+    for pool_idx, pool in enumerate(dex.pools):
+        if pool['version'] == 2:
+            reserve0, reserve1 = dex.get_reserves(pool_idx)
+            storage[str(pool_idx)] = [reserve0, reserve1, 0]
+        else:
+            v3_pool = dex.v3_pools[pool_idx]
+            storage[str(pool_idx)] = [v3_pool.sqrt_price_x96, v3_pool.tick, 0, 0, 0, 0, True]
+
+            if v3_pool.loaded_words is None:
+                tick_bitmap = v3_pool.tick_bitmap
+            else:
+                tick_bitmap = {w: v3_pool.tick_bitmap.get(w, 0) for w in v3_pool.loaded_words}
+
+            v3_state[str(pool_idx)] = {
+                'liquidity': v3_pool.liquidity,
+                'tick_spacing': v3_pool.tick_spacing,
+                'tick_bitmap': tick_bitmap,
+                'ticks': {t: [v3_pool.liquidity_gross.get(t, 0), net] for t, net in v3_pool.ticks.items()},
+            }
+
+    return {'storage': storage, 'v3_state': v3_state}
+
+
+def read_recording(path: str) -> tuple:
+    """
+    :return: (setup record, list of frame records), refer to FrameRecorder
+    """
+    setup = None
+    frames = []
+
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record['type'] == 'setup':
+                # the first setup is the state the frames were recorded on
+                setup = setup or record
+            else:
+                frames.append(record)
+
+    return setup, frames
+
+
+class ReplayDEX(DEX):
+    """
+    DEX loaded from the setup record of a recording instead of Multicall queries
+    """
+
+    def __init__(self, setup: Dict[str, Any], **kwargs):
+        self.recorded_setup = setup
+        rpc_endpoints = {chain: 'http://localhost:8545' for chain in setup['tokens']}
+        super().__init__(rpc_endpoints,
+                         setup['tokens'],
+                         setup['pools'],
+                         setup['trading_symbols'],
+                         setup['max_swap_number'],
+                         **kwargs)
+
+    def _fetch_pool_data(self, chains: Optional[List[str]] = None) -> Dict[str, Any]:
+        chains = chains or self.chains_list
+        return {
+            pool_idx: storage_data
+            for pool_idx, storage_data in self.recorded_setup['storage'].items()
+            if self.pools[int(pool_idx)]['chain'] in chains
+        }
+
+    def _fetch_v3_pool_state(self, multicall_results: Dict[str, Any]) -> Dict[str, Any]:
+        # JSON object keys are strings
+        return {
+            pool_idx: {
+                'liquidity': state['liquidity'],
+                'tick_spacing': state['tick_spacing'],
+                'tick_bitmap': {int(w): word for w, word in state['tick_bitmap'].items()},
+                'ticks': {int(t): tuple(v) for t, v in state['ticks'].items()},
+            }
+            for pool_idx, state in self.recorded_setup['v3_state'].items()
+        }
+
+
+def frame_type(message: Dict[str, Any]) -> Optional[str]:
+    """
+    :return: 'log', 'block' for eth_subscription notifications, None for others (ex. eth_subscribe responses)
+    """
+    result = message.get('params', {}).get('result')
+
+    if not isinstance(result, dict):
+        return None
+    if 'topics' in result:
+        return 'log'
+    if 'number' in result:
+        return 'block'
+    return None
+
+
+async def replay_frames(dex_stream,
+                        frames: List[Dict[str, Any]],
+                        speed: Optional[float] = None,
+                        on_frame: Optional[Callable[[float], Any]] = None) -> List[float]:
+    """
+    Feeds recorded frames into DexStream as if they were received (receive, handle_pool_event, new_block)
+
+    :param dex_stream: data.dex_streams.DexStream
+    :param speed: 1.0 replays at recorded speed, 10.0 ten times faster, None as fast as possible
+    :param on_frame: called with the receive time of each frame before it's handled
+    :return: the time each frame took to handle
+    """
+    pools = {chain: dex_stream.chain_pools(chain) for chain in dex_stream.dex.chains_list}
+
+    took = []
+    start = time.time()
+    first = frames[0]['t'] if frames else 0
+
+    for record in frames:
+        if speed:
+            delay = (record['t'] - first) / speed - (time.time() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        s = time.time()
+        if on_frame:
+            on_frame(s)
+
+        chain = record['chain']
+        dex_stream.receive(chain, record['frame'])
+
+        message = loads(record['frame'])
+        kind = frame_type(message)
+
+        if kind == 'log':
+            event = message['params']['result']
+            pool_idx = pools[chain].get(event['address'].lower())
+            if pool_idx is not None:
+                dex_stream.handle_pool_event(chain, pool_idx, event)
+        elif kind == 'block':
+            await dex_stream.new_block(chain, message['params']['result'], wait=True)
+
+        took.append(time.time() - s)
+
+    # publish updates still pending in coalesce mode
+    for chain in list(dex_stream.pending_updates):
+        dex_stream.flush_updates(chain)
+
+    return took
@@ -1,5 +1,6 @@
 import random
 import asyncio
+import aiohttp
 import websockets
 from typing import Any, Callable, Dict
 
@@ -19,6 +20,15 @@ async def reconnecting_websocket_loop(stream_fn: Callable, tag: str):
             break
 
 
+async def json_rpc(session: aiohttp.ClientSession, url: str, method: str, params: list) -> Any:
+    payload = {'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params}
+    async with session.post(url, json=payload) as r:
+        res = await r.json(content_type=None)
+    if 'error' in res:
+        raise Exception(f'{method} failed: {res["error"]}')
+    return res['result']
+
+
 def calculate_next_block_base_fee(block: Dict[str, Any]):
     base_fee = int(block['baseFeePerGas'], base=16)
     gas_used = int(block['gasUsed'], base=16)
@@ -1,7 +1,11 @@
 import os
-from typing import Dict
+import math
+import time
+import asyncio
+import numbers
+from collections import deque
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
-from influxdb_client import Point
 from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
 
 load_dotenv(override=True)
@@ -12,23 +16,80 @@ INFLUXDB_ORG = os.getenv('INFLUXDB_ORG')
 INFLUXDB_BUCKET = os.getenv('INFLUXDB_BUCKET')
 
 
+def escape_key(key: str) -> str:
+    return key.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def encode_field(value: Any) -> Optional[str]:
+    """
+    Encodes a field value in line protocol, returns None for values that can't be written (ex. NaN, inf)
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, numbers.Integral):
+        return f'{int(value)}i'
+    if isinstance(value, numbers.Real):
+        value = float(value)
+        return repr(value) if math.isfinite(value) else None
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{value}"'
+
+
+def line_protocol(measurement: str, data: Dict[str, Any], timestamp: int) -> Optional[str]:
+    """
+    ex) line_protocol('DEX_ARB_BASE_ETHUSDT', {'UNI3ETHUSDT/UNI2ETHUSDT': 0.12}, 1692000000000000000)
+        -> 'DEX_ARB_BASE_ETHUSDT UNI3ETHUSDT/UNI2ETHUSDT=0.12 1692000000000000000'
+
+    :param timestamp: in nanoseconds
+    :return: None if there is no field to write
+    """
+    fields = []
+
+    for k, v in data.items():
+        value = encode_field(v)
+        if value is not None:
+            fields.append(f'{escape_key(k)}={value}')
+
+    if not fields:
+        return None
+
+    measurement = measurement.replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ')
+    return f'{measurement} {",".join(fields)} {timestamp}'
+
+
 class InfluxDB:
     """
     Used to collect real-time data from bot.
     If all init args are None, InfluxDB won't do anything.
+
+    send doesn't wait on the database: points are put in a bounded ring as they are,
+    which a background task encodes in line protocol and writes in batches,
+    when batch_size points are queued or every flush_interval seconds.
+    If the ring is full, the oldest points are dropped to make room for new ones.
+
+    Counters:
+    - sent: points written
+    - dropped: points dropped because the ring was full
+    - failed: points lost in failed writes
     """
 
     def __init__(self,
                  token: str = INFLUXDB_TOKEN,
                  url: str = INFLUXDB_URL,
                  org: str = INFLUXDB_ORG,
-                 bucket: str = INFLUXDB_BUCKET):
+                 bucket: str = INFLUXDB_BUCKET,
+                 batch_size: int = 1000,
+                 flush_interval: float = 1.0,
+                 max_queued: int = 100000):
 
         self.token = token
         self.url = url
         self.org = org
         self.bucket = bucket
 
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
         if token:
             self.client = InfluxDBClientAsync(
                 url=url,
@@ -40,19 +101,101 @@ class InfluxDB:
             self.client = None
             self.write_api = None
 
+        # (measurement, data, timestamp) of the points waiting to be written
+        self.queue = deque(maxlen=max_queued)
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self.flusher: Optional[asyncio.Task] = None
+        self.wakeup: Optional[asyncio.Event] = None
+
     async def send(self, measurement: str, data: Dict[str, float]):
-        if self.write_api:
-            points = [
-                Point(measurement).field(k, v)
-                for k, v in data.items()
-            ]
-            await self.write_api.write(
-                bucket=self.bucket,
-                org=self.org,
-                record=points
-            )
+        """
+        Queues a point with the fields in data, returns without waiting on the database
+        data is encoded when the point is written, so it shouldn't be changed after the call
+        """
+        self.put(measurement, data)
+
+    def put(self, measurement: str, data: Dict[str, float], timestamp: Optional[int] = None):
+        """
+        :param timestamp: in nanoseconds, the time of the call if None
+        """
+        if not self.write_api:
+            return
+
+        if len(self.queue) == self.queue.maxlen:
+            # deque drops the oldest point on append
+            self.dropped += 1
+
+        self.queue.append((measurement, data, timestamp or time.time_ns()))
+
+        if self.flusher is None:
+            # the flusher is started from the first send, which is called from the running event loop
+            self.wakeup = asyncio.Event()
+            self.flusher = asyncio.ensure_future(self._flush_loop())
+
+        if len(self.queue) >= self.batch_size:
+            self.wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self.queue:
+            points = self._take(self.batch_size)
+
+            # points without a field that can be written are skipped
+            batch = [line for line in (line_protocol(*point) for point in points) if line is not None]
+            if not batch:
+                continue
+
+            try:
+                await self.write_api.write(
+                    bucket=self.bucket,
+                    org=self.org,
+                    record=batch
+                )
+                self.sent += len(batch)
+            except asyncio.CancelledError:
+                # put the points back for close to write
+                self.queue.extendleft(reversed(points))
+                raise
+            except Exception as e:
+                self.failed += len(batch)
+                print(f'InfluxDB write of {len(batch)} points failed: {e}')
+
+    def _take(self, n: int) -> List[tuple]:
+        return [self.queue.popleft() for _ in range(min(n, len(self.queue)))]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queued': len(self.queue),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
 
     async def close(self):
+        if self.flusher:
+            self.flusher.cancel()
+            try:
+                await self.flusher
+            except asyncio.CancelledError:
+                pass
+            self.flusher = None
+
+        if self.write_api:
+            # write what's left before closing
+            await self.flush()
+
         if self.client:
             await self.client.close()
 
@@ -64,6 +207,4 @@ async def test_send():
 
 
 if __name__ == '__main__':
-    import asyncio
-
     asyncio.run(test_send())
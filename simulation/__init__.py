@@ -1,3 +1,4 @@
 from simulation.uniswap_v2 import *
 from simulation.uniswap_v3 import *
+from simulation.optimizer import *
 from simulation.online_simulator import *
\ No newline at end of file
@@ -0,0 +1,263 @@
+"""
+Kernels of the hop math that prices swap paths and screens amounts out over the pool arrays of DEX
+
+Two backends with the same functions:
+- NumpyKernels: vectorized NumPy, the default
+- NumbaKernels: explicit loops compiled with Numba (pip install numba), which skip the temporary
+  (paths, hops) arrays NumPy has to gather. Compiled code is cached to __pycache__ (cache=True),
+  so only the first start-up after a change pays for compiling
+
+Amounts out are float64 estimates for screening: V2 hops use the constant product formula,
+V3 hops the math of a swap that stays within the current tick (liquidity doesn't change).
+Exact amounts are simulated with UniswapV2Simulator, UniswapV3Simulator
+"""
+import numpy as np
+
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """
+        Leaves functions as they are when Numba isn't installed
+        """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+Q96 = 2.0 ** 96
+
+
+def v2_amounts_out(amounts_in: np.ndarray,
+                   reserves_in: np.ndarray,
+                   reserves_out: np.ndarray,
+                   fee: np.ndarray or float) -> np.ndarray:
+    """
+    Float version of UniswapV2Simulator.get_amounts_out, the arguments are broadcast against each other
+
+    :param fee: fee as a fraction, ex) 0.003
+    """
+    amounts_in_with_fee = amounts_in * (1 - fee)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amounts_out = amounts_in_with_fee * reserves_out / (reserves_in + amounts_in_with_fee)
+    return np.where((reserves_in > 0) & (reserves_out > 0), amounts_out, 0.0)
+
+
+def v3_amounts_out(amounts_in: np.ndarray,
+                   sqrt_prices_x96: np.ndarray,
+                   liquidity: np.ndarray,
+                   fee: np.ndarray or float,
+                   zero_for_one: np.ndarray or bool) -> np.ndarray:
+    """
+    Amounts out of swaps that stay within the current tick of Uniswap V3 variant pools
+    (SqrtPriceMath.getNextSqrtPriceFromInput, getAmount0Delta, getAmount1Delta in floats)
+    the arguments are broadcast against each other
+
+    :param fee: fee as a fraction, ex) 0.0005
+    """
+    sqrt_price = sqrt_prices_x96 / Q96
+    amounts_in_less_fee = amounts_in * (1 - fee)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # token0 in: the price goes down, token1 out
+        next_down = liquidity * sqrt_price / (liquidity + amounts_in_less_fee * sqrt_price)
+        amounts_out_0 = liquidity * (sqrt_price - next_down)
+
+        # token1 in: the price goes up, token0 out
+        next_up = sqrt_price + amounts_in_less_fee / liquidity
+        amounts_out_1 = liquidity * (next_up - sqrt_price) / (sqrt_price * next_up)
+
+    amounts_out = np.where(zero_for_one, amounts_out_0, amounts_out_1)
+    return np.where((liquidity > 0) & (sqrt_price > 0), amounts_out, 0.0)
+
+
+def numpy_path_prices(reserve0: np.ndarray,
+                      reserve1: np.ndarray,
+                      sqrt_price: np.ndarray,
+                      fee: np.ndarray,
+                      hop_rows: np.ndarray,
+                      hop_mask: np.ndarray,
+                      hop_v2: np.ndarray,
+                      hop_token0_in: np.ndarray,
+                      hop_scale: np.ndarray,
+                      rows: np.ndarray) -> tuple:
+    """
+    Returns the price, fee of the swap paths at rows, the same values as DEX.get_price multiplied over the hops
+
+    :param reserve0, reserve1, sqrt_price, fee: the columns of DEX.storage_array
+    :param hop_rows ~ hop_scale: the arrays of DEX.price_index[symbol]
+    """
+    hop_rows = hop_rows[rows]
+    hop_mask = hop_mask[rows]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v2_price = reserve1[hop_rows] / reserve0[hop_rows]
+        v3_price = (sqrt_price[hop_rows] / Q96) ** 2
+        price = np.where(hop_v2[rows], v2_price, v3_price) * hop_scale[rows]
+
+        # take the inverse of the token_in -> token_out quote (refer to DEX._loop_update_price_for_symbol)
+        inverse = np.where(hop_token0_in[rows], 1 / price, price)
+
+    inverse = np.where(hop_mask, inverse, 1.0)
+    fees = np.where(hop_mask, 1 - fee[hop_rows], 1.0)
+
+    return np.prod(inverse, axis=1), 1 - np.prod(fees, axis=1)
+
+
+def numpy_path_amounts_out(amounts_in: np.ndarray,
+                           reserve0: np.ndarray,
+                           reserve1: np.ndarray,
+                           sqrt_price: np.ndarray,
+                           liquidity: np.ndarray,
+                           fee: np.ndarray,
+                           hop_rows: np.ndarray,
+                           hop_mask: np.ndarray,
+                           hop_v2: np.ndarray,
+                           hop_token0_in: np.ndarray,
+                           rows: np.ndarray,
+                           sell: bool) -> np.ndarray:
+    """
+    Swaps amounts_in through the swap paths at rows, refer to DEX.estimate_amounts_out
+
+    :param liquidity: liquidity of the V3 pool of each row of DEX.storage_array, as float
+    :return: (len(rows), len(amounts_in))
+    """
+    hop_rows = hop_rows[rows]
+    hop_mask = hop_mask[rows]
+    hop_v2 = hop_v2[rows]
+    token0_in = ~hop_token0_in[rows] if sell else hop_token0_in[rows]
+
+    amounts = np.tile(amounts_in.astype(np.float64), (len(rows), 1))
+    hops = range(hop_rows.shape[1] - 1, -1, -1) if sell else range(hop_rows.shape[1])
+
+    for h in hops:
+        r = hop_rows[:, h]
+        t0 = token0_in[:, h][:, None]
+
+        v2_out = v2_amounts_out(amounts,
+                                np.where(t0, reserve0[r][:, None], reserve1[r][:, None]),
+                                np.where(t0, reserve1[r][:, None], reserve0[r][:, None]),
+                                fee[r][:, None])
+        v3_out = v3_amounts_out(amounts, sqrt_price[r][:, None], liquidity[r][:, None], fee[r][:, None], t0)
+
+        out = np.where(hop_v2[:, h][:, None], v2_out, v3_out)
+        amounts = np.where(hop_mask[:, h][:, None], out, amounts)
+
+    return amounts
+
+
+@njit(cache=True)
+def loop_path_prices(reserve0, reserve1, sqrt_price, fee, hop_rows, hop_mask, hop_v2, hop_token0_in, hop_scale, rows):
+    """
+    numpy_path_prices as loops over paths and hops, compiled with Numba
+    """
+    n = rows.shape[0]
+    prices = np.empty(n)
+    fees = np.empty(n)
+
+    for i in range(n):
+        row = rows[i]
+        price_product = 1.0
+        fee_product = 1.0
+
+        for h in range(hop_rows.shape[1]):
+            if not hop_mask[row, h]:
+                continue
+
+            r = hop_rows[row, h]
+            if hop_v2[row, h]:
+                price = reserve1[r] / reserve0[r] if reserve0[r] != 0 else np.inf
+            else:
+                price = (sqrt_price[r] / Q96) ** 2
+
+            price *= hop_scale[row, h]
+
+            if hop_token0_in[row, h]:
+                price = 1 / price if price != 0 else np.inf
+
+            price_product *= price
+            fee_product *= 1 - fee[r]
+
+        prices[i] = price_product
+        fees[i] = 1 - fee_product
+
+    return prices, fees
+
+
+@njit(cache=True)
+def loop_path_amounts_out(amounts_in, reserve0, reserve1, sqrt_price, liquidity, fee,
+                          hop_rows, hop_mask, hop_v2, hop_token0_in, rows, sell):
+    """
+    numpy_path_amounts_out as loops over paths, amounts and hops, compiled with Numba
+    """
+    n_hops = hop_rows.shape[1]
+    amounts_out = np.empty((rows.shape[0], amounts_in.shape[0]))
+
+    for i in range(rows.shape[0]):
+        row = rows[i]
+
+        for j in range(amounts_in.shape[0]):
+            amount = float(amounts_in[j])
+
+            for k in range(n_hops):
+                h = n_hops - 1 - k if sell else k
+                if not hop_mask[row, h]:
+                    continue
+
+                r = hop_rows[row, h]
+                token0_in = hop_token0_in[row, h] != sell
+                amount_less_fee = amount * (1 - fee[r])
+
+                if hop_v2[row, h]:
+                    reserve_in = reserve0[r] if token0_in else reserve1[r]
+                    reserve_out = reserve1[r] if token0_in else reserve0[r]
+                    if reserve_in <= 0 or reserve_out <= 0:
+                        amount = 0.0
+                    else:
+                        amount = amount_less_fee * reserve_out / (reserve_in + amount_less_fee)
+                else:
+                    sqrt_p = sqrt_price[r] / Q96
+                    liq = liquidity[r]
+                    if liq <= 0 or sqrt_p <= 0:
+                        amount = 0.0
+                    elif token0_in:
+                        next_sqrt_p = liq * sqrt_p / (liq + amount_less_fee * sqrt_p)
+                        amount = liq * (sqrt_p - next_sqrt_p)
+                    else:
+                        next_sqrt_p = sqrt_p + amount_less_fee / liq
+                        amount = liq * (next_sqrt_p - sqrt_p) / (sqrt_p * next_sqrt_p)
+
+            amounts_out[i, j] = amount
+
+    return amounts_out
+
+
+class NumpyKernels:
+    name = 'numpy'
+    path_prices = staticmethod(numpy_path_prices)
+    path_amounts_out = staticmethod(numpy_path_amounts_out)
+
+
+class NumbaKernels:
+    name = 'numba'
+    path_prices = staticmethod(loop_path_prices)
+    path_amounts_out = staticmethod(loop_path_amounts_out)
+
+
+def load_kernels(backend: str = 'numpy'):
+    """
+    :param backend: 'numpy' or 'numba', 'numba' falls back to 'numpy' if Numba isn't installed
+    :return: NumpyKernels or NumbaKernels
+    """
+    if backend not in ['numpy', 'numba']:
+        raise ValueError(f'backend should be one of: numpy, numba. Got: {backend}')
+
+    if backend == 'numba':
+        if NUMBA_AVAILABLE:
+            return NumbaKernels
+        print('Numba is not installed (pip install numba), using the NumPy kernels')
+
+    return NumpyKernels
@@ -1,6 +1,8 @@
 import os
 import json
+import numpy as np
 from web3 import Web3
+from web3.exceptions import ContractLogicError
 from pathlib import Path
 from typing import Any, Dict, List
 
@@ -15,6 +17,10 @@ DIR = os.path.dirname(os.path.abspath(__file__))
 ABI_FILE_PATH = Path(DIR) / 'SimulatorV1.json'
 SIMULATOR_ABI = json.load(open(ABI_FILE_PATH, 'r'))['abi']
 
+# SimulatorV1.json is the forge build output of contracts/src/SimulatorV1.sol (contracts/out/SimulatorV1.sol),
+# builds from before simulateSwapInBatch was added don't have it
+BATCH_SIMULATION = any(item.get('name') == 'simulateSwapInBatch' for item in SIMULATOR_ABI)
+
 
 class OnlineSimulator:
     """
@@ -153,6 +159,41 @@ class OnlineSimulator:
     def simulate(self, chain: str, params: List[Dict[str, Any]]) -> int:
         return self.sim[chain].functions.simulateSwapIn(params).call()
 
+    def simulate_batch(self,
+                       chain: str,
+                       routes: List[List[Dict[str, Any]]],
+                       amounts_in: List[int]) -> np.ndarray:
+        """
+        Simulates N routes with M amounts in with a single eth_call (SimulatorV1.simulateSwapInBatch)
+        If SimulatorV1.json was built before simulateSwapInBatch (BATCH_SIMULATION is False),
+        every route, amount in is simulated with its own simulateSwapIn call instead
+
+        :param routes: list of params made with make_params, the amount of the first swap is overwritten
+        :param amounts_in: ex) [100 * 10 ** 6, 1000 * 10 ** 6] (USDT)
+        :return: np.ndarray of shape (N, M) of amounts out (dtype=object)
+        amount out is 0 where the route reverted
+        """
+        amounts_in = [int(amount_in) for amount_in in amounts_in]
+
+        if BATCH_SIMULATION:
+            amounts_out = self.sim[chain].functions.simulateSwapInBatch(routes, amounts_in).call()
+        else:
+            amounts_out = [[self._simulate_or_zero(chain, route, amount_in) for amount_in in amounts_in]
+                           for route in routes]
+
+        result = np.zeros((len(routes), len(amounts_in)), dtype=object)
+        for i, route_amounts_out in enumerate(amounts_out):
+            result[i, :] = route_amounts_out
+        return result
+
+    def _simulate_or_zero(self, chain: str, route: List[Dict[str, Any]], amount_in: int) -> int:
+        if not route:
+            return 0
+        try:
+            return self.simulate(chain, [{**route[0], 'amount': amount_in}, *route[1:]])
+        except ContractLogicError:
+            return 0
+
 
 if __name__ == '__main__':
     import os
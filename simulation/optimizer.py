@@ -0,0 +1,194 @@
+import math
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+from simulation.uniswap_v2 import UniswapV2Simulator
+from simulation.uniswap_v3 import UniswapV3Simulator, TickDataError
+
+# 1 / golden ratio
+INV_PHI = (math.sqrt(5) - 1) / 2
+
+
+class ArbitrageOptimizer:
+    """
+    Finds the amount in that maximizes the profit of a cyclic arbitrage route:
+    profit(amount_in) = amount_out(amount_in) - amount_in
+
+    A route is the list of swaps of the buy path followed by the sell path, where each swap is a dict:
+    - Uniswap V2 variants: {'version': 2, 'reserve_in': int, 'reserve_out': int, 'fee': 3000}
+    - Uniswap V3 variants: {'version': 3, 'pool': UniswapV3Pool, 'zero_for_one': bool}
+
+    Routes of only Uniswap V2 variant pools are solved in closed form.
+    Routes with Uniswap V3 variant pools are solved with golden-section search on the exact offline simulators,
+    which works because amount_out is concave in amount_in, so the profit has a single maximum
+    """
+
+    def __init__(self):
+        self.sim_v2 = UniswapV2Simulator()
+        self.sim_v3 = UniswapV3Simulator()
+
+    def get_amount_out(self, route: List[Dict[str, Any]], amount_in: int) -> int:
+        """
+        Returns the exact amount out of swapping amount_in through the route,
+        0 if any of the swaps would revert, or would cross ticks that weren't loaded
+        (so that the search of optimal_amounts_in stays in the range that can be simulated)
+        """
+        amount = int(amount_in)
+
+        for swap in route:
+            if amount <= 0:
+                return 0
+            if swap['version'] == 2:
+                amount = self.sim_v2.get_amount_out(amount, swap['reserve_in'], swap['reserve_out'], swap['fee'])
+            else:
+                try:
+                    amount = self.sim_v3.get_amount_out(swap['pool'], amount, swap['zero_for_one'])
+                except TickDataError:
+                    return 0
+
+        return amount
+
+    def get_profit(self, route: List[Dict[str, Any]], amount_in: int) -> int:
+        return self.get_amount_out(route, amount_in) - int(amount_in)
+
+    def v2_route_coefficients(self, route: List[Dict[str, Any]]) -> tuple:
+        """
+        A route of Uniswap V2 variant pools swaps like a single virtual pool:
+
+        amount_out = A * amount_in / (B + C * amount_in)
+
+        where a single swap has: A = fee_numerator * reserve_out, B = fee_denominator * reserve_in, C = fee_numerator
+        and swaps are combined as: A = A1 * A2, B = B1 * B2, C = B2 * C1 + C2 * A1
+
+        :return: (A, B, C) as Python ints
+        """
+        a, b, c = 1, 1, 0
+
+        for swap in route:
+            fee_numerator, fee_denominator = self.sim_v2.fee_fraction(swap['fee'])
+            a2 = fee_numerator * int(swap['reserve_out'])
+            b2 = fee_denominator * int(swap['reserve_in'])
+            c2 = fee_numerator
+            a, b, c = a * a2, b * b2, b2 * c + c2 * a
+
+        return a, b, c
+
+    def optimal_v2_amount_in(self, route: List[Dict[str, Any]], max_amount_in: Optional[int] = None) -> int:
+        """
+        Closed form solution of the optimal amount in of a route of Uniswap V2 variant pools:
+        d/dx (A * x / (B + C * x) - x) = 0 --> x = (sqrt(A * B) - B) / C
+
+        Returns 0 if the route isn't profitable (A <= B)
+        """
+        a, b, c = self.v2_route_coefficients(route)
+
+        if a <= b or c == 0:
+            return 0
+
+        amount_in = (math.isqrt(a * b) - b) // c
+
+        if max_amount_in is not None:
+            amount_in = min(amount_in, int(max_amount_in))
+
+        # the integer math of swaps rounds down, so check the neighbors of the real valued optimum
+        candidates = [x for x in [amount_in - 1, amount_in, amount_in + 1]
+                      if x > 0 and (max_amount_in is None or x <= max_amount_in)]
+        return max(candidates, key=lambda x: self.get_profit(route, x), default=0)
+
+    def optimal_amounts_in(self,
+                           routes: List[List[Dict[str, Any]]],
+                           max_amount_in: int,
+                           tolerance: float = 1e-6,
+                           max_iterations: int = 100) -> tuple:
+        """
+        Finds the optimal amount in of every route in one call
+
+        Routes of only Uniswap V2 variant pools use the closed form solution,
+        and the rest are searched together with golden-section search, where the brackets of all routes
+        are kept in NumPy arrays and narrowed at the same time
+
+        :param max_amount_in: the upper bound of amount in, ex) max bet size in USDT (1 USDT = 1,000,000)
+        :param tolerance: the search stops when brackets are narrower than tolerance * max_amount_in (or 1 unit)
+        :return: (amounts_in, profits) np.ndarray of Python ints (dtype=object)
+        amount in is 0 for routes that aren't profitable
+        """
+        n = len(routes)
+        amounts_in = np.zeros(n, dtype=object)
+
+        is_v2 = np.array([all(swap['version'] == 2 for swap in route) for route in routes], dtype=bool)
+
+        for i in np.flatnonzero(is_v2):
+            amounts_in[i] = self.optimal_v2_amount_in(routes[i], max_amount_in)
+
+        search = np.flatnonzero(~is_v2)
+
+        if len(search) > 0:
+            amounts_in[search] = self._golden_section_search([routes[i] for i in search],
+                                                             max_amount_in,
+                                                             tolerance,
+                                                             max_iterations)
+
+        profits = np.array([self.get_profit(route, x) if x > 0 else 0
+                            for route, x in zip(routes, amounts_in)], dtype=object)
+
+        # don't trade routes that aren't profitable
+        amounts_in[profits <= 0] = 0
+        profits[profits <= 0] = 0
+
+        return amounts_in, profits
+
+    def optimal_amount_in(self,
+                          route: List[Dict[str, Any]],
+                          max_amount_in: int,
+                          tolerance: float = 1e-6) -> tuple:
+        """
+        :return: (amount_in, profit) of a single route, refer to optimal_amounts_in
+        """
+        amounts_in, profits = self.optimal_amounts_in([route], max_amount_in, tolerance)
+        return amounts_in[0], profits[0]
+
+    def _golden_section_search(self,
+                               routes: List[List[Dict[str, Any]]],
+                               max_amount_in: int,
+                               tolerance: float,
+                               max_iterations: int) -> np.ndarray:
+        n = len(routes)
+
+        lo = np.zeros(n)
+        hi = np.full(n, float(max_amount_in))
+        x1 = hi - INV_PHI * (hi - lo)
+        x2 = lo + INV_PHI * (hi - lo)
+
+        def _profits(routes_idx: np.ndarray, x: np.ndarray) -> np.ndarray:
+            return np.array([float(self.get_profit(routes[i], int(v))) for i, v in zip(routes_idx, x)])
+
+        all_routes = np.arange(n)
+        f1 = _profits(all_routes, x1)
+        f2 = _profits(all_routes, x2)
+
+        min_width = max(1.0, tolerance * max_amount_in)
+
+        for _ in range(max_iterations):
+            active = np.flatnonzero(hi - lo > min_width)
+            if len(active) == 0:
+                break
+
+            # the maximum is in [x1, hi] if f1 < f2, otherwise in [lo, x2]
+            right = f1[active] < f2[active]
+            r = active[right]
+            l = active[~right]
+
+            lo[r] = x1[r]
+            x1[r] = x2[r]
+            f1[r] = f2[r]
+            x2[r] = lo[r] + INV_PHI * (hi[r] - lo[r])
+            f2[r] = _profits(r, x2[r])
+
+            hi[l] = x2[l]
+            x2[l] = x1[l]
+            f2[l] = f1[l]
+            x1[l] = hi[l] - INV_PHI * (hi[l] - lo[l])
+            f1[l] = _profits(l, x1[l])
+
+        best = np.where(f1 > f2, x1, x2)
+        return np.array([int(x) for x in best], dtype=object)
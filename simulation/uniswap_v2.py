@@ -1,3 +1,21 @@
+import math
+import numpy as np
+from typing import Sequence
+
+# pool fees are in the format of pools in addresses/*.py: 3000 = 0.3%
+FEE_DENOMINATOR = 1000000
+
+UINT256_MAX = 2 ** 256 - 1
+
+
+def to_uint(values) -> np.ndarray:
+    """
+    Converts values to an object array of Python ints
+    Arithmetic on object arrays is done with Python ints, so there is no overflow or rounding
+    """
+    return np.asarray(np.frompyfunc(int, 1, 1)(np.asarray(values, dtype=object)), dtype=object)
+
+
 class UniswapV2Simulator:
 
     def __init__(self):
@@ -19,36 +37,123 @@ class UniswapV2Simulator:
         price = reserve1 / reserve0 * 10 ** (decimals0 - decimals1)
         return price if token0_in else 1 / price
 
+    def fee_fraction(self, fee: int = 3000) -> tuple:
+        """
+        Returns the fee multiplier as the smallest integer fraction
+        ex) 3000 -> (997, 1000), 2500 -> (399, 400)
+
+        The intermediate values of get_amount_out are then the same as that of UniswapV2Library,
+        which matters when checking for uint256 overflows
+        """
+        fee = int(fee)
+        gcd = math.gcd(FEE_DENOMINATOR - fee, FEE_DENOMINATOR)
+        return (FEE_DENOMINATOR - fee) // gcd, FEE_DENOMINATOR // gcd
+
     def get_amount_out(self,
-                       amount_in: float,
-                       reserve_in: float,
-                       reserve_out: float,
-                       fee: float = 3000):
+                       amount_in: int,
+                       reserve_in: int,
+                       reserve_out: int,
+                       fee: int = 3000) -> int:
         """
         Fee in Uniswap V2 variants are 0.3%
         However, for variants that have different fee rates,
         fee can be overrided
 
-        fee in get_amount_out, get_amount_in are used in the format
-        that is saved into storage_array from dex.DEX class for consistency
-        with Uniswap V3 variant pools
+        fee in get_amount_out, get_amount_in are used in the format of pools: 3000 = 0.3%
+
+        Uses integer math with uint256 semantics, and returns the same value as
+        UniswapV2Library.getAmountOut (=SimulatorV1.simulateUniswapV2SwapIn)
+        Swaps that would revert on-chain (zero amount_in/reserves, overflows) return 0
         """
-        fee = fee // 1000
-        amount_in_with_fee = amount_in * (1000 - fee)
+        amount_in, reserve_in, reserve_out = int(amount_in), int(reserve_in), int(reserve_out)
+
+        if amount_in <= 0 or reserve_in <= 0 or reserve_out <= 0:
+            return 0
+
+        fee_numerator, fee_denominator = self.fee_fraction(fee)
+
+        amount_in_with_fee = amount_in * fee_numerator
         numerator = amount_in_with_fee * reserve_out
-        denominator = (reserve_in * 1000) + amount_in_with_fee
-        return int(numerator / denominator)
+        denominator = reserve_in * fee_denominator + amount_in_with_fee
+
+        if max(amount_in_with_fee, numerator, denominator) > UINT256_MAX:
+            return 0
+
+        return numerator // denominator
 
     def get_amount_in(self,
-                      amount_out: float,
-                      reserve_in: float,
-                      reserve_out: float,
-                      fee: float = 3000):
+                      amount_out: int,
+                      reserve_in: int,
+                      reserve_out: int,
+                      fee: int = 3000) -> int:
+        """
+        Returns the same value as UniswapV2Library.getAmountIn
+        Swaps that would revert on-chain return 0
+        """
+        amount_out, reserve_in, reserve_out = int(amount_out), int(reserve_in), int(reserve_out)
+
+        if amount_out <= 0 or reserve_in <= 0 or reserve_out <= amount_out:
+            return 0
+
+        fee_numerator, fee_denominator = self.fee_fraction(fee)
+
+        numerator = reserve_in * amount_out * fee_denominator
+        denominator = (reserve_out - amount_out) * fee_numerator
+        return numerator // denominator + 1
+
+    def get_amounts_out(self,
+                        amounts_in: Sequence[int] or np.ndarray,
+                        reserves_in: Sequence[int] or np.ndarray,
+                        reserves_out: Sequence[int] or np.ndarray,
+                        fee: int = 3000) -> np.ndarray:
+        """
+        Batched version of get_amount_out
+        amounts_in, reserves_in, reserves_out are broadcast against each other like NumPy arrays
+
+        ex) amounts_in: (m,), reserves_in/out: (n, 1) --> amounts_out: (n, m)
+
+        :return: np.ndarray of Python ints (dtype=object)
+        """
+        amounts_in = to_uint(amounts_in)
+        reserves_in = to_uint(reserves_in)
+        reserves_out = to_uint(reserves_out)
+
+        fee_numerator, fee_denominator = self.fee_fraction(fee)
+
+        amount_in_with_fee = amounts_in * fee_numerator
+        numerator = amount_in_with_fee * reserves_out
+        denominator = reserves_in * fee_denominator + amount_in_with_fee
+
+        valid = (amounts_in > 0) & (reserves_in > 0) & (reserves_out > 0)
+        valid &= (numerator <= UINT256_MAX) & (denominator <= UINT256_MAX)
+        valid = valid.astype(bool)
+
+        amounts_out = numerator // np.where(valid, denominator, 1)
+        return np.where(valid, amounts_out, 0).astype(object)
+
+    def get_amounts_out_path(self,
+                             amounts_in: Sequence[int] or np.ndarray,
+                             reserves_in: Sequence,
+                             reserves_out: Sequence,
+                             fees: Sequence[int] = None) -> np.ndarray:
+        """
+        Simulates multi-hop swaps the way SimulatorV1.simulateSwapIn does:
+        the amount out of a swap is the amount in of the next swap
+
+        :param reserves_in: reserve_in of each hop, each of which is broadcast against amounts_in
+        :param reserves_out: reserve_out of each hop
+        :param fees: fee of each hop, defaults to 3000 for all hops
+        A route that reverts at any hop returns 0
+        """
+        if fees is None:
+            fees = [3000] * len(reserves_in)
+
+        amounts = to_uint(amounts_in)
+
+        for reserve_in, reserve_out, fee in zip(reserves_in, reserves_out, fees):
+            amounts = self.get_amounts_out(amounts, reserve_in, reserve_out, fee)
 
-        fee = fee // 1000
-        numerator = reserve_in * amount_out * 1000
-        denominator = (reserve_out - amount_out) * (1000 - fee)
-        return int(numerator / denominator + 1)
+        return amounts
 
     def get_max_amount_in(self,
                           reserve0: float,
@@ -87,7 +192,7 @@ class UniswapV2Simulator:
         :param slippage_tolerance_lower: 0.01 (1%), 0.005 (0.5%), ...
         :param slippage_tolerance_upper: 0.01 (1%), ...
         """
-        fee_pct = fee / 10000.0 / 100.0
+        fee_pct = fee / FEE_DENOMINATOR
         price_quote = self.reserves_to_price(reserve0,
                                              reserve1,
                                              decimals0,
@@ -1,23 +1,149 @@
 import math
 import numpy as np
+from typing import Dict, List, Optional, Set
 
+from simulation.uniswap_v3_math import *
 
-class UniswapV3Simulator:
+
+class TickDataError(Exception):
+    """
+    Raised when a swap reaches ticks that aren't loaded in UniswapV3Pool
+    Swaps like these should be simulated online
+    """
+
+    def __init__(self, msg: str):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class UniswapV3Pool:
+    """
+    Local copy of the state of an Uniswap V3 pool that swaps are simulated on
+
+    Only the values that UniswapV3Pool.swap reads are kept:
+    slot0 (sqrtPriceX96, tick), liquidity, fee, tickSpacing, tickBitmap, ticks.liquidityNet
+    and ticks.liquidityGross, which decides when ticks are flipped in the bitmap on Mint/Burn
     """
-    For the time being, V3 simulator limits swap simulations to
-    single tick swaps for simplicity
 
-    This is a design to enforce less price impact on swap actions.
-    It also makes sense to limit swaps to single tick swaps, because that is how
-    arbitrage/market making is done in most cases using limit orders.
+    def __init__(self,
+                 sqrt_price_x96: int,
+                 tick: int,
+                 liquidity: int,
+                 fee: int,
+                 tick_spacing: Optional[int] = None,
+                 ticks: Optional[Dict[int, int]] = None,
+                 tick_bitmap: Optional[Dict[int, int]] = None,
+                 liquidity_gross: Optional[Dict[int, int]] = None,
+                 loaded_words: Optional[Set[int]] = None):
+        """
+        :param fee: 100, 500, 3000, 10000
+        :param tick_spacing: defaults to the tick spacing of the fee tier
+
+        :param ticks: liquidityNet of initialized ticks
+        ex) {-887220: 1000000, 887220: -1000000, ...}
+
+        :param tick_bitmap: words of tickBitmap, words that aren't in the dict are 0
+        If None, the bitmap is built from ticks
+        ex) {-14: 2 ** 255, 13: 1, ...}
+
+        :param liquidity_gross: liquidityGross of initialized ticks
+        If None, abs(liquidityNet) is used, which is only exact for ticks that are used by one side of positions
+
+        :param loaded_words: positions of the tickBitmap words that were loaded from the pool
+        Swaps that reach other words raise TickDataError. If None, all words are assumed to be loaded
+        """
+        self.sqrt_price_x96 = int(sqrt_price_x96)
+        self.tick = int(tick)
+        self.liquidity = int(liquidity)
+        self.fee = int(fee)
+        self.tick_spacing = int(tick_spacing or FEE_TO_TICK_SPACING[self.fee])
+        self.ticks = {int(t): int(net) for t, net in (ticks or {}).items()}
+
+        if liquidity_gross is None:
+            self.liquidity_gross = {t: max(abs(net), 1) for t, net in self.ticks.items()}
+        else:
+            self.liquidity_gross = {int(t): int(gross) for t, gross in liquidity_gross.items()}
+
+        if tick_bitmap is None:
+            self.tick_bitmap = {}
+            for t in self.ticks:
+                word_pos, bit_pos = tick_position(compress_tick(t, self.tick_spacing))
+                self.tick_bitmap[word_pos] = self.tick_bitmap.get(word_pos, 0) | (1 << bit_pos)
+        else:
+            self.tick_bitmap = {int(w): int(word) for w, word in tick_bitmap.items()}
 
-    Strategies don't utilize market orders (in the case of CEXs) or multi-tick swaps
-    that much when slippage is an important factor in profitability.
+        self.loaded_words = None if loaded_words is None else set(loaded_words)
 
-    TODO: Add TickMap and TickMath to support simulation of multi-tick swaps
-    However, I mark this as TODO.
-    Market orders / Multi-tick swaps can help to increase order size and reduce leg outs,
-    so this is a feature that should be implemented in the future.
+    def copy(self) -> 'UniswapV3Pool':
+        return UniswapV3Pool(self.sqrt_price_x96,
+                             self.tick,
+                             self.liquidity,
+                             self.fee,
+                             self.tick_spacing,
+                             self.ticks,
+                             self.tick_bitmap,
+                             self.liquidity_gross,
+                             self.loaded_words)
+
+    def is_loaded(self, word_pos: int) -> bool:
+        return self.loaded_words is None or word_pos in self.loaded_words
+
+    def update_slot0(self,
+                     sqrt_price_x96: int,
+                     tick: Optional[int] = None,
+                     liquidity: Optional[int] = None):
+        """
+        Updates the pool with the values from a Swap event
+        If tick is None, it is calculated from sqrt_price_x96
+        """
+        self.sqrt_price_x96 = int(sqrt_price_x96)
+        self.tick = get_tick_at_sqrt_ratio(self.sqrt_price_x96) if tick is None else int(tick)
+        if liquidity is not None:
+            self.liquidity = int(liquidity)
+
+    def update_position(self, tick_lower: int, tick_upper: int, liquidity_delta: int):
+        """
+        Updates the pool with the values from Mint (liquidity_delta > 0), Burn (liquidity_delta < 0) events
+        the same way UniswapV3Pool._modifyPosition does
+
+        Ticks in words that aren't loaded are skipped, those words are still not loaded afterwards
+        """
+        for tick, liquidity_net_delta in [(tick_lower, liquidity_delta), (tick_upper, -liquidity_delta)]:
+            self._update_tick(int(tick), int(liquidity_delta), int(liquidity_net_delta))
+
+        if tick_lower <= self.tick < tick_upper:
+            self.liquidity += liquidity_delta
+
+    def _update_tick(self, tick: int, liquidity_gross_delta: int, liquidity_net_delta: int):
+        word_pos, bit_pos = tick_position(compress_tick(tick, self.tick_spacing))
+
+        if not self.is_loaded(word_pos):
+            return
+
+        gross_before = self.liquidity_gross.get(tick, 0)
+        gross_after = gross_before + liquidity_gross_delta
+
+        # flip the tick in the bitmap when it gets initialized/uninitialized
+        if (gross_before == 0) != (gross_after == 0):
+            self.tick_bitmap[word_pos] = self.tick_bitmap.get(word_pos, 0) ^ (1 << bit_pos)
+
+        if gross_after == 0:
+            self.ticks.pop(tick, None)
+            self.liquidity_gross.pop(tick, None)
+        else:
+            self.ticks[tick] = self.ticks.get(tick, 0) + liquidity_net_delta
+            self.liquidity_gross[tick] = gross_after
+
+
+class UniswapV3Simulator:
+    """
+    Simulates swaps of Uniswap V3 variant pools offline, with the same integer math as the pool contracts
+    Swaps can cross any number of ticks, as long as the ticks/bitmap words crossed are in UniswapV3Pool
+
+    get_amount_out, get_amount_in return the same values as
+    QuoterV2.quoteExactInputSingle, QuoterV2.quoteExactOutputSingle (sqrtPriceLimitX96 = 0)
 
     * Reference: https://blog.uniswap.org/uniswap-v3-math-primer
     """
@@ -68,11 +194,166 @@ class UniswapV3Simulator:
         price_range = self.tick_to_price(ticks, decimals0, decimals1)
         return price_range if token0_in else (1 / price_range)[::-1]
 
-    def get_amount_out(self):
-        pass
+    def swap(self,
+             pool: UniswapV3Pool,
+             zero_for_one: bool,
+             amount_specified: int,
+             sqrt_price_limit_x96: int = 0) -> tuple:
+        """
+        UniswapV3Pool.swap without the transfers, fee growth, oracle updates
+        The pool is not changed, the state after the swap is returned instead
 
-    def get_amount_in(self):
-        pass
+        :param amount_specified: > 0 for exact input swaps, < 0 for exact output swaps
+        :param sqrt_price_limit_x96: 0 for no limit, like QuoterV2
+        :return: (amount0, amount1, sqrt_price_x96, tick, liquidity, ticks_crossed)
+        amount0, amount1 are the deltas of the pool's balances: > 0 paid to the pool, < 0 paid by the pool
+        """
+        if amount_specified == 0:
+            raise V3MathError('AS')
+
+        if sqrt_price_limit_x96 == 0:
+            sqrt_price_limit_x96 = MIN_SQRT_RATIO + 1 if zero_for_one else MAX_SQRT_RATIO - 1
+
+        if zero_for_one:
+            valid_limit = MIN_SQRT_RATIO < sqrt_price_limit_x96 < pool.sqrt_price_x96
+        else:
+            valid_limit = pool.sqrt_price_x96 < sqrt_price_limit_x96 < MAX_SQRT_RATIO
+
+        if not valid_limit:
+            raise V3MathError('SPL')
+
+        exact_input = amount_specified > 0
+
+        amount_remaining = amount_specified
+        amount_calculated = 0
+        sqrt_price_x96 = pool.sqrt_price_x96
+        tick = pool.tick
+        liquidity = pool.liquidity
+        ticks_crossed = 0
+
+        while amount_remaining != 0 and sqrt_price_x96 != sqrt_price_limit_x96:
+            sqrt_price_start_x96 = sqrt_price_x96
+
+            # the bitmap word nextInitializedTickWithinOneWord searches
+            word_pos, _ = tick_position(compress_tick(tick, pool.tick_spacing) + (0 if zero_for_one else 1))
+            if not pool.is_loaded(word_pos):
+                raise TickDataError(f'tick bitmap word {word_pos} is not loaded')
+
+            tick_next, initialized = next_initialized_tick_within_one_word(pool.tick_bitmap,
+                                                                           tick,
+                                                                           pool.tick_spacing,
+                                                                           zero_for_one)
+            tick_next = min(max(tick_next, MIN_TICK), MAX_TICK)
+            sqrt_price_next_x96 = get_sqrt_ratio_at_tick(tick_next)
+
+            if zero_for_one:
+                use_limit = sqrt_price_next_x96 < sqrt_price_limit_x96
+            else:
+                use_limit = sqrt_price_next_x96 > sqrt_price_limit_x96
+
+            sqrt_price_x96, amount_in, amount_out, fee_amount = compute_swap_step(
+                sqrt_price_x96,
+                sqrt_price_limit_x96 if use_limit else sqrt_price_next_x96,
+                liquidity,
+                amount_remaining,
+                pool.fee
+            )
+
+            if exact_input:
+                amount_remaining -= amount_in + fee_amount
+                amount_calculated -= amount_out
+            else:
+                amount_remaining += amount_out
+                amount_calculated += amount_in + fee_amount
+
+            if sqrt_price_x96 == sqrt_price_next_x96:
+                # the price moved to the next tick, cross it if it's initialized
+                if initialized:
+                    if tick_next not in pool.ticks:
+                        raise TickDataError(f'liquidityNet of initialized tick {tick_next} is not loaded')
+                    liquidity_net = -pool.ticks[tick_next] if zero_for_one else pool.ticks[tick_next]
+                    liquidity += liquidity_net
+                    if liquidity < 0:
+                        raise V3MathError('LS')
+                    ticks_crossed += 1
+                tick = tick_next - 1 if zero_for_one else tick_next
+            elif sqrt_price_x96 != sqrt_price_start_x96:
+                tick = get_tick_at_sqrt_ratio(sqrt_price_x96)
+
+        if zero_for_one == exact_input:
+            amount0, amount1 = amount_specified - amount_remaining, amount_calculated
+        else:
+            amount0, amount1 = amount_calculated, amount_specified - amount_remaining
+
+        return amount0, amount1, sqrt_price_x96, tick, liquidity, ticks_crossed
+
+    def get_amount_out(self,
+                       pool: UniswapV3Pool,
+                       amount_in: int,
+                       zero_for_one: bool) -> int:
+        """
+        Returns the same value as QuoterV2.quoteExactInputSingle with sqrtPriceLimitX96 = 0
+        If the pool runs out of liquidity, the amount out of the partial swap is returned like QuoterV2
+        Swaps that would revert on-chain return 0, swaps that reach ticks that aren't loaded raise TickDataError
+
+        :param zero_for_one: True if token_in is token0
+        """
+        amount_in = int(amount_in)
+
+        if amount_in <= 0:
+            return 0
+
+        try:
+            amount0, amount1, *_ = self.swap(pool, zero_for_one, amount_in)
+        except V3MathError:
+            return 0
+
+        # QuoterV2's callback reverts on swaps that don't pay anything
+        if amount0 <= 0 and amount1 <= 0:
+            return 0
+
+        return -amount1 if zero_for_one else -amount0
+
+    def get_amount_in(self,
+                      pool: UniswapV3Pool,
+                      amount_out: int,
+                      zero_for_one: bool) -> int:
+        """
+        Returns the same value as QuoterV2.quoteExactOutputSingle with sqrtPriceLimitX96 = 0
+        Swaps that would revert on-chain, including swaps that can't get the full amount_out, return 0
+        """
+        amount_out = int(amount_out)
+
+        if amount_out <= 0:
+            return 0
+
+        try:
+            amount0, amount1, *_ = self.swap(pool, zero_for_one, -amount_out)
+        except V3MathError:
+            return 0
+
+        if amount0 <= 0 and amount1 <= 0:
+            return 0
+
+        amount_in, amount_received = (amount0, -amount1) if zero_for_one else (amount1, -amount0)
+
+        # QuoterV2 reverts if the full amount out can't be swapped
+        if amount_received != amount_out:
+            return 0
+
+        return amount_in
+
+    def get_amounts_out(self,
+                        pool: UniswapV3Pool,
+                        amounts_in: List[int] or np.ndarray,
+                        zero_for_one: bool) -> np.ndarray:
+        """
+        get_amount_out of multiple candidate amounts in
+
+        :return: np.ndarray of Python ints (dtype=object)
+        """
+        amounts_out = [self.get_amount_out(pool, amount_in, zero_for_one) for amount_in in amounts_in]
+        return np.array(amounts_out, dtype=object)
 
 
 
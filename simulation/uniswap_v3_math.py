@@ -0,0 +1,368 @@
+"""
+Python ports of the libraries Uniswap V3 pools use to swap:
+TickMath, SqrtPriceMath, SwapMath, FullMath, TickBitmap
+
+All values are Python ints, and results are identical to that of the Solidity libraries
+Calls that would revert on-chain raise V3MathError
+
+* Reference: https://github.com/Uniswap/v3-core/tree/main/contracts/libraries
+"""
+import math
+
+MIN_TICK = -887272
+MAX_TICK = 887272
+
+MIN_SQRT_RATIO = 4295128739
+MAX_SQRT_RATIO = 1461446703485210103287273052203988822378723970342
+
+Q96 = 2 ** 96
+UINT160_MAX = 2 ** 160 - 1
+UINT256_MAX = 2 ** 256 - 1
+
+FEE_DENOMINATOR = 1000000
+
+# Uniswap V3 tick spacings by fee tier
+FEE_TO_TICK_SPACING = {
+    100: 1,
+    500: 10,
+    3000: 60,
+    10000: 200,
+}
+
+
+class V3MathError(Exception):
+
+    def __init__(self, msg: str):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+"""
+FullMath, UnsafeMath
+"""
+
+
+def mul_div(a: int, b: int, denominator: int) -> int:
+    result = a * b // denominator
+    if result > UINT256_MAX:
+        raise V3MathError('mulDiv overflow')
+    return result
+
+
+def mul_div_rounding_up(a: int, b: int, denominator: int) -> int:
+    result = -(-a * b // denominator)
+    if result > UINT256_MAX:
+        raise V3MathError('mulDivRoundingUp overflow')
+    return result
+
+
+def div_rounding_up(x: int, y: int) -> int:
+    return -(-x // y)
+
+
+"""
+TickMath
+"""
+
+# 1 / sqrt(1.0001) ** (2 ** i) in Q128.128, for i in 1 ~ 19
+_TICK_RATIOS = [
+    0xfff97272373d413259a46990580e213a,
+    0xfff2e50f5f656932ef12357cf3c7fdcc,
+    0xffe5caca7e10e4e61c3624eaa0941cd0,
+    0xffcb9843d60f6159c9db58835c926644,
+    0xff973b41fa98c081472e6896dfb254c0,
+    0xff2ea16466c96a3843ec78b326b52861,
+    0xfe5dee046a99a2a811c461f1969c3053,
+    0xfcbe86c7900a88aedcffc83b479aa3a4,
+    0xf987a7253ac413176f2b074cf7815e54,
+    0xf3392b0822b70005940c7a398e4b70f3,
+    0xe7159475a2c29b7443b29c7fa6e889d9,
+    0xd097f3bdfd2022b8845ad8f792aa5825,
+    0xa9f746462d870fdf8a65dc1f90e061e5,
+    0x70d869a156d2a1b890bb3df62baf32f7,
+    0x31be135f97d08fd981231505542fcfa6,
+    0x9aa508b5b7a84e1c677de54f3e99bc9,
+    0x5d6af8dedb81196699c329225ee604,
+    0x2216e584f5fa1ea926041bedfe98,
+    0x48a170391f7dc42444e8fa2,
+]
+
+
+def get_sqrt_ratio_at_tick(tick: int) -> int:
+    """
+    TickMath.getSqrtRatioAtTick: sqrt(1.0001 ** tick) * 2 ** 96
+    """
+    abs_tick = abs(tick)
+    if abs_tick > MAX_TICK:
+        raise V3MathError('T')
+
+    ratio = 0xfffcb933bd6fad37aa2d162d1a594001 if abs_tick & 0x1 else 0x100000000000000000000000000000000
+
+    for i, tick_ratio in enumerate(_TICK_RATIOS, start=1):
+        if abs_tick & (1 << i):
+            ratio = (ratio * tick_ratio) >> 128
+
+    if tick > 0:
+        ratio = UINT256_MAX // ratio
+
+    # Q128.128 -> Q64.96, rounding up
+    return (ratio >> 32) + (0 if ratio % (1 << 32) == 0 else 1)
+
+
+def get_tick_at_sqrt_ratio(sqrt_price_x96: int) -> int:
+    """
+    TickMath.getTickAtSqrtRatio: the greatest tick such that get_sqrt_ratio_at_tick(tick) <= sqrt_price_x96
+
+    TickMath computes this with a fixed point log2, here we estimate the tick with floats,
+    and correct the estimate with get_sqrt_ratio_at_tick, which gives the same result
+    """
+    if not MIN_SQRT_RATIO <= sqrt_price_x96 < MAX_SQRT_RATIO:
+        raise V3MathError('R')
+
+    tick = math.floor(2 * math.log(sqrt_price_x96 / Q96) / math.log(1.0001))
+    tick = min(max(tick, MIN_TICK), MAX_TICK)
+
+    while tick > MIN_TICK and get_sqrt_ratio_at_tick(tick) > sqrt_price_x96:
+        tick -= 1
+    while tick < MAX_TICK and get_sqrt_ratio_at_tick(tick + 1) <= sqrt_price_x96:
+        tick += 1
+
+    return tick
+
+
+"""
+SqrtPriceMath
+"""
+
+
+def get_next_sqrt_price_from_amount0_rounding_up(sqrt_price_x96: int,
+                                                 liquidity: int,
+                                                 amount: int,
+                                                 add: bool) -> int:
+    if amount == 0:
+        return sqrt_price_x96
+
+    numerator1 = liquidity << 96
+    product = amount * sqrt_price_x96
+
+    if add:
+        if product <= UINT256_MAX:
+            denominator = numerator1 + product
+            if denominator <= UINT256_MAX:
+                return mul_div_rounding_up(numerator1, sqrt_price_x96, denominator)
+        return div_rounding_up(numerator1, numerator1 // sqrt_price_x96 + amount)
+    else:
+        if product > UINT256_MAX or numerator1 <= product:
+            raise V3MathError('getNextSqrtPriceFromAmount0RoundingUp')
+        denominator = numerator1 - product
+        next_sqrt_price = mul_div_rounding_up(numerator1, sqrt_price_x96, denominator)
+        if next_sqrt_price > UINT160_MAX:
+            raise V3MathError('toUint160')
+        return next_sqrt_price
+
+
+def get_next_sqrt_price_from_amount1_rounding_down(sqrt_price_x96: int,
+                                                   liquidity: int,
+                                                   amount: int,
+                                                   add: bool) -> int:
+    if add:
+        next_sqrt_price = sqrt_price_x96 + (amount << 96) // liquidity
+        if next_sqrt_price > UINT160_MAX:
+            raise V3MathError('toUint160')
+        return next_sqrt_price
+    else:
+        quotient = div_rounding_up(amount << 96, liquidity)
+        if sqrt_price_x96 <= quotient:
+            raise V3MathError('getNextSqrtPriceFromAmount1RoundingDown')
+        return sqrt_price_x96 - quotient
+
+
+def get_next_sqrt_price_from_input(sqrt_price_x96: int,
+                                   liquidity: int,
+                                   amount_in: int,
+                                   zero_for_one: bool) -> int:
+    if sqrt_price_x96 <= 0 or liquidity <= 0:
+        raise V3MathError('getNextSqrtPriceFromInput')
+
+    if zero_for_one:
+        return get_next_sqrt_price_from_amount0_rounding_up(sqrt_price_x96, liquidity, amount_in, True)
+    else:
+        return get_next_sqrt_price_from_amount1_rounding_down(sqrt_price_x96, liquidity, amount_in, True)
+
+
+def get_next_sqrt_price_from_output(sqrt_price_x96: int,
+                                    liquidity: int,
+                                    amount_out: int,
+                                    zero_for_one: bool) -> int:
+    if sqrt_price_x96 <= 0 or liquidity <= 0:
+        raise V3MathError('getNextSqrtPriceFromOutput')
+
+    if zero_for_one:
+        return get_next_sqrt_price_from_amount1_rounding_down(sqrt_price_x96, liquidity, amount_out, False)
+    else:
+        return get_next_sqrt_price_from_amount0_rounding_up(sqrt_price_x96, liquidity, amount_out, False)
+
+
+def get_amount0_delta(sqrt_ratio_a_x96: int, sqrt_ratio_b_x96: int, liquidity: int, round_up: bool) -> int:
+    if sqrt_ratio_a_x96 > sqrt_ratio_b_x96:
+        sqrt_ratio_a_x96, sqrt_ratio_b_x96 = sqrt_ratio_b_x96, sqrt_ratio_a_x96
+
+    if sqrt_ratio_a_x96 <= 0:
+        raise V3MathError('getAmount0Delta')
+
+    numerator1 = liquidity << 96
+    numerator2 = sqrt_ratio_b_x96 - sqrt_ratio_a_x96
+
+    if round_up:
+        return div_rounding_up(mul_div_rounding_up(numerator1, numerator2, sqrt_ratio_b_x96), sqrt_ratio_a_x96)
+    else:
+        return mul_div(numerator1, numerator2, sqrt_ratio_b_x96) // sqrt_ratio_a_x96
+
+
+def get_amount1_delta(sqrt_ratio_a_x96: int, sqrt_ratio_b_x96: int, liquidity: int, round_up: bool) -> int:
+    if sqrt_ratio_a_x96 > sqrt_ratio_b_x96:
+        sqrt_ratio_a_x96, sqrt_ratio_b_x96 = sqrt_ratio_b_x96, sqrt_ratio_a_x96
+
+    if round_up:
+        return mul_div_rounding_up(liquidity, sqrt_ratio_b_x96 - sqrt_ratio_a_x96, Q96)
+    else:
+        return mul_div(liquidity, sqrt_ratio_b_x96 - sqrt_ratio_a_x96, Q96)
+
+
+"""
+SwapMath
+"""
+
+
+def compute_swap_step(sqrt_ratio_current_x96: int,
+                      sqrt_ratio_target_x96: int,
+                      liquidity: int,
+                      amount_remaining: int,
+                      fee_pips: int) -> tuple:
+    """
+    SwapMath.computeSwapStep
+    amount_remaining > 0 for exact input swaps, amount_remaining < 0 for exact output swaps
+
+    :return: (sqrt_ratio_next_x96, amount_in, amount_out, fee_amount)
+    """
+    zero_for_one = sqrt_ratio_current_x96 >= sqrt_ratio_target_x96
+    exact_in = amount_remaining >= 0
+
+    amount_in = 0
+    amount_out = 0
+
+    if exact_in:
+        amount_remaining_less_fee = mul_div(amount_remaining, FEE_DENOMINATOR - fee_pips, FEE_DENOMINATOR)
+        if zero_for_one:
+            amount_in = get_amount0_delta(sqrt_ratio_target_x96, sqrt_ratio_current_x96, liquidity, True)
+        else:
+            amount_in = get_amount1_delta(sqrt_ratio_current_x96, sqrt_ratio_target_x96, liquidity, True)
+
+        if amount_remaining_less_fee >= amount_in:
+            sqrt_ratio_next_x96 = sqrt_ratio_target_x96
+        else:
+            sqrt_ratio_next_x96 = get_next_sqrt_price_from_input(sqrt_ratio_current_x96,
+                                                                 liquidity,
+                                                                 amount_remaining_less_fee,
+                                                                 zero_for_one)
+    else:
+        if zero_for_one:
+            amount_out = get_amount1_delta(sqrt_ratio_target_x96, sqrt_ratio_current_x96, liquidity, False)
+        else:
+            amount_out = get_amount0_delta(sqrt_ratio_current_x96, sqrt_ratio_target_x96, liquidity, False)
+
+        if -amount_remaining >= amount_out:
+            sqrt_ratio_next_x96 = sqrt_ratio_target_x96
+        else:
+            sqrt_ratio_next_x96 = get_next_sqrt_price_from_output(sqrt_ratio_current_x96,
+                                                                  liquidity,
+                                                                  -amount_remaining,
+                                                                  zero_for_one)
+
+    is_max = sqrt_ratio_target_x96 == sqrt_ratio_next_x96
+
+    if zero_for_one:
+        if not (is_max and exact_in):
+            amount_in = get_amount0_delta(sqrt_ratio_next_x96, sqrt_ratio_current_x96, liquidity, True)
+        if not (is_max and not exact_in):
+            amount_out = get_amount1_delta(sqrt_ratio_next_x96, sqrt_ratio_current_x96, liquidity, False)
+    else:
+        if not (is_max and exact_in):
+            amount_in = get_amount1_delta(sqrt_ratio_current_x96, sqrt_ratio_next_x96, liquidity, True)
+        if not (is_max and not exact_in):
+            amount_out = get_amount0_delta(sqrt_ratio_current_x96, sqrt_ratio_next_x96, liquidity, False)
+
+    # cap the output amount to not exceed the remaining output amount
+    if not exact_in and amount_out > -amount_remaining:
+        amount_out = -amount_remaining
+
+    if exact_in and sqrt_ratio_next_x96 != sqrt_ratio_target_x96:
+        # we didn't reach the target, so take the remainder of the maximum input as fee
+        fee_amount = amount_remaining - amount_in
+    else:
+        fee_amount = mul_div_rounding_up(amount_in, fee_pips, FEE_DENOMINATOR - fee_pips)
+
+    return sqrt_ratio_next_x96, amount_in, amount_out, fee_amount
+
+
+"""
+TickBitmap
+"""
+
+
+def compress_tick(tick: int, tick_spacing: int) -> int:
+    """
+    tick / tick_spacing, rounded towards negative infinity
+    """
+    return tick // tick_spacing
+
+
+def tick_position(compressed: int) -> tuple:
+    """
+    TickBitmap.position: (word_pos, bit_pos) of a compressed tick in the bitmap
+    """
+    return compressed >> 8, compressed % 256
+
+
+def next_initialized_tick_within_one_word(tick_bitmap: dict,
+                                          tick: int,
+                                          tick_spacing: int,
+                                          lte: bool) -> tuple:
+    """
+    TickBitmap.nextInitializedTickWithinOneWord
+    Searches only within the bitmap word of the tick, which is why pools cross
+    uninitialized ticks at word boundaries
+
+    :param tick_bitmap: {word_pos: word}, words that aren't in the dict are 0
+    :return: (next tick, initialized)
+    """
+    compressed = compress_tick(tick, tick_spacing)
+
+    if lte:
+        word_pos, bit_pos = tick_position(compressed)
+        # all the 1s at or to the right of the current bit_pos
+        mask = (1 << bit_pos) - 1 + (1 << bit_pos)
+        masked = tick_bitmap.get(word_pos, 0) & mask
+
+        initialized = masked != 0
+        if initialized:
+            next_tick = (compressed - (bit_pos - (masked.bit_length() - 1))) * tick_spacing
+        else:
+            next_tick = (compressed - bit_pos) * tick_spacing
+    else:
+        # start from the word of the next tick, since the current tick state doesn't matter
+        word_pos, bit_pos = tick_position(compressed + 1)
+        # all the 1s at or to the left of the bit_pos
+        mask = ~((1 << bit_pos) - 1) & UINT256_MAX
+        masked = tick_bitmap.get(word_pos, 0) & mask
+
+        initialized = masked != 0
+        if initialized:
+            least_significant_bit = (masked & -masked).bit_length() - 1
+            next_tick = (compressed + 1 + (least_significant_bit - bit_pos)) * tick_spacing
+        else:
+            next_tick = (compressed + 1 + (255 - bit_pos)) * tick_spacing
+
+    return next_tick, initialized
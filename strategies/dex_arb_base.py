@@ -3,6 +3,7 @@ import time
 import asyncio
 import datetime
 import aioprocessing
+import numpy as np
 from functools import partial
 from dotenv import load_dotenv
 from multiprocessing import Process
@@ -11,7 +12,13 @@ from typing import Any, Dict, Optional, List
 from configs import *
 from execution import DexOrder
 from data import DEX, DexStream
-from simulation import OnlineSimulator
+from data.cache import cache_key, load_cache, save_cache
+from data.dex_streams import topology_message
+from data.recorder import FrameRecorder
+from data.latency import LatencyTracker, stamp, BLOCK_STAGES, DEQUEUE, SCAN, SIMULATE, SEND
+from data.price_board import PriceBoard, PriceMirror, ensure_resource_tracker
+from simulation import OnlineSimulator, ArbitrageOptimizer
+from strategies.spread_scanner import SpreadScanner, generate_compare_paths
 from external import InfluxDB, Telegram
 
 load_dotenv(override=True)
@@ -22,45 +29,125 @@ FLASHBOTS_PRIVATE_KEY = os.getenv('FLASHBOTS_PRIVATE_KEY')
 ETHEREUM_BOT_ADDRESS = os.getenv('ETHEREUM_BOT_ADDRESS')
 ETHEREUM_SIMULATOR_ADDRESS = os.getenv('ETHEREUM_SIMULATOR_ADDRESS')
 
+# swap paths, compare_paths are saved here and reused on restart if the pools haven't changed
+CACHE_DIR = os.getenv('CACHE_DIR', '.cache')
 
-def cycle_name(pools_1: List[int],
-               pools_2: List[int],
-               pools: List[Dict[str, Any]]) -> str:
+
+def load_compare_paths(dex: DEX, chain: str, pools: List[Dict[str, Any]]) -> Dict[str, Dict[str, tuple]]:
+    """
+    Same as generate_compare_paths, but reuses compare_paths saved in CACHE_DIR
+    if they were made from the same swap paths (=same tokens, pools, trading_symbols, max_swap_number)
+    """
+    name = f'compare_paths-{chain}'
+    key = cache_key(dex.swap_paths_key, 'compare_paths')
+
+    cached = load_cache(CACHE_DIR, name, key)
+
+    if cached is not None:
+        # symbols are saved by their position in trading_symbols
+        return {
+            symbol: dict(zip(cached[f'names_{k}'].tolist(), map(tuple, cached[f'pairs_{k}'].tolist())))
+            for k, symbol in enumerate(dex.trading_symbols)
+        }
+
+    compare_paths = generate_compare_paths(dex, pools)
+
+    arrays = {}
+    for k, symbol in enumerate(dex.trading_symbols):
+        arrays[f'names_{k}'] = np.array(list(compare_paths[symbol].keys()), dtype=str)
+        arrays[f'pairs_{k}'] = np.array(list(compare_paths[symbol].values()), dtype=np.int64).reshape(-1, 2)
+
+    save_cache(CACHE_DIR, name, key, arrays)
+
+    return compare_paths
+
+
+def make_v2_route(simulator: OnlineSimulator,
+                  reserves: Dict[int, List[int]],
+                  buy_path: List[List[int]],
+                  sell_path: List[List[int]],
+                  buy_pools: List[int],
+                  sell_pools: List[int]) -> Optional[List[Dict[str, Any]]]:
     """
-    Returns the name for cycle consisting of pools_1 and pools_2
-    ex) UNI3ETHUSDT/UNI2ETHUSDT,
-        UNI3ETHUSDT/UNI3USDCUSDT-UNI2USDCETH,
-        UNI3USDCUSDT-SUS3USDCETH/SUS3USDCUSDT-SUS2USDCETH
+    Returns the route of the same swaps as OnlineSimulator.make_params, in the format of ArbitrageOptimizer
+    using the exact reserves of Uniswap V2 variant pools
 
-    This is for logging/debugging purposes.
-    Actual bot logic does not depend on this name.
+    Returns None if the swaps go through pools that aren't Uniswap V2 variants,
+    in which case the online simulation should be used
     """
+    # buy hops in order, and sell hops in reverse order (refer to OnlineSimulator._make_sell_params)
+    hops = [(hop, pool_idx, False) for hop, pool_idx in zip(buy_path, buy_pools) if sum(hop)]
+    hops += reversed([(hop, pool_idx, True) for hop, pool_idx in zip(sell_path, sell_pools) if sum(hop)])
+
+    route = []
 
-    def _pool_name(pool: Dict[str, Any]) -> str:
-        exchange = pool['exchange'][:3].upper()
-        version = pool['version']
-        name = pool['name'].replace('/', '')
-        return f'{exchange}{version}{name}'
+    for hop, pool_idx, sell in hops:
+        pool = simulator.pools[pool_idx]
 
-    path_1_name = '-'.join([_pool_name(pools[i]) for i in pools_1])
-    path_2_name = '-'.join([_pool_name(pools[i]) for i in pools_2])
+        if pool['version'] != 2 or pool_idx not in reserves:
+            return None
 
-    return f'{path_1_name}/{path_2_name}'
+        token_in = simulator.tokens_list[hop[3] if sell else hop[2]]
+        reserve0, reserve1 = reserves[pool_idx]
+        token0_in = token_in == pool['token0']
+
+        route.append({
+            'version': 2,
+            'reserve_in': reserve0 if token0_in else reserve1,
+            'reserve_out': reserve1 if token0_in else reserve0,
+            'fee': pool['fee'],
+        })
+
+    return route
 
 
 def dex_stream_process(publisher: aioprocessing.AioQueue,
                        chain: str,
                        trading_symbols: List[str],
-                       max_swaps: int = 3):
+                       max_swaps: int = 3,
+                       use_price_board: bool = True,
+                       coalesce: bool = False,
+                       record_path: Optional[str] = None,
+                       trace_latency: bool = True):
+    """
+    :param use_price_board: share prices through shared memory (data.price_board.PriceBoard) if True,
+                            otherwise send only the re-priced rows of swap paths through publisher
+    :param coalesce: re-price/publish once per block instead of once per event, refer to data.dex_streams.DexStream
+    :param record_path: if given, websocket frames are recorded to this file, refer to data.recorder.FrameRecorder
+    :param trace_latency: send the latency trace of each event to strategy, refer to data.latency
+    """
     pools = [pool for pool in POOLS if pool['chain'] == chain]
 
     dex = DEX({chain: RPC_ENDPOINTS[chain]},
               {chain: TOKENS[chain]},
               pools,
               trading_symbols,
-              max_swaps)
+              max_swaps,
+              cache_dir=CACHE_DIR)
+
+    price_board = None
+
+    if use_price_board:
+        # prices/fees are shared with strategy through shared memory, refer to data.price_board.PriceBoard
+        price_board = PriceBoard.create({symbol: len(dex.swap_paths[symbol]['price']) for symbol in trading_symbols})
 
-    dex_stream = DexStream(dex, WS_ENDPOINTS, publisher)
+    recorder = None
+
+    if record_path:
+        recorder = FrameRecorder(record_path)
+        recorder.write_setup(dex)
+
+    dex_stream = DexStream(dex,
+                           WS_ENDPOINTS,
+                           publisher,
+                           price_board=price_board,
+                           deltas=not use_price_board,
+                           coalesce=coalesce,
+                           recorder=recorder,
+                           trace_latency=trace_latency,
+                           # exact reserves of updated V2 pools come with the event messages,
+                           # strategy simulates V2 swaps offline with them (make_v2_route)
+                           publish_reserves=True)
 
     """
     Trying to find possible cyclic arbitrage paths
@@ -85,28 +172,25 @@ def dex_stream_process(publisher: aioprocessing.AioQueue,
     Condition #2: the last pool is different
 
     compare_paths is a dictionary of possible cyclic arbitrage path pairs
+    These only depend on the swap paths, so they are cached in CACHE_DIR along with the swap paths
     """
-    compare_paths = {s: {} for s in trading_symbols}
-
-    for symbol in trading_symbols:
-        pool_indexes = dex.swap_paths[symbol]['pool_indexes']
-        for i in range(len(pool_indexes)):
-            p_1 = pool_indexes[i]
-            for j in range(i + 1, len(pool_indexes)):
-                p_2 = pool_indexes[j]
-                condition_1 = p_1[0] != p_2[0]
-                condition_2 = p_1[-1] != p_2[-1]
-                if condition_1 and condition_2:
-                    name = cycle_name(p_1, p_2, pools)
-                    compare_paths[symbol][name] = (i, j)
+    compare_paths = load_compare_paths(dex, chain, pools)
+
+    # exact reserves of Uniswap V2 variant pools, used to simulate V2 swaps offline
+    reserves = {i: dex.get_reserves(i) for i, pool in enumerate(pools) if pool['version'] == 2}
 
     # send compare_paths data to data_collector through publisher
     publisher.put({
         'source': 'dex',
         'type': 'setup',
         'compare_paths': compare_paths,
+        'reserves': reserves,
+        'price_board': price_board.layout if price_board else None,
     })
 
+    # swap paths that don't change after DEX.load are sent only once
+    publisher.put(topology_message(dex))
+
     dex_stream.start_streams()
 
 
@@ -140,7 +224,9 @@ async def strategy(subscriber: aioprocessing.AioQueue,
                    max_bet_size: float,
                    target_spread: float = 0.0,
                    retry_number: int = 2,
-                   debug: bool = False):
+                   debug: bool = False,
+                   simulation_sizes: int = 5,
+                   latency_export_interval: float = 10.0):
     rpc_endpoints = {chain: RPC_ENDPOINTS[chain]}
     tokens = {chain: TOKENS[chain]}
     pools = [pool for pool in POOLS if pool['chain'] == chain]
@@ -154,12 +240,22 @@ async def strategy(subscriber: aioprocessing.AioQueue,
     influxdb = InfluxDB()
     telegram = Telegram()
 
+    # per-stage latency histograms of event traces, p50/p99/p999 of each stage are sent to InfluxDB periodically
+    latency = LatencyTracker()
+    asyncio.ensure_future(latency.export_every(influxdb, 'DEX_ARB_BASE_LATENCY', latency_export_interval))
+
+    # orders simulated when a new block arrives are traced from the newHeads frame, refer to data.latency
+    block_latency = LatencyTracker(BLOCK_STAGES)
+    asyncio.ensure_future(block_latency.export_every(influxdb, 'DEX_ARB_BASE_BLOCK_LATENCY', latency_export_interval))
+
     simulator = OnlineSimulator(rpc_endpoints=rpc_endpoints,
                                 tokens=tokens,
                                 pools=pools,
                                 contracts=simulator_contracts,
                                 handlers=simulator_handlers)
 
+    optimizer = ArbitrageOptimizer()
+
     execution = DexOrder(private_key=FLASHBOTS_PRIVATE_KEY,
                          signing_key=FLASHBOTS_SIGNING_KEY,
                          rpc_endpoints=rpc_endpoints,
@@ -169,9 +265,13 @@ async def strategy(subscriber: aioprocessing.AioQueue,
                          handlers=execution_handlers)
 
     compare_paths = {}
+    scanners = {}
+    swap_paths = {}
+    prices = None  # PriceBoard or PriceMirror
+    reserves = {}
     gas_info = {}
 
-    spreads = {}
+    spreads = {}  # symbol -> spreads of SpreadScanner.keys
     pending = Pending()
 
     """
@@ -186,10 +286,12 @@ async def strategy(subscriber: aioprocessing.AioQueue,
         3: 50000,  # V3 1-hop cost
     }
 
-    async def _process_pending_order(pending: Pending):
+    async def _process_pending_order(pending: Pending, trace: Optional[Dict[str, int]] = None):
         """
         1. Simulate using SimulatorV1
         2. Execute order using Flashbots
+
+        :param trace: latency trace of the event or block message being handled, refer to data.latency
         """
         if pending.can_add():
             return
@@ -199,7 +301,7 @@ async def strategy(subscriber: aioprocessing.AioQueue,
         if 'block' not in gas_info or pending_info['block'] != gas_info['block']:
             return
 
-        spread = spreads[pending_info['key']]
+        spread = float(spreads[pending_info['symbol']][pending_info['position']])
 
         if spread <= target_spread:
             pending.delete_pending()
@@ -236,15 +338,43 @@ async def strategy(subscriber: aioprocessing.AioQueue,
             usdt_decimals = simulator.tokens[chain]['USDT'][1]
             # min_amount_in = max_bet_size * 10 ** usdt_decimals
             min_amount_in = int(min_amount_in_usdt * 1.1) * 10 ** usdt_decimals
-            sim_params = simulator.make_params(amount_in=min_amount_in,
-                                               buy_path=pending_info['buy_path'],
-                                               sell_path=pending_info['sell_path'],
-                                               buy_pools=pending_info['buy_pools'],
-                                               sell_pools=pending_info['sell_pools'])
+
             s = time.time()
-            simulated_amount_out = simulator.simulate(chain, sim_params)
+            # swaps that only go through Uniswap V2 variant pools are sized and simulated offline
+            route = make_v2_route(simulator,
+                                  reserves,
+                                  buy_path=pending_info['buy_path'],
+                                  sell_path=pending_info['sell_path'],
+                                  buy_pools=pending_info['buy_pools'],
+                                  sell_pools=pending_info['sell_pools'])
+
+            if route is not None:
+                """
+                Gas costs don't depend on the amount in, so the amount in that maximizes
+                the profit before gas costs also maximizes the final profit
+                """
+                optimal_amount_in = optimizer.optimal_v2_amount_in(route, max_bet_size * 10 ** usdt_decimals)
+                if optimal_amount_in > 0:
+                    min_amount_in = optimal_amount_in
+                simulated_amount_out = optimizer.get_amount_out(route, min_amount_in)
+            else:
+                sim_params = simulator.make_params(amount_in=min_amount_in,
+                                                   buy_path=pending_info['buy_path'],
+                                                   sell_path=pending_info['sell_path'],
+                                                   buy_pools=pending_info['buy_pools'],
+                                                   sell_pools=pending_info['sell_pools'])
+                # simulate amounts in from min_amount_in to max_bet_size in one call, and take the most profitable
+                amounts_in = np.unique(np.linspace(min_amount_in,
+                                                   max(max_bet_size * 10 ** usdt_decimals, min_amount_in),
+                                                   simulation_sizes).astype(np.int64))
+                amounts_out = simulator.simulate_batch(chain, [sim_params], amounts_in.tolist())[0]
+                best = int(np.argmax([int(out) - int(amount_in) for amount_in, out in zip(amounts_in, amounts_out)]))
+                min_amount_in = int(amounts_in[best])
+                simulated_amount_out = int(amounts_out[best])
             e = time.time()
             simulation_took = e - s
+            if trace is not None:
+                trace[SIMULATE] = stamp()
             simulated_profit_in_usdt = (simulated_amount_out - min_amount_in) / 10 ** usdt_decimals
 
             final_profit = simulated_profit_in_usdt - gas_cost_in_usdt
@@ -271,6 +401,8 @@ async def strategy(subscriber: aioprocessing.AioQueue,
                                                     block_number=gas_info['block'])
                     e = time.time()
                     execution_took = e - s
+                    if trace is not None:
+                        trace[SEND] = stamp()
                     print(f'Execution success. Took: {round(execution_took, 3)} secs: {receipts}')
 
             await telegram.send(
@@ -286,20 +418,45 @@ async def strategy(subscriber: aioprocessing.AioQueue,
             data = await subscriber.coro_get()
             data_type = data['type']
 
+            trace = data.get('trace')
+            if trace is not None:
+                trace[DEQUEUE] = stamp()
+
             if data_type == 'setup':
                 # data sent from: strategies.dex_arb_base.dex_stream_process
                 compare_paths = data['compare_paths']
+                scanners = {symbol: SpreadScanner(paths) for symbol, paths in compare_paths.items()}
+                reserves = data['reserves']
+                if data['price_board']:
+                    prices = PriceBoard.attach(data['price_board'])
+
+            elif data_type == 'topology':
+                # data sent from: strategies.dex_arb_base.dex_stream_process
+                swap_paths = data['swap_paths']
+                if prices is None:
+                    # prices are patched with delta messages if there is no PriceBoard
+                    prices = PriceMirror(swap_paths)
 
             elif data_type == 'block':
                 # data sent from: data.dex_streams.DexStream.stream_new_blocks
                 gas_info = data
                 print('[New block] ', gas_info)
 
-                await _process_pending_order(pending)
+                await _process_pending_order(pending, trace)
 
-            elif data_type == 'event':
+                if trace is not None and SIMULATE in trace:
+                    block_latency.record(trace)
+
+            elif data_type in ['event', 'delta']:
                 s = time.time()
                 # data sent from: data.dex_streams.DexStream.stream_uniswap_v2_events/stream_uniswap_v3_events
+                if data_type == 'delta':
+                    # patch the local copy of prices, refer to data.price_board.PriceMirror
+                    prices.apply(data)
+
+                if 'reserves' in data:
+                    # exact reserves of the V2 pools updated, refer to DexStream(publish_reserves=True)
+                    reserves.update(data['reserves'])
 
                 """
                 Take 2-step operation before sending order transaction:
@@ -314,51 +471,48 @@ async def strategy(subscriber: aioprocessing.AioQueue,
                 This means that our simulations are done online. This will take some time, and will need to be
                 ported offline to get the best performance out
                 """
-                max_spread = -1
-                max_spread_key = ''
-                max_buy_sell_price = []
-                max_path_index = None
-
                 symbol = data['symbol']
-                for path_name, path_index in compare_paths[symbol].items():
-                    """
-                    If path_name were: UNI3ETHUSDT/UNI2ETHUSDT
-                    We want to calculate the spread for both:
-                    - UNI3ETHUSDT BUY -> UNI2ETHUSDT SELL
-                    - UNI2ETHUSDT SELL -> UNI3ETHUSDT SELL
-                    """
-                    name_1, name_2 = path_name.split('/')
-                    key_1 = f'{name_1}/{name_2}'
-                    key_2 = f'{name_2}/{name_1}'
-
-                    price_1 = data['price'][path_index[0]]
-                    price_2 = data['price'][path_index[1]]
-
-                    fee_1 = data['fee'][path_index[0]]
-                    fee_2 = data['fee'][path_index[1]]
-                    total_fee = fee_1 + fee_2
-
-                    spread_1 = ((price_1 / price_2 - 1) - total_fee) * 100
-                    spread_2 = ((price_2 / price_1 - 1) - total_fee) * 100
-
-                    if spread_1 > max_spread:
-                        max_spread_key = key_1
-                        max_spread = spread_1
-                        max_buy_sell_price = [price_2, price_1]
-                        max_path_index = list(reversed(path_index))  # buy pool index, sell pool index
-
-                    if spread_2 > max_spread:
-                        max_spread_key = key_2
-                        max_spread = spread_2
-                        max_buy_sell_price = [price_1, price_2]
-                        max_path_index = list(path_index)  # buy pool index, sell pool index
-
-                    spreads[key_1] = spread_1
-                    spreads[key_2] = spread_2
-
-                await influxdb.send('DEX_ARB_BASE_ETHUSDT', spreads)
+                scanner = scanners[symbol]
+
+                if not len(scanner):
+                    continue
+
+                def _scan(price: np.ndarray, fee: np.ndarray) -> tuple:
+                    # price, fee are read from PriceBoard (shared memory) or PriceMirror without copying
+                    spread_values, max_position = scanner.max_spread(price, fee)
+                    if max_position is None:
+                        return spread_values, None, None
+                    buy_idx = int(scanner.buy_index[max_position])
+                    sell_idx = int(scanner.sell_index[max_position])
+                    return spread_values, max_position, [float(price[buy_idx]), float(price[sell_idx])]
+
+                # spreads of all compare_paths pairs, refer to strategies.spread_scanner.SpreadScanner
+                scanned = prices.read(symbol, _scan)
+                if scanned is None:
+                    # the board was being written: the next notification of the symbol reads it again
+                    continue
+                spread_values, max_position, max_buy_sell_price = scanned
+
+                if max_position is None:
+                    # none of the paths of the symbol is priced
+                    continue
+
+                max_spread = float(spread_values[max_position])
+                max_spread_key = scanner.keys[max_position]
+                # buy pool index, sell pool index
+                max_path_index = [int(scanner.buy_index[max_position]), int(scanner.sell_index[max_position])]
+
+                spreads[symbol] = spread_values
+                if trace is not None:
+                    trace[SCAN] = stamp()
+
+                # only the spreads that changed are written, the last point with a field has its current value
+                changed = scanner.changed(spread_values)
+                if changed:
+                    # queued and written in batches in the background, refer to external.influxdb.InfluxDB
+                    await influxdb.send('DEX_ARB_BASE_ETHUSDT', changed)
                 e = time.time()
-                max_msg = f'{max_spread_key}: {round(spreads[max_spread_key], 3)}%'
+                max_msg = f'{max_spread_key}: {round(max_spread, 3)}%'
                 print(f'[{datetime.datetime.now()}] Update took: {round(e - s, 4)} secs. {max_msg}')
 
                 # add newly detected edge (positive spread) to pending
@@ -366,8 +520,8 @@ async def strategy(subscriber: aioprocessing.AioQueue,
                 if pending.can_add() and max_spread > target_spread:
                     # before we add the new max_spread_key, first check if the spread can cover
                     # gas costs with our max_bet_size
-                    buy_path = data['path'][max_path_index[0]]
-                    sell_path = data['path'][max_path_index[1]]
+                    buy_path = swap_paths[symbol]['path'][max_path_index[0]]
+                    sell_path = swap_paths[symbol]['path'][max_path_index[1]]
 
                     """
                     Calculate the estimated_gas_used given:
@@ -390,20 +544,25 @@ async def strategy(subscriber: aioprocessing.AioQueue,
                     """
                     pending_info = {
                         'key': max_spread_key,
+                        'symbol': symbol,
+                        'position': max_position,  # position of the spread in spreads[symbol]
                         'max_buy_sell_price': max_buy_sell_price,
                         'block': data['block'],  # block at which the edge was detected
                         'cancel_at': data['block'] + 1,  # cancel after 1 block
                         'buy_path': buy_path,
                         'sell_path': sell_path,
-                        'buy_pools': data['pool_indexes'][max_path_index[0]],
-                        'sell_pools': data['pool_indexes'][max_path_index[1]],
+                        'buy_pools': swap_paths[symbol]['pool_indexes'][max_path_index[0]],
+                        'sell_pools': swap_paths[symbol]['pool_indexes'][max_path_index[1]],
                         'estimated_gas_used': estimated_gas_used,
                         'order_processing': False,
                     }
                     pending.add_pending(pending_info)
                     print(pending_info)
 
-                await _process_pending_order(pending)
+                await _process_pending_order(pending, trace)
+
+                if trace is not None:
+                    latency.record(trace)
 
         except Exception as e:
             await influxdb.close()
@@ -421,6 +580,9 @@ async def main():
 
     queue = aioprocessing.AioQueue()
 
+    # dex_stream_process and strategy share the shared memory of PriceBoard
+    ensure_resource_tracker()
+
     p1 = Process(target=dex_stream_process, args=(queue, chain, trading_symbols, max_swaps,))
     p1.start()
 
@@ -0,0 +1,144 @@
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+from data.dex import DEX
+
+
+def cycle_name(pools_1: List[int],
+               pools_2: List[int],
+               pools: List[Dict[str, Any]]) -> str:
+    """
+    Returns the name for cycle consisting of pools_1 and pools_2
+    ex) UNI3ETHUSDT/UNI2ETHUSDT,
+        UNI3ETHUSDT/UNI3USDCUSDT-UNI2USDCETH,
+        UNI3USDCUSDT-SUS3USDCETH/SUS3USDCUSDT-SUS2USDCETH
+
+    This is for logging/debugging purposes.
+    Actual bot logic does not depend on this name.
+    """
+
+    def _pool_name(pool: Dict[str, Any]) -> str:
+        exchange = pool['exchange'][:3].upper()
+        version = pool['version']
+        name = pool['name'].replace('/', '')
+        return f'{exchange}{version}{name}'
+
+    path_1_name = '-'.join([_pool_name(pools[i]) for i in pools_1])
+    path_2_name = '-'.join([_pool_name(pools[i]) for i in pools_2])
+
+    return f'{path_1_name}/{path_2_name}'
+
+
+def generate_compare_paths(dex: DEX, pools: List[Dict[str, Any]]) -> Dict[str, Dict[str, tuple]]:
+    """
+    Returns possible cyclic arbitrage path pairs: {symbol: {cycle name: (path i, path j)}}
+    Refer to strategies.dex_arb_base.dex_stream_process for the conditions a pair has to meet
+    """
+    compare_paths = {s: {} for s in dex.trading_symbols}
+
+    for symbol in dex.trading_symbols:
+        pool_indexes = dex.swap_paths[symbol]['pool_indexes']
+        for i in range(len(pool_indexes)):
+            p_1 = pool_indexes[i]
+            for j in range(i + 1, len(pool_indexes)):
+                p_2 = pool_indexes[j]
+                condition_1 = p_1[0] != p_2[0]
+                condition_2 = p_1[-1] != p_2[-1]
+                if condition_1 and condition_2:
+                    name = cycle_name(p_1, p_2, pools)
+                    compare_paths[symbol][name] = (i, j)
+
+    return compare_paths
+
+
+class SpreadScanner:
+    """
+    Calculates the spreads of every compare_paths pair of a symbol in one NumPy pass
+
+    If path_name were: UNI3ETHUSDT/UNI2ETHUSDT
+    both directions are calculated:
+    - UNI2ETHUSDT BUY -> UNI3ETHUSDT SELL (key: UNI3ETHUSDT/UNI2ETHUSDT)
+    - UNI3ETHUSDT BUY -> UNI2ETHUSDT SELL (key: UNI2ETHUSDT/UNI3ETHUSDT)
+
+    The two directions of pair k are at positions 2k, 2k + 1,
+    so that argmax picks the same key the pair by pair loop used to
+
+    Spreads stay in NumPy arrays, only the ones that changed since the last scan are made into {key: spread}
+    (SpreadScanner.changed), so that events that re-price a few paths don't cost as much as all the pairs
+    """
+
+    def __init__(self, compare_paths: Dict[str, tuple]):
+        """
+        :param compare_paths: compare_paths of a single symbol, refer to generate_compare_paths
+        ex) {'UNI3ETHUSDT/UNI2ETHUSDT': (0, 3), ... }
+        """
+        names = list(compare_paths.keys())
+        pairs = np.array(list(compare_paths.values()), dtype=np.int64).reshape(-1, 2)
+
+        keys = []
+        for name in names:
+            name_1, name_2 = name.split('/')
+            keys.append(f'{name_1}/{name_2}')
+            keys.append(f'{name_2}/{name_1}')
+
+        self.keys: List[str] = keys
+        self.key_to_position = {k: i for i, k in enumerate(keys)}
+
+        # buy/sell swap path index of every position
+        self.buy_index = np.stack([pairs[:, 1], pairs[:, 0]], axis=1).ravel()
+        self.sell_index = np.stack([pairs[:, 0], pairs[:, 1]], axis=1).ravel()
+
+        # spreads of the last call to changed
+        self.spreads: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def scan(self, price: np.ndarray or List[float], fee: np.ndarray or List[float]) -> np.ndarray:
+        """
+        :param price: DEX.swap_paths[symbol]['price']
+        :param fee: DEX.swap_paths[symbol]['fee']
+        :return: spreads (%) of every position: ((sell price / buy price - 1) - total fee) * 100
+        """
+        price = np.asarray(price, dtype=np.float64)
+        fee = np.asarray(fee, dtype=np.float64)
+
+        buy_price = price[self.buy_index]
+        sell_price = price[self.sell_index]
+        total_fee = fee[self.buy_index] + fee[self.sell_index]
+
+        return ((sell_price / buy_price - 1) - total_fee) * 100
+
+    def max_spread(self, price: np.ndarray or List[float], fee: np.ndarray or List[float]) -> tuple:
+        """
+        Spreads that aren't finite (paths without a price, ex. pools with 0 reserves) are never the max spread,
+        as with the > comparisons of the pair by pair loop
+
+        :return: (spreads, position of the max spread), the position is None if no spread is finite
+        """
+        spreads = self.scan(price, fee)
+
+        finite = np.where(np.isfinite(spreads), spreads, -np.inf)
+        position = int(np.argmax(finite)) if len(finite) else None
+
+        if position is None or finite[position] == -np.inf:
+            return spreads, None
+
+        return spreads, position
+
+    def changed(self, spreads: np.ndarray) -> Dict[str, float]:
+        """
+        Returns the finite spreads that are different from those of the last call, all of them on the first call
+        ex) {'UNI3ETHUSDT/UNI2ETHUSDT': 0.12, ...}
+
+        :param spreads: spreads returned from SpreadScanner.scan/max_spread
+        """
+        if self.spreads is None:
+            positions = np.flatnonzero(np.isfinite(spreads))
+        else:
+            positions = np.flatnonzero((spreads != self.spreads) & np.isfinite(spreads))
+
+        self.spreads = spreads
+
+        keys = self.keys
+        return {keys[i]: spread for i, spread in zip(positions.tolist(), spreads[positions].tolist())}
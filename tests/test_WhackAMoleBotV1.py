@@ -292,6 +292,41 @@ class WhackAMoleBotV1Tests(TestCase):
         weth_amount_out = weth_balance_after - (weth_balance_before - self.web3.to_wei(1, 'ether'))
         self.assertEqual(simulated_amount_out, weth_amount_out)
 
+    def test_batch_simulation(self):
+        factory = self.pool_v2.functions.factory().call()
+        params_1 = {
+            'protocol': 0,
+            'handler': factory,
+            'tokenIn': self.WETH,
+            'tokenOut': self.USDT,
+            'fee': 3000,
+            'amount': 0,
+        }
+        params_2 = {
+            'protocol': 1,
+            'handler': self.QUOTER2,
+            'tokenIn': self.USDT,
+            'tokenOut': self.WETH,
+            'fee': self.POOL_V3_FEE,
+            'amount': 0,
+        }
+        # there is no Uniswap V2 pool of WETH-WETH, so this route reverts
+        reverting_params = {
+            **params_1,
+            'tokenOut': self.WETH,
+        }
+        routes = [[params_1], [params_1, params_2], [reverting_params]]
+        amounts_in = [self.web3.to_wei(1, 'ether'), self.web3.to_wei(2, 'ether')]
+
+        amounts_out = self.sim.functions.simulateSwapInBatch(routes, amounts_in).call()
+
+        for route, route_amounts_out in zip(routes[:2], amounts_out[:2]):
+            for amount_in, amount_out in zip(amounts_in, route_amounts_out):
+                params = [{**route[0], 'amount': amount_in}, *route[1:]]
+                self.assertEqual(amount_out, self.sim.functions.simulateSwapIn(params).call())
+
+        self.assertEqual(amounts_out[2], [0, 0])
+
     def test_n_hop_swap_gas(self):
         """
         V2 1-hop: 116040
@@ -0,0 +1,791 @@
+import json
+import asyncio
+import eth_abi
+import tempfile
+import eth_utils
+import numpy as np
+import data.dex_streams
+from unittest import TestCase
+from queue import Queue
+from unittest.mock import patch
+
+from data.dex import DEX, STORAGE_COLUMNS, RESERVE0, RESERVE1, SQRT_PRICE, POOL_INDEX
+from data.dex_streams import (
+    DexStream,
+    topology_message,
+    SYNC_EVENT_SELECTOR,
+    SWAP_EVENT_SELECTOR,
+    MINT_EVENT_SELECTOR,
+    BURN_EVENT_SELECTOR,
+    POOL_EVENT_SELECTORS,
+)
+from data.latency import RECEIVE, DECODE, UPDATE, REPRICE, PUBLISH
+from data.price_board import PriceMirror
+from data.recorder import FrameRecorder, ReplayDEX, read_recording, replay_frames
+from simulation import TickDataError
+from simulation.kernels import NumpyKernels, NumbaKernels
+from simulation.uniswap_v3_math import compress_tick, tick_position, get_sqrt_ratio_at_tick
+
+TOKENS = {
+    'ethereum': {
+        'ETH': ['0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2', 18],
+        'USDT': ['0xdAC17F958D2ee523a2206206994597C13D831ec7', 6],
+        'USDC': ['0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48', 6],
+        'DAI': ['0x6B175474E89094C44Da98b954EedeAC495271d0F', 18],
+    }
+}
+
+columns = ['chain', 'exchange', 'version', 'name', 'address', 'fee', 'token0', 'token1']
+
+POOLS = [
+    ['uniswap', 3, 'ETH/USDT', '0x11b815efB8f581194ae79006d24E0d814B7697F6', 500, 'ETH', 'USDT'],
+    ['uniswap', 3, 'USDC/USDT', '0x3416cF6C708Da44DB2624D63ea0AAef7113527C6', 100, 'USDC', 'USDT'],
+    ['uniswap', 3, 'DAI/USDC', '0x5777d92f208679DB4b9778590Fa3CAB3aC9e2168', 100, 'DAI', 'USDC'],
+    ['uniswap', 2, 'ETH/USDT', '0x0d4a11d5EEaaC28EC3F61d100daF4d40471f1852', 3000, 'ETH', 'USDT'],
+    ['uniswap', 2, 'USDC/ETH', '0xB4e16d0168e52d35CaCD2c6185b44281Ec28C9Dc', 3000, 'USDC', 'ETH'],
+    ['sushiswap', 3, 'ETH/USDT', '0x72c2178E082feDB13246877B5aA42ebcE1b72218', 500, 'ETH', 'USDT'],
+    ['sushiswap', 2, 'DAI/ETH', '0xC3D03e4F041Fd4cD388c549Ee2A29a9E5075882f', 3000, 'DAI', 'ETH'],
+]
+
+POOLS = [dict(zip(columns, ['ethereum'] + pool)) for pool in POOLS]
+
+# Storage values returned from Multicall (getReserves for V2, slot0 for V3)
+STORAGE = {
+    '0': (3361437066223186580131307, -201365, 0, 0, 0, 0, True),
+    '1': (79232123823359791237469044736, 0, 0, 0, 0, 0, True),
+    '2': (79220239301832473575424, -276327, 0, 0, 0, 0, True),
+    '3': (16739446124543287006567, 30195815093427, 0),
+    '4': (45623712498743, 25198732109832713455129, 0),
+    '5': (3362011066223186580131307, -201362, 0, 0, 0, 0, True),
+    '6': (1023887165123498712398123, 567129873129837129871, 0),
+}
+
+
+# Uniswap V3 ETH/USDT pool state returned from DexBase._fetch_v3_pool_state
+# positions: 10 ** 19 liquidity in [-201400, -201300], 5 * 10 ** 18 liquidity in [-202000, -200000]
+V3_TICKS = {
+    -202000: (5 * 10 ** 18, 5 * 10 ** 18),
+    -201400: (10 ** 19, 10 ** 19),
+    -201300: (10 ** 19, -10 ** 19),
+    -200000: (5 * 10 ** 18, -5 * 10 ** 18),
+}
+
+V3_TICK_BITMAP = {-80: 0, -79: 0, -78: 0}
+
+for t in V3_TICKS:
+    word_pos, bit_pos = tick_position(compress_tick(t, 10))
+    V3_TICK_BITMAP[word_pos] |= 1 << bit_pos
+
+V3_STATE = {
+    '0': {
+        'liquidity': 15 * 10 ** 18,
+        'tick_spacing': 10,
+        'tick_bitmap': V3_TICK_BITMAP,
+        'ticks': V3_TICKS,
+    }
+}
+
+
+# swap_paths[symbol]['path'] generated by the original recursive generator (max_swap_number=3) from POOLS
+BASELINE_SWAP_PATHS = {
+    'ETH/USDT': [
+        [[0, 1, 3, 1, 1], [0, 0, 0, 0, 0], [0, 0, 0, 0, 0]],
+        [[0, 1, 3, 1, 0], [0, 0, 0, 0, 0], [0, 0, 0, 0, 0]],
+        [[0, 0, 3, 1, 1], [0, 0, 0, 0, 0], [0, 0, 0, 0, 0]],
+        [[0, 1, 3, 2, 1], [0, 1, 2, 1, 0], [0, 0, 0, 0, 0]],
+        [[0, 1, 3, 2, 1], [0, 1, 2, 3, 1], [0, 1, 3, 1, 1]],
+        [[0, 1, 3, 2, 1], [0, 1, 2, 3, 1], [0, 1, 3, 1, 0]],
+        [[0, 1, 3, 2, 1], [0, 1, 2, 3, 1], [0, 0, 3, 1, 1]],
+        [[0, 1, 3, 2, 1], [0, 1, 2, 0, 1], [0, 0, 0, 1, 0]],
+    ],
+    'ETH/DAI': [
+        [[0, 0, 0, 1, 0], [0, 0, 0, 0, 0], [0, 0, 0, 0, 0]],
+        [[0, 1, 0, 2, 1], [0, 1, 2, 1, 0], [0, 0, 0, 0, 0]],
+        [[0, 1, 0, 2, 1], [0, 1, 2, 3, 1], [0, 1, 3, 1, 1]],
+        [[0, 1, 0, 2, 1], [0, 1, 2, 3, 1], [0, 1, 3, 1, 0]],
+        [[0, 1, 0, 2, 1], [0, 1, 2, 3, 1], [0, 0, 3, 1, 1]],
+        [[0, 1, 0, 2, 1], [0, 1, 2, 0, 1], [0, 0, 0, 1, 0]],
+    ],
+}
+
+BASELINE_POOL_INDEXES = {
+    'ETH/USDT': [[0], [3], [5], [1, 4], [1, 1, 0], [1, 1, 3], [1, 1, 5], [1, 2, 6]],
+    'ETH/DAI': [[6], [2, 4], [2, 1, 0], [2, 1, 3], [2, 1, 5], [2, 2, 6]],
+}
+
+def pool_log(pool_idx: int, block: int, block_hash: str, log_index: int, event: str, *values) -> dict:
+    """
+    Log of the pool at POOLS[pool_idx] in the format sent by nodes
+    ex) pool_log(3, 16, '0xa', 0, 'sync', reserve0, reserve1)
+        pool_log(0, 16, '0xa', 1, 'mint', tick_lower, tick_upper, amount)
+    """
+    log = {
+        'address': POOLS[pool_idx]['address'].lower(),
+        'blockNumber': hex(block),
+        'blockHash': block_hash,
+        'logIndex': hex(log_index),
+        'removed': False,
+    }
+    if event == 'sync':
+        log['topics'] = [SYNC_EVENT_SELECTOR]
+        log['data'] = eth_abi.encode(['uint112', 'uint112'], values)
+    elif event == 'swap':
+        log['topics'] = [SWAP_EVENT_SELECTOR, '0x' + '00' * 32, '0x' + '00' * 32]
+        log['data'] = eth_abi.encode(['int256', 'int256', 'uint160', 'uint128', 'int24'], [0, 0, *values])
+    else:
+        tick_lower, tick_upper, amount = values
+        topics = [eth_utils.encode_hex(eth_abi.encode(['int24'], [t])) for t in [tick_lower, tick_upper]]
+        if event == 'mint':
+            log['topics'] = [MINT_EVENT_SELECTOR, '0x' + '00' * 32, *topics]
+            log['data'] = eth_abi.encode(['address', 'uint128', 'uint256', 'uint256'], ['0x' + '00' * 20, amount, 0, 0])
+        else:
+            log['topics'] = [BURN_EVENT_SELECTOR, '0x' + '00' * 32, *topics]
+            log['data'] = eth_abi.encode(['uint128', 'uint256', 'uint256'], [amount, 0, 0])
+    log['data'] = eth_utils.encode_hex(log['data'])
+    return log
+
+
+class OfflineDEX(DEX):
+
+    def _fetch_pool_data(self, chains=None):
+        return {
+            pool_idx: storage_data
+            for pool_idx, storage_data in STORAGE.items()
+            if self.pools[int(pool_idx)]['chain'] in (chains or self.chains_list)
+        }
+
+    def _fetch_v3_pool_state(self, multicall_results):
+        return V3_STATE
+
+
+class FakeWebsocket:
+    """
+    Replays messages as if they were sent from a node, and raises EOFError when there is none left
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        # let tasks scheduled from the stream finish
+        await asyncio.sleep(0.01)
+
+    async def send(self, msg):
+        self.sent.append(json.loads(msg))
+
+    async def recv(self):
+        await asyncio.sleep(0)
+        if not self.messages:
+            raise EOFError
+        return json.dumps(self.messages.pop(0))
+
+
+BLOCK = {'baseFeePerGas': '0x3b9aca00', 'gasUsed': '0x0', 'gasLimit': '0x1c9c380'}
+
+
+class DexTests(TestCase):
+
+    def setUp(self):
+        self.dex = OfflineDEX({'ethereum': 'http://localhost:8545'},
+                              TOKENS,
+                              POOLS,
+                              ['ETH/USDT', 'ETH/DAI'],
+                              3)
+
+    def test_batch_pricing_matches_loop(self):
+        for symbol in self.dex.trading_symbols:
+            self.dex.batch_pricing = True
+            self.dex.update_price_for_symbol('ethereum', symbol)
+            batch_price = self.dex.swap_paths[symbol]['price'].copy()
+            batch_fee = self.dex.swap_paths[symbol]['fee'].copy()
+
+            self.dex.batch_pricing = False
+            self.dex.update_price_for_symbol('ethereum', symbol)
+            loop_price = self.dex.swap_paths[symbol]['price']
+            loop_fee = self.dex.swap_paths[symbol]['fee']
+
+            self.assertGreater(batch_price.shape[0], 0)
+            self.assertTrue(np.allclose(batch_price, loop_price, rtol=1e-12))
+            self.assertTrue(np.allclose(batch_fee, loop_fee, rtol=1e-12))
+
+    def test_storage_rows(self):
+        # one row per directed pool
+        self.assertEqual(self.dex.storage_array.shape, (2 * len(POOLS), STORAGE_COLUMNS))
+
+        idx = self.dex.get_index('ethereum', 'uniswap', 'ETH', 'USDT', 2)
+        reversed_idx = (idx[0], idx[1], idx[3], idx[2], idx[4])
+
+        self.dex.update_reserves('ethereum', 'uniswap', 'ETH', 'USDT', 100, 200)
+        self.dex.refresh_storage()
+
+        for i in [idx, reversed_idx]:
+            row = self.dex.storage_array[self.dex.storage_rows[i]]
+            self.assertEqual(row[RESERVE0], 100)
+            self.assertEqual(row[RESERVE1], 200)
+            self.assertEqual(row[POOL_INDEX], 3)
+
+    def test_exact_storage(self):
+        # values float64 can't hold: uint112 reserves, uint160 sqrtPriceX96
+        reserve0, reserve1, sqrt_price = 2 ** 111 + 1, 2 ** 111 + 3, 2 ** 159 + 7
+        self.assertNotEqual(int(float(sqrt_price)), sqrt_price)
+
+        self.dex.update_pool(3, reserve0=reserve0, reserve1=reserve1, reprice=False)
+        self.dex.update_pool(0, sqrt_price=sqrt_price, liquidity=15 * 10 ** 18, tick=-201365, reprice=False)
+
+        self.assertEqual(self.dex.get_reserves(3), [reserve0, reserve1])
+        self.assertEqual(self.dex.get_sqrt_price(0), sqrt_price)
+        self.assertEqual(self.dex.v3_pools[0].sqrt_price_x96, sqrt_price)
+
+        # float values are recomputed for the changed rows only, when storage_array is read for pricing
+        v2_row = self.dex.storage_rows[self.dex.get_index('ethereum', 'uniswap', 'ETH', 'USDT', 2)]
+        v3_row = self.dex.storage_rows[self.dex.get_index('ethereum', 'uniswap', 'ETH', 'USDT', 3)]
+        self.assertEqual(len(self.dex.stale_rows), 4)
+        self.assertTrue({v2_row, v3_row} <= self.dex.stale_rows)
+
+        self.dex.reprice('ETH/USDT', np.arange(len(self.dex.swap_paths['ETH/USDT']['path'])))
+        self.assertEqual(self.dex.stale_rows, set())
+        self.assertEqual(self.dex.storage_array[v2_row, RESERVE0], float(reserve0))
+        self.assertEqual(self.dex.storage_array[v3_row, SQRT_PRICE], float(sqrt_price))
+
+    def test_eth_usdt_price(self):
+        idx = self.dex.get_index('ethereum', 'uniswap', 'ETH', 'USDT', 2)
+        price, fee = self.dex.get_price(*idx)
+        self.assertAlmostEqual(price, 30195815093427 / 10 ** 6 / (16739446124543287006567 / 10 ** 18))
+        self.assertAlmostEqual(fee, 0.003)
+
+    def test_update_pool_reprices_dependent_paths(self):
+        symbol = 'ETH/USDT'
+        pool_idx = 3  # Uniswap V2 ETH/USDT
+
+        row_hops = self.dex.pool_to_paths[pool_idx][symbol]
+        for row, hop in row_hops:
+            self.assertEqual(self.dex.swap_paths[symbol]['pool_indexes'][row][hop], pool_idx)
+
+        before = self.dex.swap_paths[symbol]['price'].copy()
+        symbols = self.dex.update_pool(pool_idx, reserve0=16739446124543287006567, reserve1=31195815093427)
+        after = self.dex.swap_paths[symbol]['price'].copy()
+
+        self.assertIn(symbol, symbols)
+
+        changed = np.flatnonzero(before != after)
+        self.assertTrue(np.array_equal(changed, np.unique(row_hops[:, 0])))
+        self.assertTrue(np.array_equal(symbols[symbol], changed))
+
+        # re-pricing the whole symbol gives the same result
+        self.dex.update_price_for_symbol('ethereum', symbol)
+        self.assertTrue(np.allclose(self.dex.swap_paths[symbol]['price'], after, rtol=1e-12))
+
+    def test_topology_and_deltas(self):
+        symbol = 'ETH/USDT'
+        queue = Queue()
+        stream = DexStream(self.dex, {}, queue, deltas=True)
+
+        topology = topology_message(self.dex)
+        self.assertEqual(topology['type'], 'topology')
+        mirror = PriceMirror(topology['swap_paths'])
+
+        symbols = self.dex.update_pool(3, reserve0=16739446124543287006567, reserve1=31195815093427)
+        stream.publish_symbols(symbols, 17000000)
+
+        message = queue.get_nowait()
+        self.assertEqual(message['type'], 'delta')
+        self.assertEqual(message['rows'], symbols[symbol].tolist())
+        self.assertNotIn('path', message)
+
+        mirror.apply(message)
+        self.assertTrue(np.array_equal(mirror.price[symbol], self.dex.swap_paths[symbol]['price']))
+        self.assertTrue(np.array_equal(mirror.fee[symbol], self.dex.swap_paths[symbol]['fee']))
+        self.assertEqual((mirror.block[symbol], mirror.version(symbol)), (17000000, 1))
+
+    def test_coalesced_updates(self):
+        symbol = 'ETH/USDT'
+        queue = Queue()
+        stream = DexStream(self.dex, {}, queue, deltas=True, coalesce=True, coalesce_interval=0.01,
+                           publish_reserves=True)
+
+        async def _stream():
+            # two updates of the same block are published once
+            stream.update_pool('ethereum', 1, 3, reserve0=16739446124543287006567, reserve1=31195815093427)
+            stream.update_pool('ethereum', 1, 3, reserve0=16739446124543287006567, reserve1=31295815093427)
+            self.assertTrue(queue.empty())
+
+            # an update of the next block flushes the updates of the previous block
+            stream.update_pool('ethereum', 2, 3, reserve0=16739446124543287006567, reserve1=31395815093427)
+            messages = [queue.get_nowait() for _ in range(queue.qsize())]
+            self.assertEqual(sorted(m['symbol'] for m in messages), sorted(self.dex.pool_to_paths[3]))
+            self.assertTrue(all((m['block'], m['updates']) == (1, 2) for m in messages))
+            # the reserves after the last update of the block
+            self.assertTrue(all(m['reserves'] == {3: [16739446124543287006567, 31295815093427]} for m in messages))
+
+            # the last block is flushed after coalesce_interval seconds
+            await asyncio.sleep(0.05)
+            messages = [queue.get_nowait() for _ in range(queue.qsize())]
+            self.assertEqual(sorted(m['symbol'] for m in messages), sorted(self.dex.pool_to_paths[3]))
+            self.assertTrue(all((m['block'], m['updates']) == (2, 1) for m in messages))
+            self.assertEqual(stream.pending_updates, {})
+
+        asyncio.run(_stream())
+
+        # same prices as re-pricing after every update
+        price = self.dex.swap_paths[symbol]['price'].copy()
+        self.dex.update_pool(3, reserve0=16739446124543287006567, reserve1=31395815093427)
+        self.assertTrue(np.array_equal(self.dex.swap_paths[symbol]['price'], price))
+
+    def test_multiplexed_stream(self):
+        queue = Queue()
+        stream = DexStream(self.dex, {'ethereum': 'ws://localhost:8546'}, queue)
+
+        sync_log = {
+            'address': POOLS[3]['address'],
+            'blockNumber': '0x10',
+            'topics': [SYNC_EVENT_SELECTOR],
+            'data': eth_utils.encode_hex(eth_abi.encode(['uint112', 'uint112'],
+                                                        [16739446124543287006567, 31195815093427])),
+        }
+        other_log = {**sync_log, 'address': '0x' + '00' * 20}
+        block = {'number': '0x10', 'baseFeePerGas': '0x3b9aca00', 'gasUsed': '0x0', 'gasLimit': '0x1c9c380'}
+
+        ws = FakeWebsocket([
+            {'jsonrpc': '2.0', 'id': 2, 'result': '0xlogs'},
+            {'jsonrpc': '2.0', 'id': 1, 'result': '0xheads'},
+            {'jsonrpc': '2.0', 'method': 'eth_subscription', 'params': {'subscription': '0xlogs', 'result': other_log}},
+            {'jsonrpc': '2.0', 'method': 'eth_subscription', 'params': {'subscription': '0xlogs', 'result': sync_log}},
+            {'jsonrpc': '2.0', 'method': 'eth_subscription', 'params': {'subscription': '0xheads', 'result': block}},
+        ])
+
+        checked = []
+        check_reorg = stream.check_reorg
+
+        async def _check_reorg(chain, block):
+            checked.append(block['number'])
+            await check_reorg(chain, block)
+
+        with patch('websockets.connect', return_value=ws), patch.object(stream, 'check_reorg', _check_reorg):
+            with self.assertRaises(EOFError):
+                asyncio.run(stream.stream_events('ethereum'))
+
+        # each block is checked for a reorg once
+        self.assertEqual(checked, ['0x10'])
+
+        # one connection with both subscriptions, logs are filtered by our pool addresses on the node
+        subscriptions = {request['id']: request['params'] for request in ws.sent}
+        self.assertEqual(subscriptions[1], ['newHeads'])
+        self.assertEqual(subscriptions[2][0], 'logs')
+        self.assertEqual(sorted(subscriptions[2][1]['address']), sorted(p['address'].lower() for p in POOLS))
+        self.assertEqual(subscriptions[2][1]['topics'], [POOL_EVENT_SELECTORS])
+
+        messages = [queue.get_nowait() for _ in range(queue.qsize())]
+        self.assertEqual(sorted(m['symbol'] for m in messages if m['type'] == 'event'),
+                         sorted(self.dex.pool_to_paths[3]))
+        # reserves aren't published unless publish_reserves is set
+        self.assertFalse(any('reserves' in m for m in messages))
+        self.assertEqual(messages[-1]['type'], 'block')
+        self.assertEqual(messages[-1]['block'], 16)
+
+    def test_record_and_replay(self):
+        queue = Queue()
+        sync_log = {
+            'address': POOLS[3]['address'],
+            'blockNumber': '0x10',
+            'topics': [SYNC_EVENT_SELECTOR],
+            'data': eth_utils.encode_hex(eth_abi.encode(['uint112', 'uint112'],
+                                                        [16739446124543287006567, 31195815093427])),
+        }
+        frame = {'jsonrpc': '2.0', 'method': 'eth_subscription', 'params': {'subscription': '0xlogs', 'result': sync_log}}
+        subscribed = {'jsonrpc': '2.0', 'id': 2, 'result': '0xlogs'}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f'{tmp}/frames.jsonl.gz'
+            recorder = FrameRecorder(path)
+            recorder.write_setup(self.dex)
+            recorder.write('ethereum', json.dumps(subscribed), received=1.0)
+            recorder.write('ethereum', json.dumps(frame), received=1.5)
+            recorder.close()
+
+            setup, frames = read_recording(path)
+
+        self.assertEqual([f['t'] for f in frames], [1.0, 1.5])
+
+        # the replayed DEX starts from the recorded state
+        dex = ReplayDEX(setup)
+        for symbol in self.dex.trading_symbols:
+            self.assertTrue(np.array_equal(dex.swap_paths[symbol]['price'], self.dex.swap_paths[symbol]['price']))
+        self.assertEqual(dex.v3_pools[0].ticks, self.dex.v3_pools[0].ticks)
+
+        stream = DexStream(dex, {}, queue, publish_reserves=True)
+        took = asyncio.run(replay_frames(stream, frames))
+        self.assertEqual(len(took), 2)
+
+        # exact reserves come with the event messages of the Sync
+        messages = [queue.get_nowait() for _ in range(queue.qsize())]
+        self.assertEqual(sorted(m['symbol'] for m in messages if m['type'] == 'event'),
+                         sorted(dex.pool_to_paths[3]))
+        for message in messages:
+            self.assertEqual(message['reserves'], {3: [16739446124543287006567, 31195815093427]})
+
+        # a resnapshot goes back to the recorded state
+        dex.resnapshot('ethereum')
+        self.assertEqual(dex.get_reserves(3), self.dex.get_reserves(3))
+        for symbol in self.dex.trading_symbols:
+            self.assertTrue(np.array_equal(dex.swap_paths[symbol]['price'], self.dex.swap_paths[symbol]['price']))
+
+    def test_resnapshot(self):
+        loaded = {symbol: self.dex.swap_paths[symbol]['price'].copy() for symbol in self.dex.trading_symbols}
+        v3_pool = self.dex.v3_pools[0]
+        v3_state = (v3_pool.sqrt_price_x96, v3_pool.tick, v3_pool.liquidity)
+        reserves = self.dex.get_reserves(3)
+
+        self.dex.update_pool(3, reserve0=16739446124543287006567, reserve1=31195815093427)
+        self.dex.update_pool(0, sqrt_price=get_sqrt_ratio_at_tick(-201350), liquidity=10 ** 18, tick=-201350)
+
+        symbols = self.dex.resnapshot('ethereum')
+
+        # every path through the reloaded pools is re-priced
+        for symbol, rows in symbols.items():
+            expected = np.unique(np.concatenate([self.dex.pool_to_paths[i][symbol][:, 0]
+                                                 for i in range(len(POOLS)) if symbol in self.dex.pool_to_paths[i]]))
+            self.assertTrue(np.array_equal(rows, expected))
+        self.assertEqual(sorted(symbols), sorted(self.dex.trading_symbols))
+
+        self.assertEqual(self.dex.get_reserves(3), reserves)
+        v3_pool = self.dex.v3_pools[0]
+        self.assertEqual((v3_pool.sqrt_price_x96, v3_pool.tick, v3_pool.liquidity), v3_state)
+        for symbol, price in loaded.items():
+            self.assertTrue(np.array_equal(self.dex.swap_paths[symbol]['price'], price, equal_nan=True))
+
+        # pools of other chains aren't reloaded
+        self.assertEqual(self.dex.resnapshot('polygon'), {})
+
+    def test_latency_trace(self):
+        queue = Queue()
+        stream = DexStream(self.dex, {}, queue, deltas=True, trace_latency=True)
+
+        stream.receive('ethereum', '{}')
+        stream.handle_pool_event('ethereum', 3, {
+            'blockNumber': '0x10',
+            'topics': [SYNC_EVENT_SELECTOR],
+            'data': eth_utils.encode_hex(eth_abi.encode(['uint112', 'uint112'],
+                                                        [16739446124543287006567, 31195815093427])),
+        })
+
+        messages = [queue.get_nowait() for _ in range(queue.qsize())]
+        deltas = [m for m in messages if m['type'] == 'delta']
+        self.assertGreater(len(deltas), 0)
+
+        for message in deltas:
+            trace = message['trace']
+            self.assertEqual(list(trace.keys()), [RECEIVE, DECODE, UPDATE, REPRICE, PUBLISH])
+            self.assertEqual(list(trace.values()), sorted(trace.values()))
+
+        # block messages are traced from the newHeads frame, for the orders simulated with them
+        stream.receive('ethereum', '{}')
+        with patch.object(data.dex_streams, 'BLOCKNATIVE_TOKEN', None):
+            asyncio.run(stream.new_block('ethereum', {**BLOCK, 'number': '0x11', 'hash': '0xb'}, wait=True))
+
+        message = queue.get_nowait()
+        self.assertEqual(message['type'], 'block')
+        self.assertEqual(list(message['trace'].keys()), [RECEIVE, PUBLISH])
+        self.assertLessEqual(message['trace'][RECEIVE], message['trace'][PUBLISH])
+
+    def test_path_generators_match_baseline(self):
+        for path_generator in ['dfs', 'join']:
+            dex = OfflineDEX({'ethereum': 'http://localhost:8545'},
+                             TOKENS,
+                             POOLS,
+                             ['ETH/USDT', 'ETH/DAI'],
+                             3,
+                             path_generator=path_generator)
+
+            for symbol, paths in BASELINE_SWAP_PATHS.items():
+                self.assertEqual(dex.swap_paths[symbol]['path'].tolist(), paths)
+                self.assertEqual(dex.swap_paths[symbol]['pool_indexes'], BASELINE_POOL_INDEXES[symbol])
+                self.assertEqual(dex.swap_paths[symbol]['tag'], [f'ethereum-{i}' for i in range(len(paths))])
+
+            # a symbol without swap paths: (0, max_swap_number, 5), the original generator always used (0, 3, 5)
+            keep = [0, 1, 3, 4, 5]
+            storage = {str(i): STORAGE[str(k)] for i, k in enumerate(keep)}
+
+            with patch.object(OfflineDEX, '_fetch_pool_data', lambda self, chains=None: storage):
+                dex = OfflineDEX({'ethereum': 'http://localhost:8545'},
+                                 TOKENS,
+                                 [POOLS[k] for k in keep],
+                                 ['ETH/DAI', 'ETH/USDT'],
+                                 4,
+                                 path_generator=path_generator)
+
+            self.assertEqual(dex.swap_paths['ETH/DAI']['path'].shape, (0, 4, 5))
+            self.assertEqual(dex.swap_paths['ETH/DAI']['price'].shape, (0,))
+
+    def test_path_generators_match(self):
+        dex = OfflineDEX({'ethereum': 'http://localhost:8545'},
+                         TOKENS,
+                         POOLS,
+                         ['ETH/USDT', 'ETH/DAI'],
+                         4,
+                         path_generator='join')
+        dex_dfs = OfflineDEX({'ethereum': 'http://localhost:8545'},
+                             TOKENS,
+                             POOLS,
+                             ['ETH/USDT', 'ETH/DAI'],
+                             4,
+                             path_generator='dfs')
+
+        for symbol in dex.trading_symbols:
+            paths = dex.swap_paths[symbol]['path']
+            self.assertTrue(np.array_equal(paths, dex_dfs.swap_paths[symbol]['path']))
+            self.assertEqual(dex.swap_paths[symbol]['pool_indexes'], dex_dfs.swap_paths[symbol]['pool_indexes'])
+
+            # every path connects token_out of a swap to token_in of the next swap
+            for path in paths:
+                hops = path[np.any(path != 0, axis=1)]
+                self.assertTrue(np.array_equal(hops[1:, 2], hops[:-1, 3]))
+
+    def test_swap_paths_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            dex = OfflineDEX({'ethereum': 'http://localhost:8545'},
+                             TOKENS,
+                             POOLS,
+                             ['ETH/USDT', 'ETH/DAI'],
+                             3,
+                             cache_dir=cache_dir)
+
+            # the second DEX loads swap paths from cache, and never searches for them
+            with patch.object(OfflineDEX, '_generate_swap_rows', side_effect=AssertionError):
+                cached_dex = OfflineDEX({'ethereum': 'http://localhost:8545'},
+                                        TOKENS,
+                                        POOLS,
+                                        ['ETH/USDT', 'ETH/DAI'],
+                                        3,
+                                        cache_dir=cache_dir)
+
+            for symbol in dex.trading_symbols:
+                paths = dex.swap_paths[symbol]
+                cached_paths = cached_dex.swap_paths[symbol]
+                self.assertTrue(np.array_equal(paths['path'], cached_paths['path']))
+                self.assertEqual(paths['pool_indexes'], cached_paths['pool_indexes'])
+                self.assertEqual(paths['tag'], cached_paths['tag'])
+                self.assertTrue(np.array_equal(paths['price'], cached_paths['price']))
+
+            # changing max_swap_number changes the cache key, and swap paths are generated again
+            dex_2 = OfflineDEX({'ethereum': 'http://localhost:8545'},
+                               TOKENS,
+                               POOLS,
+                               ['ETH/USDT', 'ETH/DAI'],
+                               2,
+                               cache_dir=cache_dir)
+
+            self.assertNotEqual(dex_2.swap_paths_key, dex.swap_paths_key)
+            self.assertEqual(dex_2.swap_paths['ETH/USDT']['path'].shape[1], 2)
+
+    def test_v2_amounts_out(self):
+        symbol = 'ETH/USDT'
+        index = self.dex.price_index[symbol]
+
+        # swap paths that only go through Uniswap V2 variant pools: [3] (Uniswap V2 ETH/USDT)
+        rows = [i for i in range(len(index['hop_mask'])) if np.all(index['hop_v2'][i][index['hop_mask'][i]])]
+        self.assertEqual([self.dex.swap_paths[symbol]['pool_indexes'][i] for i in rows], [[3]])
+
+        reserve_eth, reserve_usdt = self.dex.get_reserves(3)
+        self.assertEqual([reserve_eth, reserve_usdt], [16739446124543287006567, 30195815093427])
+
+        amounts_in = [10 ** 6, 10 ** 9]
+        bought = self.dex.get_v2_amounts_out(symbol, rows, amounts_in)
+        sold = self.dex.get_v2_amounts_out(symbol, rows, bought[0], sell=True)
+
+        self.assertEqual(bought[0].tolist(), [self.dex.sim_v2.get_amount_out(a, reserve_usdt, reserve_eth)
+                                              for a in amounts_in])
+        self.assertEqual(sold[0].tolist(), [self.dex.sim_v2.get_amount_out(a, reserve_eth, reserve_usdt)
+                                            for a in bought[0]])
+
+        # paths with Uniswap V3 pools can't be simulated offline yet
+        with self.assertRaises(ValueError):
+            self.dex.get_v2_amounts_out(symbol, range(len(index['hop_mask'])), amounts_in)
+
+    def test_kernels_match(self):
+        # without Numba installed, NumbaKernels runs the same loops as plain Python
+        for symbol in self.dex.trading_symbols:
+            rows = np.arange(len(self.dex.swap_paths[symbol]['path']))
+
+            self.dex.kernels = NumpyKernels
+            numpy_price, numpy_fee = self.dex._batch_path_prices(symbol, rows)
+            numpy_out = self.dex.estimate_amounts_out(symbol, rows, [10 ** 6, 10 ** 9], sell=True)
+
+            self.dex.kernels = NumbaKernels
+            loop_price, loop_fee = self.dex._batch_path_prices(symbol, rows)
+            loop_out = self.dex.estimate_amounts_out(symbol, rows, [10 ** 6, 10 ** 9], sell=True)
+
+            self.assertTrue(np.allclose(numpy_price, loop_price, rtol=1e-12))
+            self.assertTrue(np.allclose(numpy_fee, loop_fee, rtol=1e-12))
+            self.assertTrue(np.allclose(numpy_out, loop_out, rtol=1e-12))
+
+        with self.assertRaises(ValueError):
+            OfflineDEX({'ethereum': 'http://localhost:8545'}, TOKENS, POOLS, ['ETH/USDT'], 3, kernels='cython')
+
+    def test_estimate_amounts_out(self):
+        symbol = 'ETH/USDT'
+        pool_indexes = self.dex.swap_paths[symbol]['pool_indexes']
+        n = len(pool_indexes)
+
+        # paths through V3 pools without loaded liquidity can't be simulated
+        rows = [i for i in range(n) if all(p not in self.dex.v3_pools or self.dex.v3_pools[p].liquidity > 0
+                                           for p in pool_indexes[i])]
+        self.assertGreater(len(rows), 1)
+
+        # small enough not to cross the initialized ticks of V3 pools, where the estimates are exact up to rounding
+        amounts_in = [10 ** 6, 10 ** 8]
+        estimates = self.dex.estimate_amounts_out(symbol, rows, amounts_in)
+
+        for i, row in enumerate(rows):
+            route = self.dex.get_route(symbol, row, rows[i - 1])[:len(pool_indexes[row])]
+            for j, amount_in in enumerate(amounts_in):
+                expected = self.dex.optimizer.get_amount_out(route, amount_in)
+                self.assertAlmostEqual(estimates[i, j] / expected, 1, places=6)
+
+    def test_optimal_amounts_in(self):
+        symbol = 'ETH/USDT'
+        n = len(self.dex.swap_paths[symbol]['path'])
+        pairs = [[buy, sell] for buy in range(n) for sell in range(n) if buy != sell]
+
+        for buy_row, sell_row in pairs:
+            route = self.dex.get_route(symbol, buy_row, sell_row)
+            pool_indexes = self.dex.swap_paths[symbol]['pool_indexes']
+            self.assertEqual(len(route), len(pool_indexes[buy_row]) + len(pool_indexes[sell_row]))
+
+        amounts_in, profits = self.dex.get_optimal_amounts_in(symbol, pairs, 10000 * 10 ** 6)
+        self.assertEqual(len(amounts_in), len(pairs))
+
+        for (buy_row, sell_row), amount_in, profit in zip(pairs, amounts_in, profits):
+            route = self.dex.get_route(symbol, buy_row, sell_row)
+            if amount_in > 0:
+                self.assertEqual(profit, self.dex.optimizer.get_profit(route, amount_in))
+            else:
+                self.assertEqual(profit, 0)
+
+    def test_v3_pool_state(self):
+        pool = self.dex.v3_pools[0]
+        self.assertEqual((pool.sqrt_price_x96, pool.tick, pool.liquidity), (3361437066223186580131307, -201365,
+                                                                             15 * 10 ** 18))
+        self.assertEqual(pool.ticks, {t: v[1] for t, v in V3_TICKS.items()})
+        self.assertEqual(pool.loaded_words, {-80, -79, -78})
+
+        # pools without loaded state have no liquidity
+        self.assertEqual(self.dex.v3_pools[1].liquidity, 0)
+
+        # Swap event
+        sqrt_price = get_sqrt_ratio_at_tick(-201350)
+        symbols = self.dex.update_pool(0, sqrt_price=sqrt_price, liquidity=15 * 10 ** 18, tick=-201350)
+        self.assertIn('ETH/USDT', symbols)
+        self.assertEqual((pool.sqrt_price_x96, pool.tick), (sqrt_price, -201350))
+
+        # Mint in range adds liquidity and initializes new ticks
+        word_pos, bit_pos = tick_position(compress_tick(-201360, 10))
+        self.dex.update_position(0, -201360, -201340, 10 ** 18)
+        self.assertEqual(pool.liquidity, 16 * 10 ** 18)
+        self.assertEqual(pool.ticks[-201360], 10 ** 18)
+        self.assertTrue(pool.tick_bitmap[word_pos] & (1 << bit_pos))
+
+        # Burn of the same position un-initializes the ticks
+        self.dex.update_position(0, -201360, -201340, -10 ** 18)
+        self.assertEqual(pool.liquidity, 15 * 10 ** 18)
+        self.assertNotIn(-201360, pool.ticks)
+        self.assertEqual(pool.tick_bitmap, V3_TICK_BITMAP)
+
+        # Mint on an initialized tick only changes liquidityNet
+        self.dex.update_position(0, -201400, -201390, 10 ** 18)
+        self.assertEqual(pool.ticks[-201400], 11 * 10 ** 18)
+        self.assertEqual(pool.liquidity, 15 * 10 ** 18)
+
+    def test_v3_swap_on_loaded_ticks(self):
+        pool = self.dex.v3_pools[0]
+
+        # crosses -201400, -202000, where liquidity runs out, and reaches word -81, which isn't loaded
+        with self.assertRaises(TickDataError):
+            self.dex.sim_v3.get_amount_out(pool, 10 ** 30, True)
+
+        amount0, amount1, _, tick, liquidity, crossed = self.dex.sim_v3.swap(pool, True, 10 ** 21)
+        self.assertEqual((crossed, liquidity), (1, 5 * 10 ** 18))
+        self.assertLess(tick, -201400)
+
+    def test_reorg_rollback(self):
+        queue = Queue()
+        stream = DexStream(self.dex, {}, queue)
+        v3_pool = self.dex.v3_pools[0]
+
+        def _state():
+            return (self.dex.get_reserves(3),
+                    (v3_pool.sqrt_price_x96, v3_pool.tick, v3_pool.liquidity),
+                    dict(v3_pool.ticks), dict(v3_pool.liquidity_gross), dict(v3_pool.tick_bitmap),
+                    self.dex.swap_paths['ETH/USDT']['price'].copy(),
+                    self.dex.pool_blocks.copy())
+
+        def _assert_state(state):
+            current = _state()
+            for value, expected in zip(current[:5], state[:5]):
+                self.assertEqual(value, expected)
+            self.assertTrue(np.array_equal(current[5], state[5], equal_nan=True))
+            self.assertTrue(np.array_equal(current[6], state[6]))
+
+        def _handle(log):
+            stream.handle_pool_event('ethereum', 0 if log['address'] == POOLS[0]['address'].lower() else 3, log)
+
+        loaded = _state()
+
+        # block 16: Sync, Swap in range of a new position, Mint
+        asyncio.run(stream.new_block('ethereum',
+                                     {**BLOCK, 'number': '0x10', 'hash': '0xa', 'parentHash': '0x9'},
+                                     wait=True))
+        sqrt_price = get_sqrt_ratio_at_tick(-201350)
+        block_16 = [
+            pool_log(3, 16, '0xa', 0, 'sync', 16739446124543287006567, 31195815093427),
+            pool_log(0, 16, '0xa', 1, 'mint', -201360, -201340, 10 ** 18),
+            pool_log(0, 16, '0xa', 2, 'swap', sqrt_price, 16 * 10 ** 18, -201350),
+        ]
+        for log in block_16:
+            _handle(log)
+        after_16 = _state()
+        self.assertEqual(v3_pool.liquidity, 16 * 10 ** 18)
+
+        # block 17: Sync, Burn of the position
+        block_17 = [
+            pool_log(3, 17, '0xb', 0, 'sync', 16639446124543287006567, 31295815093427),
+            pool_log(0, 17, '0xb', 1, 'burn', -201360, -201340, 10 ** 18),
+        ]
+        for log in block_17:
+            _handle(log)
+        self.assertEqual(self.dex.get_reserves(3), [16639446124543287006567, 31295815093427])
+        self.assertNotIn(-201360, v3_pool.ticks)
+
+        # 1. removed logs of block 17 roll it back, once
+        for log in block_17:
+            _handle({**log, 'removed': True})
+        _assert_state(after_16)
+        self.assertEqual(list(stream.journals['ethereum'].hashes), [16])
+
+        # the new block 17 is applied, even with the same log indexes
+        _handle(pool_log(3, 17, '0xc', 0, 'sync', 16539446124543287006567, 31395815093427))
+        self.assertEqual(self.dex.get_reserves(3), [16539446124543287006567, 31395815093427])
+
+        # 2. a new block 17 that isn't the one we have rolls it back
+        asyncio.run(stream.new_block('ethereum',
+                                     {**BLOCK, 'number': '0x11', 'hash': '0xd', 'parentHash': '0xa'},
+                                     wait=True))
+        _assert_state(after_16)
+
+        # 3. a log of another block 16 rolls back block 16
+        queue = Queue()
+        stream.publisher = queue
+        _handle(pool_log(3, 16, '0xe', 0, 'sync', 16739446124543287006567, 30195815093427))
+        self.assertEqual(v3_pool.ticks, loaded[2])
+        self.assertEqual(v3_pool.liquidity_gross, loaded[3])
+        self.assertEqual(v3_pool.tick_bitmap, loaded[4])
+        self.assertEqual((v3_pool.sqrt_price_x96, v3_pool.tick, v3_pool.liquidity), loaded[1])
+
+        # the same reserves as loaded: the rolled back prices are published, then the new log's
+        self.assertEqual(self.dex.get_reserves(3), loaded[0])
+        self.assertTrue(np.array_equal(self.dex.swap_paths['ETH/USDT']['price'], loaded[5], equal_nan=True))
+        messages = [queue.get_nowait() for _ in range(queue.qsize())]
+        self.assertEqual([m['block'] for m in messages if m['type'] == 'event'][0], 15)
@@ -0,0 +1,190 @@
+import asyncio
+import numpy as np
+from queue import Queue
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from benchmarks.utils import synthetic_market, OfflineDEX
+from data.dex_streams import DexStream, topology_message
+from data.latency import LatencyTracker, stamp, RECEIVE, PUBLISH, DEQUEUE, SIMULATE
+from strategies import dex_arb_base
+from strategies.spread_scanner import generate_compare_paths
+
+
+class FakeSubscriber:
+    """
+    Hands messages to strategy like aioprocessing.AioQueue, and raises EOFError when there is none left
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    async def coro_get(self):
+        await asyncio.sleep(0)
+        if not self.messages:
+            raise EOFError
+        return self.messages.pop(0)
+
+
+class FakeInfluxDB:
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, measurement, data):
+        self.sent.append((measurement, dict(data)))
+
+    async def close(self):
+        pass
+
+
+class FakeTelegram:
+
+    async def send(self, message):
+        pass
+
+
+class RecordingTracker(LatencyTracker):
+    """
+    LatencyTracker that keeps the traces recorded to it
+    """
+    trackers = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.traces = []
+        RecordingTracker.trackers.append(self)
+
+    def record(self, trace):
+        super().record(trace)
+        self.traces.append(dict(trace))
+
+
+def startup_messages(dex, pools):
+    """
+    The startup messages of dex_stream_process with the delta transport
+    """
+    reserves = {i: dex.get_reserves(i) for i, pool in enumerate(pools) if pool['version'] == 2}
+    return [
+        {
+            'source': 'dex',
+            'type': 'setup',
+            'compare_paths': generate_compare_paths(dex, pools),
+            'reserves': reserves,
+            'price_board': None,
+        },
+        topology_message(dex),
+    ]
+
+
+class DexArbBaseTests(TestCase):
+
+    def test_strategy_loop(self):
+        symbol = 'ETH/USDT'
+        tokens, pools, storage = synthetic_market(50)
+        chain = list(tokens.keys())[0]
+        dex = OfflineDEX(tokens, pools, storage, [symbol], 3)
+
+        messages = startup_messages(dex, pools)
+
+        # two events that update V2 pools on the swap paths of the symbol
+        queue = Queue()
+        stream = DexStream(dex, {}, queue, deltas=True, publish_reserves=True)
+        v2_pools = [i for i in dex.pool_to_paths if symbol in dex.pool_to_paths[i] and pools[i]['version'] == 2]
+        # the second pool is on the fewest paths
+        second = min(v2_pools, key=lambda i: len(dex.pool_to_paths[i][symbol]))
+        for pool_idx in [v2_pools[0], second]:
+            reserve0, reserve1 = dex.get_reserves(pool_idx)
+            stream.update_pool(chain, 17000000, pool_idx, reserve0=reserve0 * 2, reserve1=reserve1)
+        messages.extend(queue.get_nowait() for _ in range(queue.qsize()))
+
+        influxdb = FakeInfluxDB()
+
+        with patch.object(dex_arb_base, 'InfluxDB', return_value=influxdb), \
+                patch.object(dex_arb_base, 'Telegram', FakeTelegram), \
+                patch.object(dex_arb_base, 'OnlineSimulator', MagicMock()), \
+                patch.object(dex_arb_base, 'DexOrder', MagicMock()):
+            # the loop ends when there are no messages left
+            with self.assertRaises(EOFError):
+                asyncio.run(dex_arb_base.strategy(FakeSubscriber(messages),
+                                                  chain,
+                                                  max_bet_size=0,
+                                                  target_spread=float('inf'),
+                                                  debug=True))
+
+        # the events went through the scanners made from setup, with the prices of topology
+        self.assertEqual(len(influxdb.sent), 2)
+        measurement, spreads = influxdb.sent[0]
+        self.assertEqual(measurement, 'DEX_ARB_BASE_ETHUSDT')
+        self.assertEqual(len(spreads), 2 * len(messages[0]['compare_paths'][symbol]))
+
+        # then only the spreads of the pairs with a path through the second pool
+        rows = set(dex.pool_to_paths[second][symbol][:, 0].tolist())
+        pairs = {name for name, (i, j) in messages[0]['compare_paths'][symbol].items() if i in rows or j in rows}
+        _, changed = influxdb.sent[1]
+        self.assertGreater(len(changed), 0)
+        self.assertLess(len(changed), len(spreads))
+        for key in changed:
+            name_1, name_2 = key.split('/')
+            self.assertTrue(key in pairs or f'{name_2}/{name_1}' in pairs)
+
+    def test_block_simulation_trace(self):
+        symbol = 'ETH/USDT'
+        tokens, pools, storage = synthetic_market(50)
+        chain = list(tokens.keys())[0]
+        dex = OfflineDEX(tokens, pools, storage, [symbol], 3)
+
+        messages = startup_messages(dex, pools)
+
+        # an event adds the max spread to pending, and the block that follows has it simulated
+        queue = Queue()
+        stream = DexStream(dex, {}, queue, deltas=True, publish_reserves=True)
+        pool_idx = next(i for i in dex.pool_to_paths if symbol in dex.pool_to_paths[i] and pools[i]['version'] == 2)
+        reserve0, reserve1 = dex.get_reserves(pool_idx)
+        stream.update_pool(chain, 17000000, pool_idx, reserve0=reserve0 * 2, reserve1=reserve1)
+        messages.extend(queue.get_nowait() for _ in range(queue.qsize()))
+
+        received = stamp()
+        messages.append({
+            'source': 'dex',
+            'type': 'block',
+            'chain': chain,
+            'block': 17000000,
+            'base_fee': 0,
+            'max_priority_fee_per_gas': 0,
+            'max_fee_per_gas': 0,
+            'trace': {RECEIVE: received, PUBLISH: received},
+        })
+
+        # online simulations return the amount in
+        simulator = SimpleNamespace(tokens=tokens,
+                                    pools=pools,
+                                    tokens_list=dex.tokens_list,
+                                    make_params=lambda **kwargs: [],
+                                    simulate_batch=lambda chain, routes, amounts_in: np.array([amounts_in]))
+
+        RecordingTracker.trackers = []
+
+        # Pending.can_add is also True for a pending order that isn't processing yet,
+        # on which _process_pending_order returns before simulating: patched so that the pending order is simulated
+        with patch.object(dex_arb_base.Pending, 'can_add', lambda self: self.info is None), \
+                patch.object(dex_arb_base, 'InfluxDB', FakeInfluxDB), \
+                patch.object(dex_arb_base, 'Telegram', FakeTelegram), \
+                patch.object(dex_arb_base, 'LatencyTracker', RecordingTracker), \
+                patch.object(dex_arb_base, 'OnlineSimulator', return_value=simulator), \
+                patch.object(dex_arb_base, 'DexOrder', MagicMock()):
+            with self.assertRaises(EOFError):
+                asyncio.run(dex_arb_base.strategy(FakeSubscriber(messages),
+                                                  chain,
+                                                  max_bet_size=10 ** 6,
+                                                  target_spread=-float('inf'),
+                                                  debug=True))
+
+        latency, block_latency = RecordingTracker.trackers
+
+        # the event didn't have gas prices of its block to simulate with, the block did
+        self.assertTrue(all(SIMULATE not in trace for trace in latency.traces))
+        self.assertEqual(len(block_latency.traces), 1)
+        self.assertEqual(list(block_latency.traces[0].keys()), [RECEIVE, PUBLISH, DEQUEUE, SIMULATE])
+        self.assertEqual(block_latency.histograms[SIMULATE].count, 1)
@@ -0,0 +1,105 @@
+import asyncio
+from unittest import TestCase
+
+from external.influxdb import InfluxDB, line_protocol
+
+
+class FakeWriteApi:
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.writes = []
+
+    async def write(self, bucket, org, record):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError('unreachable')
+        self.writes.append(record)
+
+
+def make_influxdb(write_api: FakeWriteApi, **kwargs) -> InfluxDB:
+    influxdb = InfluxDB(token=None, **kwargs)
+    influxdb.write_api = write_api
+    return influxdb
+
+
+class InfluxDBTests(TestCase):
+
+    def test_line_protocol(self):
+        line = line_protocol('DEX ARB', {'UNI3ETHUSDT/UNI2ETHUSDT': 0.12, 'a,b=c': 3, 'ok': True,
+                                         'note': 'say "hi"', 'nan': float('nan')}, 1692000000000000000)
+        self.assertEqual(line, 'DEX\\ ARB UNI3ETHUSDT/UNI2ETHUSDT=0.12,a\\,b\\=c=3i,ok=true,note="say \\"hi\\"" '
+                               '1692000000000000000')
+        self.assertIsNone(line_protocol('test', {'nan': float('nan')}, 0))
+
+    def test_batching(self):
+        write_api = FakeWriteApi()
+        influxdb = make_influxdb(write_api, batch_size=3, flush_interval=0.05)
+
+        async def _send():
+            # full batches are written right away
+            for i in range(4):
+                await influxdb.send('test', {'value': i})
+            await asyncio.sleep(0.01)
+            self.assertEqual([len(w) for w in write_api.writes], [3, 1])
+
+            # the rest are written after flush_interval
+            await influxdb.send('test', {'value': 4})
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(write_api.writes), 2)
+            await asyncio.sleep(0.1)
+            self.assertEqual([len(w) for w in write_api.writes], [3, 1, 1])
+
+            await influxdb.close()
+
+        asyncio.run(_send())
+        self.assertEqual(influxdb.stats(), {'queued': 0, 'sent': 5, 'dropped': 0, 'failed': 0})
+
+    def test_send_does_not_wait(self):
+        write_api = FakeWriteApi(delay=0.2)
+        influxdb = make_influxdb(write_api, batch_size=1, max_queued=2)
+
+        async def _send():
+            loop = asyncio.get_event_loop()
+            s = loop.time()
+            for i in range(5):
+                await influxdb.send('test', {'value': i})
+            self.assertLess(loop.time() - s, 0.1)
+
+            # the ring keeps the newest points
+            self.assertEqual(influxdb.dropped, 3)
+            self.assertEqual([data for _, data, _ in influxdb.queue], [{'value': 3}, {'value': 4}])
+
+            await influxdb.close()
+
+        asyncio.run(_send())
+
+    def test_failed_writes(self):
+        influxdb = make_influxdb(FakeWriteApi(fail=True), batch_size=2)
+
+        async def _send():
+            for i in range(2):
+                await influxdb.send('test', {'value': i})
+            await asyncio.sleep(0.01)
+            await influxdb.close()
+
+        asyncio.run(_send())
+        self.assertEqual(influxdb.stats(), {'queued': 0, 'sent': 0, 'dropped': 0, 'failed': 2})
+
+    def test_encoded_on_flush(self):
+        write_api = FakeWriteApi()
+        influxdb = make_influxdb(write_api, batch_size=10)
+
+        async def _send():
+            await influxdb.send('test', {'value': 1.5})
+            await influxdb.send('test', {'nan': float('nan')})
+            # the points are queued as they are, and encoded by the flusher
+            self.assertEqual(len(influxdb.queue), 2)
+            self.assertEqual(influxdb.queue[0][:2], ('test', {'value': 1.5}))
+            await influxdb.close()
+
+        asyncio.run(_send())
+        self.assertEqual(len(write_api.writes), 1)
+        self.assertEqual([line.split(' ')[:2] for line in write_api.writes[0]], [['test', 'value=1.5']])
+        self.assertEqual(influxdb.stats()['sent'], 1)
@@ -0,0 +1,51 @@
+import numpy as np
+from unittest import TestCase
+
+from data.latency import LatencyHistogram, LatencyTracker, RECEIVE, DECODE, PUBLISH, DEQUEUE, SCAN, TOTAL
+
+
+class LatencyTests(TestCase):
+
+    def test_histogram_percentiles(self):
+        rng = np.random.default_rng(0)
+        values = rng.lognormal(mean=11, sigma=1.5, size=100000).astype(np.int64)
+
+        histogram = LatencyHistogram()
+        for v in values.tolist():
+            histogram.record(v)
+
+        self.assertEqual(histogram.count, len(values))
+        self.assertEqual(histogram.max, values.max())
+
+        # within the relative error of the buckets
+        for q in [50, 99, 99.9]:
+            expected = np.percentile(values, q)
+            self.assertLess(abs(histogram.percentile(q) - expected) / expected, 0.01)
+
+    def test_histogram_buckets(self):
+        histogram = LatencyHistogram(precision_bits=8)
+
+        # buckets are contiguous and cover every value once
+        indexes = [histogram.index(v) for v in range(1 << 14)]
+        self.assertEqual(indexes, sorted(indexes))
+        self.assertEqual(len(set(indexes)), indexes[-1] + 1)
+
+        for v in [0, 255, 256, 1000, 123456789]:
+            self.assertLessEqual(abs(histogram.value_at(histogram.index(v)) - v), max(v / 128, 1))
+
+    def test_tracker(self):
+        latency = LatencyTracker()
+
+        # stages missing from a trace are skipped: dequeue is measured from publish
+        latency.record({RECEIVE: 1000, DECODE: 3000, PUBLISH: 10000, DEQUEUE: 15000, SCAN: 25000})
+        latency.record({RECEIVE: 2000, DECODE: 6000, PUBLISH: 11000, DEQUEUE: 19000, SCAN: 30000})
+
+        summary = latency.summary()
+        self.assertEqual(summary[f'{DECODE}_count'], 2)
+        self.assertEqual(summary[f'{DECODE}_max'], 4.0)
+        self.assertAlmostEqual(summary[f'{DEQUEUE}_p50'], 5.0, delta=5.0 / 128)
+        self.assertEqual(summary[f'{TOTAL}_max'], 28.0)
+        self.assertNotIn(f'{RECEIVE}_count', summary)
+
+        latency.reset()
+        self.assertEqual(latency.summary(), {})
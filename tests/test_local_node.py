@@ -0,0 +1,237 @@
+import asyncio
+import websockets
+import numpy as np
+from multicall import Call
+from queue import Queue
+from unittest import TestCase
+
+import data.dex_streams
+from benchmarks.local_node import AGGREGATE, ExecutionReverted, LocalNode, SyntheticChain
+from benchmarks.utils import synthetic_market
+from data.dex import DEX
+from data.dex_streams import DexStream
+from data.multicall_loader import ChunkedMulticall, MulticallError
+
+
+class LocalNodeTests(TestCase):
+
+    def setUp(self):
+        data.dex_streams.BLOCKNATIVE_TOKEN = None
+        self.tokens, self.pools, self.storage = synthetic_market(30)
+
+    def test_multicall_load(self):
+        synthetic_chain = SyntheticChain(self.tokens, self.pools, self.storage)
+        node = LocalNode(synthetic_chain, events_per_second=0, port=18645)
+        node.start_thread(duration=5.0)
+
+        dex = DEX({'ethereum': node.http_url}, self.tokens, self.pools, ['ETH/USDT'], 3)
+
+        for pool_idx, pool in enumerate(self.pools):
+            state = synthetic_chain.pools[pool['address'].lower()]
+            if pool['version'] == 2:
+                self.assertEqual(dex.get_reserves(pool_idx), [state['reserve0'], state['reserve1']])
+            else:
+                v3_pool = dex.v3_pools[pool_idx]
+                self.assertEqual((v3_pool.sqrt_price_x96, v3_pool.tick, v3_pool.liquidity),
+                                 (state['sqrt_price'], state['tick'], state['liquidity']))
+                self.assertEqual(v3_pool.ticks, {t: net for t, (_, net) in state['ticks'].items()})
+
+    def test_chunked_multicall(self):
+        synthetic_chain = SyntheticChain(self.tokens, self.pools, self.storage)
+        node = LocalNode(synthetic_chain, events_per_second=0, port=18647)
+        node.start_thread(duration=5.0)
+
+        # the node fails the first query, and every query of more than 4 calls after that
+        call = synthetic_chain.call
+        failures = {'first': True}
+
+        def flaky_call(to, data):
+            if data[:4] == AGGREGATE:
+                n_calls = int.from_bytes(data[4 + 32:4 + 64], 'big')
+                if failures.pop('first', False) or n_calls > 4:
+                    raise ExecutionReverted
+            return call(to, data)
+
+        synthetic_chain.call = flaky_call
+
+        dex = DEX({'ethereum': node.http_url}, self.tokens, self.pools, ['ETH/USDT'], 3,
+                  multicall_chunk_size=8, multicall_retries=1)
+        dex.multicall.backoff = 0.01
+
+        for pool_idx, pool in enumerate(self.pools):
+            if pool['version'] == 2:
+                state = synthetic_chain.pools[pool['address'].lower()]
+                self.assertEqual(dex.get_reserves(pool_idx), [state['reserve0'], state['reserve1']])
+
+        timings = dex.multicall.timings
+        self.assertEqual(dex.block_numbers, {'ethereum': synthetic_chain.block_number})
+        self.assertTrue(all(t['block'] == synthetic_chain.block_number for t in timings))
+        self.assertTrue(all(t['calls'] <= 4 for t in timings))
+        self.assertGreater(len(timings), 1)
+        report = dex.multicall.report()
+        self.assertTrue(report.startswith(f'ethereum @{synthetic_chain.block_number}: {len(timings)} chunks'))
+
+    def test_multicall_error(self):
+        synthetic_chain = SyntheticChain(self.tokens, self.pools, self.storage)
+        node = LocalNode(synthetic_chain, events_per_second=0, port=18648)
+        node.start_thread(duration=5.0)
+
+        multicall = ChunkedMulticall({'ethereum': node.http_url}, chunk_size=4, retries=1, backoff=0.01)
+        block_numbers = multicall.get_block_numbers(['ethereum'])
+        calls = [Call(p['address'], 'getReserves()((uint112,uint112,uint32))', [(str(i), None)])
+                 for i, p in enumerate(self.pools) if p['version'] == 2]
+
+        results = multicall({'ethereum': calls}, block_numbers)
+        self.assertEqual(len(results), len(calls))
+        self.assertEqual(len(multicall.timings), -(-len(calls) // 4))
+
+        # a call that always reverts is isolated and raised
+        calls.append(Call('0x' + '00' * 20, 'getReserves()((uint112,uint112,uint32))', [('missing', None)]))
+        with self.assertRaises(MulticallError):
+            multicall({'ethereum': calls}, block_numbers)
+
+    def assert_synced(self, dex: DEX, synthetic_chain: SyntheticChain):
+        for pool_idx, pool in enumerate(self.pools):
+            state = synthetic_chain.pools[pool['address'].lower()]
+            if pool['version'] == 2:
+                self.assertEqual(dex.get_reserves(pool_idx), [state['reserve0'], state['reserve1']])
+            else:
+                v3_pool = dex.v3_pools[pool_idx]
+                self.assertEqual((v3_pool.sqrt_price_x96, v3_pool.tick), (state['sqrt_price'], state['tick']))
+
+    def resync(self, port: int, **kwargs) -> dict:
+        """
+        Loads DEX, misses 5 blocks of logs, and resyncs
+        """
+        synthetic_chain = SyntheticChain(self.tokens, self.pools, self.storage)
+        node = LocalNode(synthetic_chain, events_per_second=0, block_time=60, port=port)
+        node.start_thread(duration=5.0)
+
+        dex = DEX({'ethereum': node.http_url}, self.tokens, self.pools, ['ETH/USDT'], 3)
+        self.assertEqual(dex.block_numbers, {'ethereum': synthetic_chain.block_number})
+
+        for _ in range(5):
+            synthetic_chain.new_block()
+            for _ in range(20):
+                synthetic_chain.next_log()
+
+        queue = Queue()
+        stream = DexStream(dex, {'ethereum': node.ws_url}, queue, publish_reserves=True, **kwargs)
+
+        async def _resync_twice():
+            # the V2, V3 streams of a chain reconnecting together: the second one waits, then has nothing to resync
+            return await asyncio.gather(stream.resync('ethereum'), stream.resync('ethereum'))
+
+        result, again = asyncio.run(_resync_twice())
+        self.assertIsNone(again)
+
+        self.assertEqual((result['from'], result['to']), (17000001, 17000005))
+        self.assertEqual(dex.block_numbers, {'ethereum': 17000005})
+        self.assert_synced(dex, synthetic_chain)
+
+        # prices are the same as those of a DEX loaded now
+        loaded_dex = DEX({'ethereum': node.http_url}, self.tokens, self.pools, ['ETH/USDT'], 3)
+        self.assertTrue(np.allclose(dex.swap_paths['ETH/USDT']['price'], loaded_dex.swap_paths['ETH/USDT']['price'],
+                                    equal_nan=True))
+
+        messages = [queue.get_nowait() for _ in range(queue.qsize())]
+        self.assertEqual({m['type'] for m in messages}, {'event'})
+        for pool_idx, values in messages[0]['reserves'].items():
+            self.assertEqual(dex.get_reserves(pool_idx), values)
+
+        # logs the subscription sends again are skipped
+        for log in synthetic_chain.logs:
+            stream.handle_pool_event('ethereum', stream.chain_pools('ethereum')[log['address']], log)
+        self.assertTrue(queue.empty())
+
+        return result
+
+    def test_resync_backfill(self):
+        result = self.resync(18649, logs_block_range=2)
+        self.assertEqual((result['method'], result['logs']), ('eth_getLogs', 100))
+
+    def test_resync_resnapshot(self):
+        result = self.resync(18650, max_backfill_blocks=2)
+        self.assertEqual(result['method'], 'Multicall')
+
+    def test_resync_resnapshot_failure(self):
+        synthetic_chain = SyntheticChain(self.tokens, self.pools, self.storage)
+        node = LocalNode(synthetic_chain, events_per_second=0, block_time=60, port=18651)
+        node.start_thread(duration=5.0)
+
+        dex = DEX({'ethereum': node.http_url}, self.tokens, self.pools, ['ETH/USDT'], 3, multicall_retries=0)
+        dex.multicall.backoff = 0.01
+        loaded = dex.swap_paths['ETH/USDT']['price'].copy()
+
+        for _ in range(5):
+            synthetic_chain.new_block()
+            for _ in range(20):
+                synthetic_chain.next_log()
+
+        # the node fails the queries of V3 pool states, after the slot0/getReserves queries went through
+        call = synthetic_chain.call
+        failing = {'calls': 0}
+
+        def failing_call(to, data):
+            if data[:4] == AGGREGATE:
+                failing['calls'] += 1
+                if failing['calls'] > 1:
+                    raise ExecutionReverted
+            return call(to, data)
+
+        synthetic_chain.call = failing_call
+
+        stream = DexStream(dex, {'ethereum': node.ws_url}, Queue(), max_backfill_blocks=2)
+        with self.assertRaises(MulticallError):
+            asyncio.run(stream.resync('ethereum'))
+
+        # the pools are still synced up to the block they were loaded at, and the next resync starts from there
+        self.assertEqual(dex.block_numbers, {'ethereum': 17000000})
+        self.assertTrue(np.array_equal(dex.swap_paths['ETH/USDT']['price'], loaded, equal_nan=True))
+
+        synthetic_chain.call = call
+        ticks = []
+
+        async def _tick():
+            while True:
+                ticks.append(dex.block_numbers['ethereum'])
+                await asyncio.sleep(0.001)
+
+        async def _resync():
+            # the event loop keeps running while the pools are re-loaded
+            ticker = asyncio.ensure_future(_tick())
+            result = await stream.resync('ethereum')
+            ticker.cancel()
+            return result
+
+        result = asyncio.run(_resync())
+        self.assertEqual((result['method'], result['from'], result['to']), ('Multicall', 17000001, 17000005))
+        self.assertGreater(ticks.count(17000000), 1)
+        self.assert_synced(dex, synthetic_chain)
+
+    def test_event_stream(self):
+        synthetic_chain = SyntheticChain(self.tokens, self.pools, self.storage)
+        node = LocalNode(synthetic_chain, events_per_second=300, block_time=0.2, port=18646)
+        node.start_thread(duration=1.0)
+
+        queue = Queue()
+        dex = DEX({'ethereum': node.http_url}, self.tokens, self.pools, ['ETH/USDT'], 3)
+        stream = DexStream(dex, {'ethereum': node.ws_url}, queue, publish_reserves=True)
+
+        # the stream ends when the node disconnects
+        with self.assertRaises(websockets.ConnectionClosed):
+            asyncio.run(stream.stream_events('ethereum'))
+
+        messages = [queue.get_nowait() for _ in range(queue.qsize())]
+        types = {m['type'] for m in messages}
+        self.assertTrue({'event', 'block'} <= types)
+
+        # the last Sync of each pool is the state the node ended with
+        reserves = {}
+        for m in messages:
+            reserves.update(m.get('reserves', {}))
+        self.assertGreater(len(reserves), 0)
+        for pool_idx, values in reserves.items():
+            state = synthetic_chain.pools[self.pools[pool_idx]['address'].lower()]
+            self.assertEqual(values, [state['reserve0'], state['reserve1']])
+            self.assertEqual(dex.get_reserves(pool_idx), values)
@@ -0,0 +1,45 @@
+import eth_abi
+import eth_utils
+from unittest import TestCase
+
+from data.log_decoder import *
+
+
+def encode(types, values) -> str:
+    return eth_utils.encode_hex(eth_abi.encode(types, values))
+
+
+class LogDecoderTests(TestCase):
+    """
+    Fast decoders should return the same values as eth_abi.decode
+    """
+
+    def test_sync(self):
+        values = [16739446124543287006567, 2 ** 112 - 1]
+        self.assertEqual(decode_sync(encode(['uint112', 'uint112'], values)), tuple(values))
+
+    def test_swap(self):
+        types = ['int256', 'int256', 'uint160', 'uint128', 'int24']
+        for values in [
+            [-1000000000, 553972135326841419, 1871405151062397392327305369018, 15373563727148617263, -201350],
+            [10 ** 18, -2 ** 255, 2 ** 160 - 1, 2 ** 128 - 1, 887272],
+            [0, 0, 4295128739, 0, -887272],
+        ]:
+            data = encode(types, values)
+            self.assertEqual(decode_swap(data), tuple(values))
+            self.assertEqual(decode_swap(data), eth_abi.decode(types, eth_utils.decode_hex(data)))
+
+    def test_mint_burn(self):
+        mint = encode(['address', 'uint128', 'uint256', 'uint256'],
+                      ['0xC36442b4a4522E871399CD717aBDD847Ab11FE88', 10 ** 20, 5, 6])
+        burn = encode(['uint128', 'uint256', 'uint256'], [10 ** 20, 5, 6])
+        self.assertEqual(decode_mint(mint), 10 ** 20)
+        self.assertEqual(decode_burn(burn), 10 ** 20)
+
+        for tick in [-887220, -60, 0, 60, 887220]:
+            self.assertEqual(decode_int_topic(encode(['int24'], [tick])), tick)
+
+    def test_words(self):
+        data = encode(['uint256', 'int256'], [7, -7])
+        self.assertEqual(decode_words(data), [7, 2 ** 256 - 7])
+        self.assertEqual(loads('{"a": [1, "0x2"]}'), {'a': [1, '0x2']})
@@ -0,0 +1,78 @@
+import time
+import numpy as np
+import multiprocessing
+from unittest import TestCase
+
+from data.price_board import PriceBoard, ensure_resource_tracker
+
+
+def _read_board(layout, queue):
+    board = PriceBoard.attach(layout)
+    queue.put(board.snapshot('ETH/USDT'))
+    board.close()
+
+
+class PriceBoardTests(TestCase):
+
+    def setUp(self):
+        ensure_resource_tracker()
+        self.board = PriceBoard.create({'ETH/USDT': 4, 'BTC/USDT': 0})
+
+    def tearDown(self):
+        self.board.close()
+
+    def test_write_read(self):
+        price = np.array([1800.0, 1801.0, 1799.5, 1800.5])
+        fee = np.array([0.003, 0.0005, 0.003, 0.006])
+
+        self.assertEqual(self.board.version('ETH/USDT'), 0)
+        version = self.board.write('ETH/USDT', price, fee, 17000000)
+        self.assertEqual(version, 1)
+
+        reader = PriceBoard.attach(self.board.layout)
+        board_price, board_fee, block, board_version = reader.snapshot('ETH/USDT')
+        self.assertTrue(np.array_equal(board_price, price))
+        self.assertTrue(np.array_equal(board_fee, fee))
+        self.assertEqual((block, board_version), (17000000, 1))
+
+        # reads are zero-copy: fn sees the board itself, and the next write
+        self.assertEqual(reader.read('ETH/USDT', lambda p, f: float(p.max())), 1801.0)
+        self.board.write('ETH/USDT', price * 2, fee, 17000001)
+        self.assertEqual(reader.read('ETH/USDT', lambda p, f: float(p.max())), 3602.0)
+        self.assertEqual(reader.version('ETH/USDT'), 2)
+
+        # boards of symbols without swap paths are empty
+        self.assertEqual(reader.snapshot('BTC/USDT')[0].shape, (0,))
+        reader.close()
+
+    def test_stale_read(self):
+        price = np.array([1800.0, 1801.0, 1799.5, 1800.5])
+        fee = np.array([0.003, 0.0005, 0.003, 0.006])
+        self.board.write('ETH/USDT', price, fee, 17000000)
+
+        # a writer that stopped in the middle of a write: readers give up after timeout instead of raising
+        self.board.header['ETH/USDT'][0] += 1
+        s = time.monotonic()
+        self.assertIsNone(self.board.read('ETH/USDT', lambda p, f: float(p.max()), timeout=0.02))
+        self.assertEqual(self.board.read('ETH/USDT', lambda p, f: float(p.max()), timeout=0.0, stale='stale'),
+                         'stale')
+        self.assertLess(time.monotonic() - s, 1.0)
+        self.assertIsNone(self.board.snapshot('ETH/USDT'))
+
+        # the write completes
+        self.board.header['ETH/USDT'][0] += 1
+        self.assertEqual(self.board.read('ETH/USDT', lambda p, f: float(p.max())), 1801.0)
+
+    def test_read_from_another_process(self):
+        price = np.array([1800.0, 1801.0, 1799.5, 1800.5])
+        fee = np.array([0.003, 0.0005, 0.003, 0.006])
+        self.board.write('ETH/USDT', price, fee, 17000000)
+
+        queue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_read_board, args=(self.board.layout, queue))
+        p.start()
+        board_price, board_fee, block, version = queue.get(timeout=10)
+        p.join()
+
+        self.assertTrue(np.array_equal(board_price, price))
+        self.assertEqual((block, version), (17000000, 1))
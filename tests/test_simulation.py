@@ -5,7 +5,7 @@ from web3 import Web3
 from unittest import TestCase
 from eth_account.account import Account
 
-from simulation import UniswapV2Simulator, UniswapV3Simulator
+from simulation import UniswapV2Simulator, UniswapV3Simulator, UniswapV3Pool
 
 POOL_V2_ABI = json.load(open('../abi/UniswapV2Pool.json', 'r'))
 POOL_V3_ABI = json.load(open('../abi/UniswapV3Pool.json', 'r'))
@@ -147,6 +147,41 @@ class SimulationTests(TestCase):
     #
     #     self.assertEqual(usdt_balance_before + sim_amount_out, usdt_balance_after)
 
+    def test_sim_v3_quoter_parity(self):
+        """
+        Offline multi-tick swaps should return the same amounts as QuoterV2
+        Ticks are loaded from the bitmap words around the current tick
+        """
+        sqrt_price, tick, *_ = self.pool_v3.functions.slot0().call()
+        liquidity = self.pool_v3.functions.liquidity().call()
+        fee = self.pool_v3.functions.fee().call()
+        tick_spacing = self.pool_v3.functions.tickSpacing().call()
+        token0 = self.pool_v3.functions.token0().call()
+        token1 = self.pool_v3.functions.token1().call()
+
+        word = (tick // tick_spacing) >> 8
+        tick_bitmap = {}
+        ticks = {}
+
+        for w in range(word - 3, word + 4):
+            bitmap = self.pool_v3.functions.tickBitmap(w).call()
+            tick_bitmap[w] = bitmap
+            for bit in range(256):
+                if bitmap & (1 << bit):
+                    t = ((w << 8) + bit) * tick_spacing
+                    ticks[t] = self.pool_v3.functions.ticks(t).call()[1]  # liquidityNet
+
+        pool = UniswapV3Pool(sqrt_price, tick, liquidity, fee, tick_spacing, ticks, tick_bitmap)
+
+        for zero_for_one in [True, False]:
+            token_in, token_out = (token0, token1) if zero_for_one else (token1, token0)
+            for amount_in in [10 ** 6, 10 ** 12, 10 ** 18, 10 ** 21]:
+                quoter_amount_out, *_ = self.quoter2.functions.quoteExactInputSingle(
+                    (token_in, token_out, amount_in, fee, 0)
+                ).call()
+                sim_amount_out = self.sim_v3.get_amount_out(pool, amount_in, zero_for_one)
+                self.assertEqual(quoter_amount_out, sim_amount_out)
+
     def test_sim_v3_get_amount_out(self):
         """
         Currently only implements single tick swap
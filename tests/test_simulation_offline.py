@@ -0,0 +1,312 @@
+import numpy as np
+from unittest import TestCase
+from unittest.mock import patch
+from web3.exceptions import ContractLogicError
+
+import simulation.online_simulator
+from simulation import OnlineSimulator, UniswapV2Simulator, UniswapV3Simulator, UniswapV3Pool, ArbitrageOptimizer
+from simulation.uniswap_v3_math import *
+
+
+def uniswap_v2_get_amount_out(amount_in: int, reserve_in: int, reserve_out: int) -> int:
+    """
+    UniswapV2Library.getAmountOut, which is used in SimulatorV1.simulateUniswapV2SwapIn
+    """
+    amount_in_with_fee = amount_in * 997
+    numerator = amount_in_with_fee * reserve_out
+    denominator = reserve_in * 1000 + amount_in_with_fee
+    return numerator // denominator
+
+
+class FakeSimulatorV1:
+    """
+    SimulatorV1 of a build without simulateSwapInBatch: simulateSwapIn is a single Uniswap V2 swap,
+    and reverts if the amount in is 0
+    """
+
+    def __init__(self, reserve_in: int, reserve_out: int):
+        self.reserve_in = reserve_in
+        self.reserve_out = reserve_out
+        self.calls = 0
+        self.functions = self
+
+    def simulateSwapIn(self, params):
+        self.calls += 1
+        amount_in = params[0]['amount']
+        return FakeCall(lambda: uniswap_v2_get_amount_out(amount_in, self.reserve_in, self.reserve_out)
+                        if amount_in else self.revert())
+
+    def revert(self):
+        raise ContractLogicError('execution reverted')
+
+
+class FakeCall:
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def call(self):
+        return self.fn()
+
+
+class OfflineSimulationTests(TestCase):
+    """
+    Offline simulations don't need a mainnet hardfork,
+    the results are compared to the math of the contracts used in SimulatorV1
+    """
+
+    # WETH-USDT Uniswap V2 pool reserves
+    RESERVE_WETH = 16739446124543287006567
+    RESERVE_USDT = 30195815093427
+
+    def setUp(self):
+        self.sim_v2 = UniswapV2Simulator()
+        self.sim_v3 = UniswapV3Simulator()
+        self.optimizer = ArbitrageOptimizer()
+
+        """
+        Uniswap V3 pool at price 1 (tick 0) with two positions:
+        - 10 ** 21 liquidity in [-600, 600]
+        - 5 * 10 ** 20 liquidity in [-120, 120]
+        """
+        self.pool_v3 = UniswapV3Pool(sqrt_price_x96=Q96,
+                                     tick=0,
+                                     liquidity=15 * 10 ** 20,
+                                     fee=3000,
+                                     ticks={-600: 10 ** 21, -120: 5 * 10 ** 20, 120: -5 * 10 ** 20, 600: -10 ** 21})
+
+    def test_sim_v2_get_amount_out(self):
+        amounts_in = [1, 10 ** 6, 10 ** 18, 12345678901234567890123, 2 ** 100]
+
+        for amount_in in amounts_in:
+            amount_out = self.sim_v2.get_amount_out(amount_in, self.RESERVE_WETH, self.RESERVE_USDT)
+            expected = uniswap_v2_get_amount_out(amount_in, self.RESERVE_WETH, self.RESERVE_USDT)
+            self.assertEqual(amount_out, expected)
+
+        amounts_out = self.sim_v2.get_amounts_out(amounts_in, self.RESERVE_WETH, self.RESERVE_USDT)
+        expected = [uniswap_v2_get_amount_out(a, self.RESERVE_WETH, self.RESERVE_USDT) for a in amounts_in]
+        self.assertEqual(amounts_out.tolist(), expected)
+
+    def test_sim_v2_fee(self):
+        # fee // 1000 used to turn fees below 1000 into 0
+        amount_out_3000 = self.sim_v2.get_amount_out(10 ** 18, self.RESERVE_WETH, self.RESERVE_USDT, 3000)
+        amount_out_2500 = self.sim_v2.get_amount_out(10 ** 18, self.RESERVE_WETH, self.RESERVE_USDT, 2500)
+        amount_out_0 = self.sim_v2.get_amount_out(10 ** 18, self.RESERVE_WETH, self.RESERVE_USDT, 0)
+        self.assertLess(amount_out_3000, amount_out_2500)
+        self.assertLess(amount_out_2500, amount_out_0)
+
+        # get_amount_in is the inverse of get_amount_out
+        amount_in = self.sim_v2.get_amount_in(amount_out_2500, self.RESERVE_WETH, self.RESERVE_USDT, 2500)
+        self.assertGreaterEqual(self.sim_v2.get_amount_out(amount_in, self.RESERVE_WETH, self.RESERVE_USDT, 2500),
+                                amount_out_2500)
+
+    def test_sim_v2_reverts(self):
+        # zero amounts, zero reserves, uint256 overflows revert in UniswapV2Library
+        amounts_out = self.sim_v2.get_amounts_out([0, 10 ** 18, 2 ** 250],
+                                                  [self.RESERVE_WETH, 0, self.RESERVE_WETH],
+                                                  self.RESERVE_USDT)
+        self.assertEqual(amounts_out.tolist(), [0, 0, 0])
+
+    def test_sim_v2_multihop(self):
+        # USDT -> WETH -> USDT, with routes broadcast against amounts
+        amounts_in = np.array([10 ** 6, 10 ** 9, 10 ** 12], dtype=object)
+        reserves_in = [np.array([[self.RESERVE_USDT], [self.RESERVE_USDT * 2]], dtype=object), self.RESERVE_WETH]
+        reserves_out = [np.array([[self.RESERVE_WETH], [self.RESERVE_WETH]], dtype=object), self.RESERVE_USDT]
+
+        amounts_out = self.sim_v2.get_amounts_out_path(amounts_in, reserves_in, reserves_out)
+        self.assertEqual(amounts_out.shape, (2, 3))
+
+        for route in range(2):
+            for i, amount_in in enumerate(amounts_in):
+                amount = uniswap_v2_get_amount_out(amount_in, self.RESERVE_USDT * (route + 1), self.RESERVE_WETH)
+                amount = uniswap_v2_get_amount_out(amount, self.RESERVE_WETH, self.RESERVE_USDT)
+                self.assertEqual(amounts_out[route, i], amount)
+
+    def test_v3_tick_math(self):
+        self.assertEqual(get_sqrt_ratio_at_tick(MIN_TICK), MIN_SQRT_RATIO)
+        self.assertEqual(get_sqrt_ratio_at_tick(MAX_TICK), MAX_SQRT_RATIO)
+        self.assertEqual(get_sqrt_ratio_at_tick(0), Q96)
+
+        for tick in [MIN_TICK, -887220, -276327, -201365, -1, 0, 1, 60, 201362, 887271]:
+            sqrt_price = get_sqrt_ratio_at_tick(tick)
+            self.assertEqual(get_tick_at_sqrt_ratio(sqrt_price), tick)
+            self.assertEqual(get_tick_at_sqrt_ratio(get_sqrt_ratio_at_tick(tick + 1) - 1), tick)
+
+    def test_v3_swap_math(self):
+        """
+        Test vectors from Uniswap v3-core SqrtPriceMath.spec.ts, SwapMath.spec.ts
+        """
+        e18 = 10 ** 18
+        price_121_100 = 87150978765690771352898345369  # encodePriceSqrt(121, 100)
+
+        self.assertEqual(get_next_sqrt_price_from_input(Q96, e18, e18 // 10, False), price_121_100)
+        self.assertEqual(get_next_sqrt_price_from_input(Q96, e18, e18 // 10, True), 72025602285694852357767227579)
+
+        self.assertEqual(get_amount0_delta(Q96, price_121_100, e18, True), 90909090909090910)
+        self.assertEqual(get_amount0_delta(Q96, price_121_100, e18, False), 90909090909090909)
+        self.assertEqual(get_amount1_delta(Q96, price_121_100, e18, True), 100000000000000000)
+        self.assertEqual(get_amount1_delta(Q96, price_121_100, e18, False), 99999999999999999)
+
+        price_101_100 = 79623317895830914510639640423  # encodePriceSqrt(101, 100)
+
+        # exact amount in/out that gets capped at price target in one for zero
+        for amount in [e18, -e18]:
+            self.assertEqual(compute_swap_step(Q96, price_101_100, 2 * e18, amount, 600),
+                             (price_101_100, 9975124224178055, 9925619580021728, 5988667735148))
+
+        # exact amount in that is fully spent in one for zero
+        _, amount_in, amount_out, fee_amount = compute_swap_step(Q96, 250541448375047931186413801569, 2 * e18, e18, 600)
+        self.assertEqual((amount_in, amount_out, fee_amount), (999400000000000000, 666399946655997866, 600000000000000))
+
+        # amount out is capped at the desired amount out
+        self.assertEqual(compute_swap_step(417332158212080721273783715441582,
+                                           1452870262520218020823638996,
+                                           159344665391607089467575320103,
+                                           -1,
+                                           1),
+                         (417332158212080721273783715441581, 1, 1, 1))
+
+        # entire input amount taken as fee
+        self.assertEqual(compute_swap_step(2413, 79887613182836312, 1985041575832132834610021537970, 10, 1872),
+                         (2413, 0, 0, 10))
+
+    def test_v3_tick_bitmap(self):
+        """
+        Test vectors from Uniswap v3-core TickBitmap.spec.ts
+        """
+        pool = UniswapV3Pool(Q96, 0, 0, 100, ticks={t: 0 for t in [-200, -55, -4, 70, 78, 84, 139, 240, 535]})
+
+        def next_tick(tick: int, lte: bool) -> tuple:
+            return next_initialized_tick_within_one_word(pool.tick_bitmap, tick, 1, lte)
+
+        self.assertEqual(next_tick(78, False), (84, True))
+        self.assertEqual(next_tick(-55, False), (-4, True))
+        self.assertEqual(next_tick(77, False), (78, True))
+        self.assertEqual(next_tick(255, False), (511, False))
+        self.assertEqual(next_tick(383, False), (511, False))
+
+        self.assertEqual(next_tick(78, True), (78, True))
+        self.assertEqual(next_tick(79, True), (78, True))
+        self.assertEqual(next_tick(258, True), (256, False))
+        self.assertEqual(next_tick(72, True), (70, True))
+        self.assertEqual(next_tick(-257, True), (-512, False))
+        self.assertEqual(next_tick(1023, True), (768, False))
+
+    def test_v3_multi_tick_swap(self):
+        # a small swap stays within the current tick range
+        amount0, amount1, sqrt_price, tick, liquidity, crossed = self.sim_v3.swap(self.pool_v3, True, 10 ** 18)
+        self.assertEqual(amount0, 10 ** 18)
+        self.assertEqual((tick, liquidity, crossed), (-14, 15 * 10 ** 20, 0))
+
+        # the first step moves to tick 0 without any amounts, the next step targets the initialized tick -120
+        expected = compute_swap_step(Q96, get_sqrt_ratio_at_tick(-120), 15 * 10 ** 20, 10 ** 18, 3000)
+        self.assertEqual((sqrt_price, -amount1), (expected[0], expected[2]))
+
+        # a larger swap crosses tick -120, and the [-120, 120] position becomes inactive
+        amount_in = 2 * 10 ** 19
+        amount0, amount1, sqrt_price, tick, liquidity, crossed = self.sim_v3.swap(self.pool_v3, True, amount_in)
+        self.assertEqual((crossed, liquidity), (1, 10 ** 21))
+        self.assertLess(tick, -120)
+
+        amount_out = self.sim_v3.get_amount_out(self.pool_v3, amount_in, True)
+        self.assertEqual(amount_out, -amount1)
+
+        # swapping the other way crosses tick 120
+        _, _, _, tick, liquidity, crossed = self.sim_v3.swap(self.pool_v3, False, 2 * 10 ** 19)
+        self.assertEqual((crossed, liquidity), (1, 10 ** 21))
+        self.assertGreaterEqual(tick, 120)
+
+        # exact output swaps are the inverse of exact input swaps
+        amount_in_needed = self.sim_v3.get_amount_in(self.pool_v3, amount_out, True)
+        self.assertLessEqual(amount_in_needed, amount_in)
+        self.assertGreaterEqual(self.sim_v3.get_amount_out(self.pool_v3, amount_in_needed, True), amount_out)
+
+    def test_v3_out_of_liquidity(self):
+        # swapping more than the pool holds uses up all the liquidity, and returns the partial amount out
+        amount0, amount1, sqrt_price, tick, liquidity, crossed = self.sim_v3.swap(self.pool_v3, True, 10 ** 30)
+        self.assertEqual((crossed, liquidity), (2, 0))
+        self.assertEqual(sqrt_price, MIN_SQRT_RATIO + 1)
+        self.assertLess(amount0, 10 ** 30)
+
+        amount_out = self.sim_v3.get_amount_out(self.pool_v3, 10 ** 30, True)
+        self.assertEqual(amount_out, -amount1)
+
+        # QuoterV2 reverts on exact output swaps that can't be filled
+        self.assertEqual(self.sim_v3.get_amount_in(self.pool_v3, amount_out + 1, True), 0)
+
+        amounts_out = self.sim_v3.get_amounts_out(self.pool_v3, [0, 10 ** 18, 10 ** 30], True)
+        self.assertEqual(amounts_out.tolist(), [0, self.sim_v3.get_amount_out(self.pool_v3, 10 ** 18, True), amount_out])
+
+    def test_optimal_v2_amount_in(self):
+        # USDT -> WETH on a cheaper pool, WETH -> USDT on the reference pool
+        route = [
+            {'version': 2, 'reserve_in': 2000 * 10 ** 6, 'reserve_out': 10 ** 18, 'fee': 3000},
+            {'version': 2, 'reserve_in': 10 ** 18, 'reserve_out': 2200 * 10 ** 6, 'fee': 3000},
+        ]
+        amount_in = self.optimizer.optimal_v2_amount_in(route)
+
+        brute_force = max(range(1, 200 * 10 ** 6, 10 ** 4), key=lambda x: self.optimizer.get_profit(route, x))
+        self.assertGreaterEqual(self.optimizer.get_profit(route, amount_in),
+                                self.optimizer.get_profit(route, brute_force))
+        for x in [amount_in - 1, amount_in + 1]:
+            self.assertGreaterEqual(self.optimizer.get_profit(route, amount_in), self.optimizer.get_profit(route, x))
+
+        # capped by the max amount in (amounts that round to the same profit are equally optimal)
+        self.assertIn(self.optimizer.optimal_v2_amount_in(route, 10 ** 6), [10 ** 6 - 1, 10 ** 6])
+
+        # the reverse route isn't profitable
+        reverse = [
+            {'version': 2, 'reserve_in': 2200 * 10 ** 6, 'reserve_out': 10 ** 18, 'fee': 3000},
+            {'version': 2, 'reserve_in': 10 ** 18, 'reserve_out': 2000 * 10 ** 6, 'fee': 3000},
+        ]
+        self.assertEqual(self.optimizer.optimal_v2_amount_in(reverse), 0)
+
+    def test_optimal_amounts_in(self):
+        # token1 -> token0 on the V3 pool at price 1, token0 -> token1 on a V2 pool at price 1.02
+        route_v3 = [
+            {'version': 3, 'pool': self.pool_v3, 'zero_for_one': False},
+            {'version': 2, 'reserve_in': 10 ** 22, 'reserve_out': 102 * 10 ** 20, 'fee': 3000},
+        ]
+        route_v2 = [
+            {'version': 2, 'reserve_in': 10 ** 22, 'reserve_out': 102 * 10 ** 20, 'fee': 3000},
+            {'version': 2, 'reserve_in': 10 ** 22, 'reserve_out': 10 ** 22, 'fee': 3000},
+        ]
+        route_unprofitable = [
+            {'version': 3, 'pool': self.pool_v3, 'zero_for_one': True},
+            {'version': 2, 'reserve_in': 102 * 10 ** 20, 'reserve_out': 10 ** 22, 'fee': 3000},
+        ]
+        max_amount_in = 10 ** 21
+
+        amounts_in, profits = self.optimizer.optimal_amounts_in([route_v3, route_v2, route_unprofitable],
+                                                                 max_amount_in)
+
+        brute_force = max(self.optimizer.get_profit(route_v3, x) for x in range(0, max_amount_in, 10 ** 17))
+        self.assertGreater(profits[0], 0)
+        self.assertGreaterEqual(profits[0], brute_force * (1 - 1e-6))
+        self.assertEqual(profits[0], self.optimizer.get_profit(route_v3, amounts_in[0]))
+
+        self.assertEqual(amounts_in[1], self.optimizer.optimal_v2_amount_in(route_v2, max_amount_in))
+        self.assertEqual((amounts_in[2], profits[2]), (0, 0))
+
+    def test_batch_simulation_fallback(self):
+        simulator = OnlineSimulator(rpc_endpoints={'ethereum': 'http://localhost:8545'},
+                                    tokens={'ethereum': {}},
+                                    pools=[],
+                                    contracts={'ethereum': '0x' + '00' * 20},
+                                    handlers={'ethereum': {}})
+        sim = FakeSimulatorV1(self.RESERVE_USDT, self.RESERVE_WETH)
+        simulator.sim = {'ethereum': sim}
+
+        route = [{'protocol': 0, 'amount': 0}]
+        amounts_in = [0, 100 * 10 ** 6, 1000 * 10 ** 6]
+
+        with patch.object(simulation.online_simulator, 'BATCH_SIMULATION', False):
+            amounts_out = simulator.simulate_batch('ethereum', [route, []], amounts_in)
+
+        # one simulateSwapIn call per amount in of the route, reverts are 0
+        self.assertEqual(sim.calls, 3)
+        self.assertEqual(amounts_out.shape, (2, 3))
+        self.assertEqual(amounts_out[0].tolist(),
+                         [0] + [uniswap_v2_get_amount_out(a, self.RESERVE_USDT, self.RESERVE_WETH)
+                                for a in amounts_in[1:]])
+        self.assertEqual(amounts_out[1].tolist(), [0, 0, 0])
@@ -0,0 +1,84 @@
+import numpy as np
+from unittest import TestCase
+
+from strategies.spread_scanner import SpreadScanner
+
+
+class SpreadScannerTests(TestCase):
+
+    def test_spreads(self):
+        compare_paths = {
+            'UNI3ETHUSDT/UNI2ETHUSDT': (0, 1),
+            'UNI3ETHUSDT/SUS2ETHUSDT': (0, 2),
+            'UNI2ETHUSDT/SUS2ETHUSDT': (1, 2),
+        }
+        price = [1800.0, 1810.0, 1795.0]
+        fee = [0.0005, 0.003, 0.003]
+
+        scanner = SpreadScanner(compare_paths)
+        spreads, position = scanner.max_spread(price, fee)
+
+        self.assertEqual(len(scanner), 6)
+        self.assertEqual(scanner.keys[:2], ['UNI3ETHUSDT/UNI2ETHUSDT', 'UNI2ETHUSDT/UNI3ETHUSDT'])
+
+        for key, spread in zip(scanner.keys, spreads):
+            name_1, name_2 = key.split('/')
+            i = compare_paths.get(key, compare_paths.get(f'{name_2}/{name_1}'))
+            # key name_1/name_2: buy name_2, sell name_1
+            sell, buy = (i[0], i[1]) if key in compare_paths else (i[1], i[0])
+            expected = ((price[sell] / price[buy] - 1) - (fee[sell] + fee[buy])) * 100
+            self.assertAlmostEqual(spread, expected)
+
+        # buy SUS2ETHUSDT at 1795, sell UNI2ETHUSDT at 1810
+        self.assertEqual(scanner.keys[position], 'UNI2ETHUSDT/SUS2ETHUSDT')
+        self.assertEqual((scanner.buy_index[position], scanner.sell_index[position]), (2, 1))
+        self.assertEqual(position, int(np.argmax(spreads)))
+
+    def test_unpriced_paths(self):
+        compare_paths = {
+            'UNI3ETHUSDT/UNI2ETHUSDT': (0, 1),
+            'UNI3ETHUSDT/SUS2ETHUSDT': (0, 2),
+            'UNI2ETHUSDT/SUS2ETHUSDT': (1, 2),
+        }
+        fee = [0.0005, 0.003, 0.003]
+        scanner = SpreadScanner(compare_paths)
+
+        # UNI3ETHUSDT isn't priced, SUS2ETHUSDT has 0 reserves
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spreads, position = scanner.max_spread([np.nan, 1810.0, 0.0], fee)
+
+        self.assertTrue(np.all(np.isnan(spreads[:4])))
+        self.assertEqual(spreads[4], np.inf)
+        # the only finite spread: buy UNI2ETHUSDT at 1810, sell SUS2ETHUSDT at 0
+        self.assertEqual(scanner.keys[position], 'SUS2ETHUSDT/UNI2ETHUSDT')
+        self.assertAlmostEqual(spreads[position], -100.6)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spreads, position = scanner.max_spread([np.nan, np.nan, np.nan], fee)
+
+        self.assertTrue(np.all(np.isnan(spreads)))
+        self.assertIsNone(position)
+
+    def test_changed(self):
+        compare_paths = {
+            'UNI3ETHUSDT/UNI2ETHUSDT': (0, 1),
+            'UNI3ETHUSDT/SUS2ETHUSDT': (0, 2),
+            'UNI2ETHUSDT/SUS2ETHUSDT': (1, 2),
+        }
+        fee = [0.0005, 0.003, 0.003]
+        scanner = SpreadScanner(compare_paths)
+
+        # every spread on the first call
+        spreads, _ = scanner.max_spread([1800.0, 1810.0, 1795.0], fee)
+        self.assertEqual(scanner.changed(spreads), dict(zip(scanner.keys, spreads.tolist())))
+
+        # UNI2ETHUSDT re-priced: the pairs that go through it
+        spreads, _ = scanner.max_spread([1800.0, 1805.0, 1795.0], fee)
+        changed = scanner.changed(spreads)
+        self.assertEqual(sorted(changed), sorted(k for k in scanner.keys if 'UNI2ETHUSDT' in k))
+        self.assertEqual(scanner.changed(spreads), {})
+
+        # UNI3ETHUSDT isn't priced: the spreads through it can't be written
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spreads, _ = scanner.max_spread([np.nan, 1805.0, 1795.0], fee)
+        self.assertEqual(scanner.changed(spreads), {})